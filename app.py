@@ -1,18 +1,22 @@
 import os
+import json
 import logging
-import time
 import threading
-import numpy as np
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
 from utils.sos import sos
+from utils.outbox import AlertOutbox
 from utils.audio import AudioCapture
-from utils.vad import VoiceActivityDetector
 from utils.incident import IncidentRecorder
-from utils.audio_buffer import AudioBuffer
 from utils.speech_analysis import SpeechAnalyzer
+from utils.model_registry import model_registry
+from utils.metrics import metrics
+from utils.events import EventBroadcaster, format_sse
+from utils.distress import load_distress_classifier
+from utils.multistream import MultiStreamMonitor
+from utils.replay import FileAudioSource
 # --- Import the chatbot function ---
-from utils.chatbot import chat as chatbot_response
+from utils.chatbot_async import AsyncChatbot
 
 
 app = Flask(__name__,
@@ -21,135 +25,68 @@ app = Flask(__name__,
 
 app.config['UPLOAD_FOLDER'] = 'evidence/images'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max upload size
+app.config['REPLAY_FOLDER'] = 'recordings'  # audio files streams may replay
+app.config['WHISPER_MODEL'] = os.getenv('WHISPER_MODEL', 'base')
+app.config['WHISPER_QUANTIZE'] = os.getenv('WHISPER_QUANTIZE', '0') == '1'  # int8 CPU mode
 
 # --- Global State ---
-monitoring_thread = None
-stop_monitoring_event = threading.Event()
+chatbot = AsyncChatbot()  # one event loop + connection pool for every chat session
+events = EventBroadcaster()  # live monitoring events pushed to browsers (/events)
+monitor = None
+monitor_lock = threading.Lock()
 emergency_contacts = []   # contacts set dynamically from frontend
+DEFAULT_STREAM_ID = "default"
 
 # --- Setup Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
 
 
-# --- Background Monitoring Function (Full Logic from main.py) ---
-def background_monitoring_task():
-    logging.info("🛡️ VoiceGuard Background Monitoring Thread Started")
-
-    # Initialize components
-    audio_capture = AudioCapture()
-    vad_detector = VoiceActivityDetector(aggressiveness=3)
-    incident_recorder = IncidentRecorder()
-    audio_buffer = AudioBuffer(max_duration_seconds=15)
-    speech_analyzer = SpeechAnalyzer(model_size="base")
-
-    # Stats tracking
-    total_chunks = 0
-    speech_chunks = 0
-    high_threat_chunks = 0
-    consecutive_high_threats = 0
-
-    HIGH_THREAT_THRESHOLD = 1
-    COOLDOWN_TIME = 30
-    last_incident_time = 0
-
-    try:
-        audio_capture.start_recording()
-
-        print("🎯 VoiceGuard is monitoring")
-        print("   • HIGH threat incidents trigger SMS to emergency contacts")
-        print("   • Speech analysis with threat detection")
-        print("   • Audio evidence collection")
-        print("Press stop button in UI to stop")
-        print()
-
-        while not stop_monitoring_event.is_set():
-            chunk = audio_capture.get_audio_chunk()
-            if not chunk:
-                time.sleep(0.05)
-                continue
-
-            audio_data, timestamp = chunk
-            total_chunks += 1
-
-            # Add to audio buffer + VAD
-            audio_buffer.add_audio(audio_data)
-            vad_detector.add_audio(audio_data)
-
-            # Speech detection
-            if vad_detector.is_speech_detected():
-                speech_chunks += 1
-
-                # Threat level calc
-                volume = np.sqrt(np.mean(audio_data.astype(np.float32) ** 2))
-                speech_confidence = vad_detector.get_speech_confidence()
-
-                if volume > 1000 and speech_confidence > 0.7:
-                    audio_threat_level = "HIGH"
-                    threat_emoji = "🔴"
-                    consecutive_high_threats += 1
-                    high_threat_chunks += 1
-                elif volume > 1000 and speech_confidence > 0.5:
-                    audio_threat_level = "MEDIUM"
-                    threat_emoji = "🟡"
-                    consecutive_high_threats = 0
-                else:
-                    audio_threat_level = "LOW"
-                    threat_emoji = "🟢"
-                    consecutive_high_threats = 0
-
-                print(f"🗣️  SPEECH: Vol={volume:>6.0f} | Conf={speech_confidence:.2f} | {threat_emoji} {audio_threat_level}")
-
-                # Incident recording
-                current_time = time.time()
-                if (audio_threat_level == "HIGH" and
-                        consecutive_high_threats >= HIGH_THREAT_THRESHOLD and
-                        current_time - last_incident_time > COOLDOWN_TIME):
-
-                    print("🔍 Analyzing speech content...")
-                    evidence_audio = audio_buffer.get_recent_audio(duration_seconds=8)
-
-                    speech_analysis = speech_analyzer.analyze_audio_with_text(
-                        evidence_audio,
-                        sample_rate=audio_capture.sample_rate
-                    )
-
-                    incident = incident_recorder.record_incident(
-                        threat_level="HIGH",
-                        volume=volume,
-                        speech_confidence=speech_confidence,
-                        audio_data=evidence_audio,
-                        speech_analysis=speech_analysis,
-                        sample_rate=audio_capture.sample_rate
-                    )
-
-                    if incident and emergency_contacts:
-                        print("📱 Sending emergency SMS alerts...")
-                        for phone in emergency_contacts:
-                            sms_sent = sos(phone)
-                            if sms_sent:
-                                print(f"✅ SOS sent to {phone}")
-                            else:
-                                print(f"❌ Failed to send SOS to {phone}")
-
-                        last_incident_time = current_time
-                        consecutive_high_threats = 0
-                        print("=" * 60)
-
-            # Stats log
-            if total_chunks % 100 == 0 and total_chunks > 0:
-                speech_ratio = speech_chunks / total_chunks
-                threat_ratio = high_threat_chunks / speech_chunks if speech_chunks > 0 else 0
-                print(f"📊 Stats: Speech {speech_chunks}/{total_chunks} ({speech_ratio:.1%}) | "
-                      f"High threats: {high_threat_chunks} ({threat_ratio:.1%})")
-
-    except Exception as e:
-        logging.error(f"Error in monitoring thread: {e}")
-    finally:
-        audio_capture.stop_recording()
-        summary = incident_recorder.get_incident_summary()
-        print("\n🛑 VoiceGuard Stopped")
-        print(f"📊 Final Stats: {summary}")
-        logging.info("🛑 VoiceGuard Background Monitoring Thread Stopped")
+# --- Monitoring (one pipeline per stream, see utils/multistream.py) ---
+def get_monitor():
+    """Create the multi-stream monitor on first use; the Whisper model is
+    loaded once on the analysis thread and shared by every stream, and SOS
+    alerts for recorded incidents go through the durable outbox"""
+    global monitor
+    with monitor_lock:
+        if monitor is None:
+            monitor = MultiStreamMonitor(
+                lambda: SpeechAnalyzer(model_size=app.config['WHISPER_MODEL'],
+                                       quantize=app.config['WHISPER_QUANTIZE']),
+                IncidentRecorder(post_roll_seconds=10, outbox=AlertOutbox(),
+                                 alert_contacts=emergency_contacts, on_alert=publish_sms_results),
+                distress_classifier=load_distress_classifier(),
+                events=events
+            )
+        return monitor
+
+
+def publish_sms_results(incident_id, results):
+    """Outbox delivery results as a live event (numbers are masked)"""
+    events.publish("sms", incident_id=incident_id, results=[
+        {"phone": mask_phone(r["phone"]), "ok": r["ok"], "status": r["status"],
+         "attempts": r["attempts"], "error": r["error"]}
+        for r in results
+    ])
+
+
+def mask_phone(phone):
+    return "•" * max(len(phone) - 4, 0) + phone[-4:]
+
+
+def build_audio_source(options):
+    """Audio source for a stream from the request body"""
+    source_type = options.get("source", "mic")
+    if source_type == "mic":
+        return AudioCapture(input_device_index=options.get("device_index"))
+    if source_type == "file":
+        replay_folder = os.path.abspath(app.config['REPLAY_FOLDER'])
+        path = os.path.abspath(os.path.join(replay_folder, options.get("path", "")))
+        if os.path.commonpath([replay_folder, path]) != replay_folder or not os.path.exists(path):
+            raise ValueError(f"Replay file not found in {app.config['REPLAY_FOLDER']}/")
+        return FileAudioSource(path,
+                               realtime_factor=float(options.get("realtime_factor", 1.0)),
+                               loop=bool(options.get("loop", False)))
+    raise ValueError(f"Unknown source type: {source_type}")
 
 
 # --- Flask Routes ---
@@ -167,17 +104,14 @@ def set_emergency_contacts():
     global emergency_contacts
     data = request.get_json()
     emergency_contacts = data.get("contacts", [])
+    get_monitor().incident_recorder.set_alert_contacts(emergency_contacts)
     logging.info(f"Emergency contacts set: {emergency_contacts}")
     return jsonify({"status": "success", "contacts": emergency_contacts}), 200
 
 
 @app.route('/start_monitoring', methods=['POST'])
 def start_monitoring():
-    global monitoring_thread
-    if monitoring_thread is None or not monitoring_thread.is_alive():
-        stop_monitoring_event.clear()
-        monitoring_thread = threading.Thread(target=background_monitoring_task)
-        monitoring_thread.start()
+    if get_monitor().start_stream(DEFAULT_STREAM_ID, AudioCapture()):
         logging.info("Background monitoring started.")
         return jsonify({'status': 'success', 'message': 'Monitoring started.'}), 200
     return jsonify({'status': 'info', 'message': 'Monitoring already active.'}), 200
@@ -185,16 +119,139 @@ def start_monitoring():
 
 @app.route('/stop_monitoring', methods=['POST'])
 def stop_monitoring():
-    global monitoring_thread
-    if monitoring_thread and monitoring_thread.is_alive():
-        stop_monitoring_event.set()
-        monitoring_thread.join()
-        monitoring_thread = None
+    if monitor and monitor.stop_stream(DEFAULT_STREAM_ID):
         logging.info("Background monitoring stopped.")
         return jsonify({'status': 'success', 'message': 'Monitoring stopped.'}), 200
     return jsonify({'status': 'info', 'message': 'Monitoring is not active.'}), 200
 
 
+@app.route('/monitoring_stats', methods=['GET'])
+def monitoring_stats():
+    if monitor is None:
+        return jsonify({'status': 'info', 'message': 'Monitoring has not been started.',
+                        'models': model_registry.stats()}), 200
+    return jsonify({'status': 'success', 'stats': monitor.stats(), 'models': model_registry.stats()}), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """Prometheus scrape endpoint (counters and latency histograms, see utils/metrics.py)"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/stats', methods=['GET'])
+def stats_route():
+    """The same metrics as JSON (histograms as count/mean/p50/p95/p99), plus component stats"""
+    return jsonify({
+        'status': 'success',
+        'metrics': metrics.snapshot(),
+        'monitoring': monitor.stats() if monitor is not None else None,
+        'models': model_registry.stats(),
+        'chat': chatbot.stats(),
+        'events': events.stats()
+    }), 200
+
+
+@app.route('/events', methods=['GET'])
+def events_route():
+    """
+    Live monitoring events as server-sent events: stream, status, vad,
+    threat, incident_pending, incident, sms (and dropped, when this client
+    fell behind and lost events). Reconnecting clients send Last-Event-ID
+    and get the recent events they missed. ?types=threat,incident filters.
+    """
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+    types = [t for t in request.args.get('types', '').split(',') if t] or None
+    subscription = events.subscribe(types=types, last_event_id=last_event_id)
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                event = subscription.get(timeout=15)
+                if event is None:
+                    yield ": keep-alive\n\n"  # also notices clients that went away
+                    continue
+                yield format_sse(event)
+        finally:
+            subscription.close()
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+@app.route('/streams', methods=['GET'])
+def list_streams():
+    if monitor is None:
+        return jsonify({'status': 'success', 'streams': []}), 200
+    return jsonify({'status': 'success', 'streams': monitor.stream_ids()}), 200
+
+
+@app.route('/streams/<stream_id>/start', methods=['POST'])
+def start_stream(stream_id):
+    options = request.get_json(silent=True) or {}
+    try:
+        source = build_audio_source(options)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    if get_monitor().start_stream(stream_id, source):
+        logging.info(f"Stream '{stream_id}' started.")
+        return jsonify({'status': 'success', 'message': f"Stream '{stream_id}' started."}), 200
+    return jsonify({'status': 'info', 'message': f"Stream '{stream_id}' already active."}), 200
+
+
+@app.route('/streams/<stream_id>/stop', methods=['POST'])
+def stop_stream(stream_id):
+    if monitor and monitor.stop_stream(stream_id):
+        logging.info(f"Stream '{stream_id}' stopped.")
+        return jsonify({'status': 'success', 'message': f"Stream '{stream_id}' stopped."}), 200
+    return jsonify({'status': 'info', 'message': f"Stream '{stream_id}' is not active."}), 200
+
+
+@app.route('/streams/<stream_id>', methods=['GET'])
+def stream_status(stream_id):
+    stats = monitor.stream_stats(stream_id) if monitor else None
+    if stats is None:
+        return jsonify({'status': 'error', 'message': f"Unknown stream '{stream_id}'."}), 404
+    return jsonify({'status': 'success', 'stats': stats}), 200
+
+
+@app.route('/incidents', methods=['GET'])
+def list_incidents():
+    """Query recorded incidents: ?start=&end=&threat_level=&keyword=&limit=&offset="""
+    incident_recorder = get_monitor().incident_recorder
+    args = request.args
+    try:
+        limit = min(int(args.get('limit', 50)), 500)
+        offset = int(args.get('offset', 0))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'limit and offset must be integers.'}), 400
+
+    incidents = incident_recorder.query_incidents(
+        start=args.get('start'),
+        end=args.get('end'),
+        threat_level=args.get('threat_level'),
+        keyword=args.get('keyword'),
+        limit=limit,
+        offset=offset
+    )
+    counts = incident_recorder.index.counts()
+    return jsonify({
+        'status': 'success',
+        'total_incidents': sum(counts.values()),
+        'by_threat_level': counts,
+        'incidents': incidents,
+        'limit': limit,
+        'offset': offset
+    }), 200
+
+
 @app.route('/send_sms', methods=['POST'])
 def send_sms_route():
     data = request.get_json()
@@ -204,6 +261,10 @@ def send_sms_route():
 
     logging.info(f"Received request to send SOS to: {phone_number}")
     sms_sent_successfully = sos(phone_number)
+    events.publish("sms", incident_id=None, results=[
+        {"phone": mask_phone(phone_number), "ok": sms_sent_successfully,
+         "status": "sent" if sms_sent_successfully else "failed"}
+    ])
     if sms_sent_successfully:
         return jsonify({'status': 'success', 'message': f'SOS sent to {phone_number}.'}), 200
     else:
@@ -244,6 +305,17 @@ def upload_evidence():
     }), 200
 
 # --- Chatbot Route ---
+def chat_error_response(result):
+    """JSON error with the status (429/503/504) and Retry-After the chatbot asked for"""
+    response = jsonify(result)
+    response.status_code = result.get('status_code', 200)
+    if result.get('retry_after'):
+        response.headers['Retry-After'] = str(int(result['retry_after'] + 0.999))
+    return response
+
+
+# Under `uvicorn asgi:app` these two routes are served by asgi.py instead,
+# without holding a thread per session; these serve the development server.
 @app.route('/chat', methods=['POST'])
 def chat_route():
     data = request.get_json()
@@ -254,10 +326,49 @@ def chat_route():
     if not user_id or not message:
         return jsonify({'error': 'user_id and message are required.'}), 400
         
-    response = chatbot_response(user_id, message, language=language)
+    response = chatbot.submit(chatbot.chat(user_id, message, language=language)).result()
+    if 'status_code' in response:
+        return chat_error_response(response)
     return jsonify(response)
 
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream_route():
+    """Same as /chat, but streams the answer as server-sent events
+    (start, token..., done | error) so the first words show up right away"""
+    data = request.get_json()
+    user_id = data.get('user_id')
+    message = data.get('message')
+    language = data.get('language', 'auto')
+
+    if not user_id or not message:
+        return jsonify({'error': 'user_id and message are required.'}), 400
+
+    stream = chatbot.stream(user_id, message, language=language)
+    first = next(stream)
+    if first['type'] == 'error' and 'status_code' in first:
+        stream.close()
+        return chat_error_response(first)
+
+    def events():
+        try:
+            yield f"event: {first['type']}\ndata: {json.dumps(first, ensure_ascii=False)}\n\n"
+            for event in stream:
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            stream.close()  # cancels the upstream request if the client disconnected
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # stop reverse proxies from buffering the stream
+    })
+
+
 # --- Main Execution ---
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    debug = True
+    # Load Whisper in the background at boot so the first /start_monitoring
+    # is instant (with the debug reloader, only in the serving process)
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        model_registry.preload(app.config['WHISPER_MODEL'], quantize=app.config['WHISPER_QUANTIZE'])
+    app.run(host='0.0.0.0', port=5000, debug=debug)
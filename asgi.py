@@ -0,0 +1,102 @@
+"""
+ASGI entry point for VoiceGuard
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+/chat and /chat/stream are served by Starlette on the server's event loop,
+so a chat session waiting on the model (or streaming its answer) holds no
+thread: hundreds of sessions share one loop here and the AsyncChatbot loop
+upstream. Every other route is the Flask app from app.py, mounted through
+a WSGI adapter and run on its thread pool as before.
+
+`python app.py` still starts the Flask development server, with the sync
+chat routes from app.py.
+"""
+import json
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import app as flask_app
+from app import chatbot
+from utils.model_registry import model_registry
+
+
+def chat_error_response(result):
+    """JSON error with the status (429/503/504) and Retry-After the chatbot asked for"""
+    headers = {}
+    if result.get('retry_after'):
+        headers['Retry-After'] = str(int(result['retry_after'] + 0.999))
+    return JSONResponse(result, status_code=result.get('status_code', 200), headers=headers)
+
+
+async def read_chat_request(request):
+    """(user_id, message, language) from the JSON body, or an error response"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or not data.get('user_id') or not data.get('message'):
+        return None, JSONResponse({'error': 'user_id and message are required.'}, status_code=400)
+    return (data['user_id'], data['message'], data.get('language', 'auto')), None
+
+
+async def chat_route(request):
+    chat_request, error = await read_chat_request(request)
+    if error:
+        return error
+    user_id, message, language = chat_request
+
+    response = await chatbot.call(chatbot.chat(user_id, message, language=language))
+    if 'status_code' in response:
+        return chat_error_response(response)
+    return JSONResponse(response)
+
+
+async def chat_stream_route(request):
+    """Same as /chat, but streams the answer as server-sent events
+    (start, token..., done | error) so the first words show up right away"""
+    chat_request, error = await read_chat_request(request)
+    if error:
+        return error
+    user_id, message, language = chat_request
+
+    stream = chatbot.astream(user_id, message, language=language)
+    first = await stream.__anext__()
+    if first['type'] == 'error' and 'status_code' in first:
+        await stream.aclose()
+        return chat_error_response(first)
+
+    async def events():
+        try:
+            yield f"event: {first['type']}\ndata: {json.dumps(first, ensure_ascii=False)}\n\n"
+            async for event in stream:
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            await stream.aclose()  # cancels the upstream request if the client disconnected
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # stop reverse proxies from buffering the stream
+    })
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Load Whisper in the background so the first /start_monitoring is instant
+    model_registry.preload(flask_app.config['WHISPER_MODEL'], quantize=flask_app.config['WHISPER_QUANTIZE'])
+    yield
+    chatbot.stop()
+
+
+app = Starlette(
+    routes=[
+        Route('/chat', chat_route, methods=['POST']),
+        Route('/chat/stream', chat_stream_route, methods=['POST']),
+        Mount('/', WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan
+)
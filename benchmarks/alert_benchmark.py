@@ -0,0 +1,84 @@
+"""
+SOS dispatcher benchmark against a local stub SMS gateway
+
+Starts an HTTP server that imitates the SMS API (configurable latency and
+failure rate), then sends one alert to N contacts with AlertDispatcher and
+prints time-to-delivery per recipient.
+
+Usage:
+    python -m benchmarks.alert_benchmark --contacts 5 --latency 1.0 --fail-rate 0.3
+"""
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.sos import AlertDispatcher, print_alert_results
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients dropping keep-alive connections at shutdown
+
+
+def start_stub_gateway(latency=0.5, fail_rate=0.0, port=0):
+    """Stub SMS API: sleeps `latency` s, answers 503 with probability fail_rate"""
+    stats = {"requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                stats["requests"] += 1
+            time.sleep(latency)
+            status = 503 if random.random() < fail_rate else 200
+            body = b'{"result": {"error": "0", "sent": "1"}}' if status == 200 else b'{"error": "busy"}'
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = QuietHTTPServer(("127.0.0.1", port), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SOS fan-out against a stub gateway")
+    parser.add_argument("--contacts", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=1.0, help="gateway latency per request (s)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered 503")
+    parser.add_argument("--deadline", type=float, default=30.0, help="per-alert deadline (s)")
+    args = parser.parse_args()
+
+    server, stats = start_stub_gateway(args.latency, args.fail_rate)
+    url = f"http://127.0.0.1:{server.server_address[1]}/sendsms/"
+    dispatcher = AlertDispatcher(api_url=url, api_key="test", deadline_seconds=args.deadline)
+
+    contacts = [f"90000000{i:02d}" for i in range(args.contacts)]
+    started = time.perf_counter()
+    results = dispatcher.dispatch(contacts).result()
+    elapsed = time.perf_counter() - started
+
+    print()
+    print("📊 VoiceGuard SOS dispatch")
+    print("=" * 50)
+    print_alert_results(results)
+    print(f"   Delivered: {sum(r['ok'] for r in results)}/{len(results)} "
+          f"in {elapsed * 1000:.0f} ms ({stats['requests']} gateway requests)")
+    print(f"   Serial sends would take ≥ {len(contacts) * args.latency * 1000:.0f} ms")
+
+    dispatcher.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Chatbot time-to-first-token benchmark against a local fake OpenAI server
+
+Starts an OpenAI-compatible /chat/completions endpoint that "generates"
+a fixed answer token by token (configurable first-token delay and
+per-token delay), points utils.chatbot at it and compares when the user
+sees the first words with chat() (blocking) and chat_stream().
+With --concurrency it also fires that many simultaneous sessions through
+the asyncio backend (utils/chatbot_async.py) and reports latency and the
+number of threads used; add --routes asgi|flask to send them through
+POST /chat/stream on the ASGI app (asgi.py) or the Flask server instead. With --turns it holds one long conversation and
+reports prompt size, time-to-first-token and whether each request
+extended the previous prompt unchanged (prefix-stable, so a provider's
+prompt cache could reuse it). --prefill-ms-per-1k makes the fake server
+slower for longer prompts, like a real model.
+
+Usage:
+    python -m benchmarks.chat_benchmark --tokens 200 --token-delay 0.01
+    python -m benchmarks.chat_benchmark --concurrency 500 --max-concurrency 64
+    python -m benchmarks.chat_benchmark --concurrency 500 --routes asgi
+    python -m benchmarks.chat_benchmark --turns 30 --prefill-ms-per-1k 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER_WORD = "safe "
+FAKE_SERVER_THREAD = "fake-openai"
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients dropping keep-alive connections at shutdown
+
+
+class FakeOpenAIServer(QuietHTTPServer):
+    block_on_close = False
+
+    def process_request(self, request, client_address):
+        # Named handler threads, so thread counts can leave the fake model out
+        thread = threading.Thread(target=self.process_request_thread, args=(request, client_address),
+                                  name=FAKE_SERVER_THREAD, daemon=True)
+        thread.start()
+
+
+def start_fake_openai(tokens=200, first_token_delay=0.3, token_delay=0.01, port=0,
+                      prefill_ms_per_1k=0.0):
+    """Fake OpenAI-compatible server; honours "stream" in the request body.
+    stats["prompts"] keeps the messages of every request."""
+    stats = {"requests": 0, "prompts": []}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with lock:
+                stats["requests"] += 1
+                stats["prompts"].append(body.get("messages", []))
+            prompt_bytes = len(json.dumps(body.get("messages", []), ensure_ascii=False).encode())
+            time.sleep(first_token_delay + prompt_bytes / 4 / 1000 * prefill_ms_per_1k / 1000)
+
+            if not body.get("stream"):
+                time.sleep(token_delay * tokens)
+                payload = json.dumps({
+                    "id": "fake", "object": "chat.completion", "created": int(time.time()),
+                    "model": body.get("model") or "fake",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": ANSWER_WORD * tokens}}],
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def send(data):
+                frame = f"data: {data}\n\n".encode()
+                self.wfile.write(f"{len(frame):x}\r\n".encode() + frame + b"\r\n")
+                self.wfile.flush()
+
+            for i in range(tokens):
+                send(json.dumps({
+                    "id": "fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": body.get("model") or "fake",
+                    "choices": [{"index": 0, "finish_reason": None, "delta": {"content": ANSWER_WORD}}],
+                }))
+                time.sleep(token_delay)
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = FakeOpenAIServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def run_concurrent(sessions, max_concurrency):
+    """Many users chatting at once through one AsyncChatbot"""
+    import numpy as np
+    from utils.chatbot_async import AsyncChatbot
+
+    chatbot = AsyncChatbot(max_concurrency=max_concurrency, max_waiting=sessions)
+
+    async def one(i):
+        started = time.perf_counter()
+        result = await chatbot.chat(f"load_user_{i}", f"I need help ({i})")
+        return (time.perf_counter() - started) * 1000, "error" not in result
+
+    async def all_sessions():
+        return await asyncio.gather(*(one(i) for i in range(sessions)))
+
+    def client_threads():
+        # The fake server runs in this process too; leave its handler threads out
+        return sum(1 for t in threading.enumerate() if t.name != FAKE_SERVER_THREAD)
+
+    threads_before = client_threads()
+    started = time.perf_counter()
+    results = chatbot.submit(all_sessions()).result()
+    elapsed = time.perf_counter() - started
+    peak_threads = client_threads()
+    chatbot.stop()
+
+    latencies = np.array([ms for ms, ok in results])
+    ok = sum(1 for ms, ok in results if ok)
+    print(f"   Concurrent sessions:  {ok}/{sessions} answered in {elapsed:.1f}s "
+          f"(p50 {np.percentile(latencies, 50):.0f} ms, p95 {np.percentile(latencies, 95):.0f} ms)")
+    print(f"   Client threads:       {threads_before} before, {peak_threads} after "
+          f"(max {max_concurrency} upstream requests in flight)")
+
+
+def run_routes(sessions, max_concurrency, server="asgi"):
+    """
+    Many users streaming answers at once through POST /chat/stream, served by
+    asgi.py under uvicorn or by the threaded Flask server from app.py
+    """
+    import httpx
+    import numpy as np
+    import app as flask_module
+    from utils.chatbot_async import AsyncChatbot
+
+    flask_module.chatbot = AsyncChatbot(max_concurrency=max_concurrency, max_waiting=sessions,
+                                        rate_per_minute=60000, burst=sessions)
+    if server == "asgi":
+        import uvicorn
+        import asgi
+        asgi.chatbot = flask_module.chatbot
+        http_server = uvicorn.Server(uvicorn.Config(asgi.app, host="127.0.0.1", port=0, lifespan="off",
+                                                    log_level="warning", backlog=sessions * 2))
+        threading.Thread(target=http_server.run, daemon=True).start()
+        while not http_server.started:
+            time.sleep(0.01)
+        port = http_server.servers[0].sockets[0].getsockname()[1]
+    else:
+        from werkzeug.serving import make_server
+        http_server = make_server("127.0.0.1", 0, flask_module.app, threaded=True)
+        http_server.socket.listen(sessions * 2)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        port = http_server.server_port
+
+    def server_threads():
+        # The fake model server runs in this process too; leave its handler threads out
+        return sum(1 for t in threading.enumerate() if t.name != FAKE_SERVER_THREAD)
+
+    peak_threads = [server_threads()]
+    sampling = threading.Event()
+
+    def sample_threads():
+        while not sampling.wait(0.01):
+            peak_threads[0] = max(peak_threads[0], server_threads())
+
+    async def one(client, i):
+        started = time.perf_counter()
+        async with client.stream("POST", f"http://127.0.0.1:{port}/chat/stream",
+                                 json={"user_id": f"route_user_{i}", "message": f"I need help ({i})"}) as response:
+            body = "".join([chunk async for chunk in response.aiter_text()])
+        return (time.perf_counter() - started) * 1000, response.status_code == 200 and "event: done" in body
+
+    async def all_sessions():
+        limits = httpx.Limits(max_connections=sessions, max_keepalive_connections=0)
+        async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+            return await asyncio.gather(*(one(client, i) for i in range(sessions)))
+
+    threads_before = server_threads()
+    threading.Thread(target=sample_threads, daemon=True).start()
+    started = time.perf_counter()
+    results = asyncio.run(all_sessions())
+    elapsed = time.perf_counter() - started
+    sampling.set()
+    if server == "asgi":
+        http_server.should_exit = True
+    else:
+        http_server.shutdown()
+    flask_module.chatbot.stop()
+
+    latencies = np.array([ms for ms, ok in results])
+    ok = sum(1 for ms, ok in results if ok)
+    print(f"   /chat/stream ({server}):  {ok}/{sessions} answered in {elapsed:.1f}s "
+          f"(p50 {np.percentile(latencies, 50):.0f} ms, p95 {np.percentile(latencies, 95):.0f} ms)")
+    print(f"   Server threads:       {threads_before} before, {peak_threads[0] - 1} peak "
+          f"(max {max_concurrency} upstream requests in flight)")
+
+
+def run_conversation(chatbot, stats, turns):
+    """One long conversation: prompt size, TTFT and prefix stability per turn"""
+    rows = []
+    for turn in range(turns):
+        started = time.perf_counter()
+        first_token_ms = None
+        for event in chatbot.chat_stream("bench_long", f"Question {turn}: what are my rights if {turn} things happen?"):
+            if event["type"] == "token" and first_token_ms is None:
+                first_token_ms = (time.perf_counter() - started) * 1000
+            elif event["type"] == "done":
+                rows.append((turn, event["prompt_tokens"], first_token_ms))
+
+    prompts = stats["prompts"][-turns:]
+    # Stable: the previous request's messages are an exact prefix of this one
+    prefix_stable = sum(
+        1 for previous, current in zip(prompts, prompts[1:])
+        if json.dumps(current[:len(previous)]) == json.dumps(previous)
+    )
+    print(f"   Long conversation:    {turns} turns, prompt tokens "
+          f"{min(r[1] for r in rows)}..{max(r[1] for r in rows)}, "
+          f"TTFT {rows[0][2]:.0f} ms (turn 1) .. {max(r[2] for r in rows):.0f} ms (max)")
+    print(f"   Prefix-stable turns:  {prefix_stable}/{turns - 1} extended the previous prompt unchanged")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chatbot time-to-first-token, blocking vs streaming")
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--first-token-delay", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between tokens")
+    parser.add_argument("--concurrency", type=int, default=0, help="also run this many simultaneous sessions")
+    parser.add_argument("--max-concurrency", type=int, default=32, help="upstream request cap for --concurrency")
+    parser.add_argument("--routes", choices=["asgi", "flask"],
+                        help="run the --concurrency sessions through POST /chat/stream on this server")
+    parser.add_argument("--turns", type=int, default=0, help="also hold one conversation this many turns long")
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=0.0,
+                        help="extra fake-server latency per 1k prompt tokens")
+    args = parser.parse_args()
+
+    server, stats = start_fake_openai(args.tokens, args.first_token_delay, args.token_delay,
+                                      prefill_ms_per_1k=args.prefill_ms_per_1k)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ.setdefault("MODEL_ID", "fake-model")
+    from utils import chatbot  # reads the environment on import
+
+    started = time.perf_counter()
+    result = chatbot.chat("bench_blocking", "I need help (blocking)")
+    blocking_ms = (time.perf_counter() - started) * 1000
+    if "error" in result:
+        raise SystemExit(f"❌ chat() failed: {result['error']}")
+
+    started = time.perf_counter()
+    first_token_ms = None
+    done = None
+    for event in chatbot.chat_stream("bench_streaming", "I need help (streaming)"):
+        if event["type"] == "token" and first_token_ms is None:
+            first_token_ms = (time.perf_counter() - started) * 1000
+        elif event["type"] == "error":
+            raise SystemExit(f"❌ chat_stream() failed: {event['error']}")
+        elif event["type"] == "done":
+            done = event
+    streaming_ms = (time.perf_counter() - started) * 1000
+
+    print()
+    print("📊 VoiceGuard chatbot latency")
+    print("=" * 50)
+    print(f"   Blocking chat():      first words after {blocking_ms:.0f} ms")
+    print(f"   Streaming chat():     first words after {first_token_ms:.0f} ms, complete in {streaming_ms:.0f} ms")
+    print(f"   Same answer:          {done['response'] == result['response']}")
+    print(f"   History committed:    {chatbot.get_history('bench_streaming')['session_length']} messages")
+    if args.turns:
+        run_conversation(chatbot, stats, args.turns)
+    if args.concurrency and args.routes:
+        run_routes(args.concurrency, args.max_concurrency, args.routes)
+    elif args.concurrency:
+        run_concurrent(args.concurrency, args.max_concurrency)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
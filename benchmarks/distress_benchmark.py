@@ -0,0 +1,183 @@
+"""
+Train and evaluate the acoustic distress classifier (utils/distress.py)
+
+The labeled set is a directory with one sub-directory of WAV/FLAC files per
+class, e.g. neutral/, scream/, crying/, aggressive/ ("neutral" is the
+no-distress class). Files are cut into clips of --clip-seconds, the length
+DistressStage scores in the pipeline.
+
+    python -m benchmarks.distress_benchmark train path/to/labeled --out data/distress_model.npz
+    python -m benchmarks.distress_benchmark eval path/to/heldout --model data/distress_model.npz
+
+eval reports accuracy, per-class recall, microseconds per inference and,
+at the gating threshold, the share of Whisper calls avoided on neutral
+audio versus distress clips wrongly gated. --synthetic generates a toy
+tone/noise set instead of reading a corpus; it only smoke-tests the
+tooling and says nothing about real-world accuracy.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from utils.distress import (DEFAULT_MODEL_PATH, NEUTRAL_LABEL, DistressClassifier, LogMelExtractor,
+                            train_distress_model)
+from utils.replay import find_audio_files, load_audio
+
+
+def load_labeled_clips(directory, clip_seconds=1.5, sample_rate=16000):
+    """(clips, label indices, labels) from a directory of per-class folders"""
+    labels = sorted(name for name in os.listdir(directory)
+                    if os.path.isdir(os.path.join(directory, name)))
+    if NEUTRAL_LABEL not in labels:
+        print(f"⚠️  No '{NEUTRAL_LABEL}' folder: scores will be the top class probability")
+    clip_samples = int(clip_seconds * sample_rate)
+    clips, y = [], []
+    for index, label in enumerate(labels):
+        for path in find_audio_files(os.path.join(directory, label)):
+            audio = load_audio(path, sample_rate)
+            for start in range(0, max(len(audio) - clip_samples, 0) + 1, clip_samples):
+                clip = audio[start:start + clip_samples]
+                if len(clip) >= clip_samples // 2:
+                    clips.append(clip)
+                    y.append(index)
+    return clips, np.array(y), labels
+
+
+def write_synthetic_set(directory, clips_per_class=40, clip_seconds=1.5, sample_rate=16000, seed=0):
+    """Toy classes from tones and noise - for smoke-testing the tooling only"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(clip_seconds * sample_rate)) / sample_rate
+    def voice(f0, level, harmonics=6, tremolo=0.0):
+        f0 = f0 * (1 + 0.03 * np.sin(2 * np.pi * rng.uniform(2, 5) * t))
+        phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+        sig = sum(np.sin(k * phase) / k for k in range(1, harmonics + 1))
+        if tremolo:
+            sig *= 1 + tremolo * np.sin(2 * np.pi * rng.uniform(4, 7) * t)
+        return level * sig
+    makers = {
+        NEUTRAL_LABEL: lambda: voice(rng.uniform(100, 220), rng.uniform(500, 3000)) * (rng.random() < 0.7),
+        "scream": lambda: voice(rng.uniform(700, 1400), rng.uniform(6000, 12000), harmonics=3),
+        "crying": lambda: voice(rng.uniform(350, 600), rng.uniform(2000, 6000), tremolo=0.8),
+        "aggressive": lambda: voice(rng.uniform(130, 260), rng.uniform(6000, 12000), harmonics=15),
+    }
+    for label, make in makers.items():
+        os.makedirs(os.path.join(directory, label), exist_ok=True)
+        for i in range(clips_per_class):
+            audio = make() + rng.normal(0, rng.uniform(100, 600), len(t))
+            audio = np.clip(audio, -32768, 32767).astype(np.int16)
+            sf.write(os.path.join(directory, label, f"{label}_{i:03d}.wav"), audio, sample_rate,
+                     subtype="PCM_16")
+    return directory
+
+
+def evaluate(classifier, clips, y, labels, threshold=0.5, sample_rate=16000):
+    predictions, distress, inference_us = [], [], []
+    for clip in clips:
+        result = classifier.score(clip, sample_rate)
+        predictions.append(labels.index(result["label"]) if result["label"] in labels else -1)
+        distress.append(result["distress"])
+        inference_us.append(result["inference_us"])
+    predictions = np.array(predictions)
+    distress = np.array(distress)
+    gated = distress < threshold
+
+    neutral = np.array([labels[i] == NEUTRAL_LABEL for i in y])
+    report = {
+        "clips": len(clips),
+        "accuracy": round(float(np.mean(predictions == y)), 3),
+        "recall": {label: round(float(np.mean(predictions[y == i] == i)), 3)
+                   for i, label in enumerate(labels) if np.any(y == i)},
+        "inference_us": {
+            "p50": round(float(np.percentile(inference_us, 50)), 1),
+            "p95": round(float(np.percentile(inference_us, 95)), 1)
+        },
+        "threshold": threshold,
+        # Every clip here would have been a HIGH trigger going to Whisper
+        "asr_calls_avoided": int(gated.sum()),
+        "asr_calls_avoided_ratio": round(float(gated.mean()), 3),
+        "neutral_gated_ratio": round(float(gated[neutral].mean()), 3) if neutral.any() else None,
+        "distress_gated_ratio": round(float(gated[~neutral].mean()), 3) if (~neutral).any() else None,
+    }
+    return report
+
+
+def print_report(report):
+    print()
+    print("📊 VoiceGuard distress classifier")
+    print("=" * 50)
+    print(f"   Clips:            {report['clips']}")
+    print(f"   Accuracy:         {report['accuracy']:.1%}")
+    for label, recall in report["recall"].items():
+        print(f"     {label:<15} recall {recall:.1%}")
+    print(f"   Inference (us):   p50 {report['inference_us']['p50']} | p95 {report['inference_us']['p95']}")
+    print(f"   Gate at {report['threshold']}:      {report['asr_calls_avoided']} Whisper call(s) avoided "
+          f"({report['asr_calls_avoided_ratio']:.1%})")
+    if report["neutral_gated_ratio"] is not None:
+        print(f"     neutral gated   {report['neutral_gated_ratio']:.1%} (saved ASR)")
+    if report["distress_gated_ratio"] is not None:
+        print(f"     distress gated  {report['distress_gated_ratio']:.1%} (missed - keep this near 0)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train/evaluate the VoiceGuard distress classifier")
+    parser.add_argument("command", choices=["train", "eval"])
+    parser.add_argument("data", nargs="?", help="directory with one folder of audio per class")
+    parser.add_argument("--synthetic", action="store_true", help="use a generated toy set (smoke test)")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="weights file to evaluate")
+    parser.add_argument("--out", default=DEFAULT_MODEL_PATH, help="where train writes the weights")
+    parser.add_argument("--clip-seconds", type=float, default=1.5)
+    parser.add_argument("--hidden", type=int, default=32, help="hidden units (0 = logistic model)")
+    parser.add_argument("--epochs", type=int, default=400)
+    parser.add_argument("--holdout", type=float, default=0.2, help="train: fraction kept for evaluation")
+    parser.add_argument("--threshold", type=float, default=0.5, help="gating threshold on the distress score")
+    args = parser.parse_args()
+
+    data = args.data
+    if args.synthetic:
+        data = write_synthetic_set(tempfile.mkdtemp(prefix="voiceguard_distress_"),
+                                   clip_seconds=args.clip_seconds)
+    if not data:
+        parser.error("give a labeled data directory or --synthetic")
+
+    clips, y, labels = load_labeled_clips(data, args.clip_seconds)
+    if not clips:
+        parser.error(f"no audio clips found under {data}")
+    print(f"🎞️  {len(clips)} clip(s) in {len(labels)} class(es): {', '.join(labels)}")
+
+    if args.command == "train":
+        order = np.random.default_rng(0).permutation(len(clips))
+        split = int(len(order) * (1 - args.holdout))
+        train_idx, test_idx = order[:split], order[split:]
+
+        started = time.perf_counter()
+        extractor = LogMelExtractor()
+        X = np.stack([extractor.features(clips[i]) for i in train_idx])
+        classifier = train_distress_model(X, y[train_idx], labels, hidden=args.hidden, epochs=args.epochs)
+        print(f"🧠 Trained {'MLP' if args.hidden else 'logistic'} model on {len(train_idx)} clip(s) "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        classifier.save(args.out)
+        print(f"💾 Weights written to {args.out}")
+        if len(test_idx):
+            print_report(evaluate(classifier, [clips[i] for i in test_idx], y[test_idx], labels,
+                                  args.threshold))
+    else:
+        if not os.path.exists(args.model):
+            print(f"❌ No model at {args.model} - run the train command first")
+            sys.exit(1)
+        classifier = DistressClassifier.load(args.model)
+        missing = set(labels) - set(classifier.labels)
+        if missing:
+            print(f"⚠️  Model does not know class(es): {', '.join(sorted(missing))}")
+        print_report(evaluate(classifier, clips, y, classifier.labels if not missing else labels,
+                              args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Offline replay benchmark for the VoiceGuard detection pipeline
+
+Replays WAV/FLAC files through the full pipeline (buffer, VAD, threat
+scoring, incident analysis and recording) with FileAudioSource, headless
+and faster than real time, and prints a performance report:
+chunks/sec, VAD frames/sec, chunk -> decision latency percentiles, Whisper
+time per incident and peak RSS.
+
+Usage:
+    python -m benchmarks.replay_benchmark path/to/corpus [more files/dirs]
+    python -m benchmarks.replay_benchmark --synthetic 120 --no-asr
+
+Use --min-chunks-per-sec / --max-p95-ms to fail (exit 1) on regressions in CI.
+--distress-model gates Whisper with a trained distress classifier (see
+utils/distress.py) and reports what it kept out of ASR on both paths: HIGH
+chunks and background segment transcription.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from utils.audio_buffer import AudioBuffer
+from utils.distress import DistressClassifier
+from utils.incident import IncidentRecorder
+from utils.pipeline import build_monitoring_pipeline
+from utils.replay import FileAudioSource
+from utils.vad import VoiceActivityDetector
+from benchmarks.vad_benchmark import make_chunks
+
+
+class NullSpeechAnalyzer:
+    """Stands in for SpeechAnalyzer when benchmarking without ASR"""
+    def analyze_audio_with_text(self, audio_data, sample_rate=16000):
+        return {
+            "transcription": {"text": "", "language": "unknown", "error": "ASR disabled"},
+            "text_analysis": {"threat_score": 0.0, "threat_level": "NONE", "keywords_found": []},
+            "combined_analysis": {}
+        }
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentiles(values, points=(50, 95, 99)):
+    if not values:
+        return {}
+    result = np.percentile(np.asarray(values, dtype=np.float64), points)
+    return {f"p{p}": round(float(v), 2) for p, v in zip(points, result)}
+
+
+def write_synthetic_corpus(directory, seconds, sample_rate=16000):
+    """Write a synthetic speech-like WAV so the benchmark runs without a corpus"""
+    audio = np.concatenate(make_chunks(seconds, sample_rate))
+    path = os.path.join(directory, "synthetic.wav")
+    sf.write(path, audio, sample_rate, subtype="PCM_16")
+    return path
+
+
+def run_benchmark(paths, model_size=None, realtime_factor=0.0, output_dir=None, evidence_format="flac",
+                  quantize=False, incremental=True, shouting_rule=False, distress_classifier=None):
+    models = {}
+    if model_size:
+        from utils.model_registry import model_registry
+        from utils.speech_analysis import SpeechAnalyzer
+        speech_analyzer = SpeechAnalyzer(model_size=model_size, quantize=quantize)
+        models = model_registry.stats()
+    else:
+        speech_analyzer = NullSpeechAnalyzer()
+
+    output_dir = output_dir or tempfile.mkdtemp(prefix="voiceguard_bench_")
+    incident_recorder = IncidentRecorder(
+        incidents_dir=os.path.join(output_dir, "incidents"),
+        audio_dir=os.path.join(output_dir, "evidence"),
+        evidence_format=evidence_format,
+        post_roll_seconds=5
+    )
+
+    whisper_ms = []
+    def on_incident(incident, job):
+        transcription = (incident.get("speech_analysis") or {}).get("transcription", {})
+        total_ms = transcription.get("timings_ms", {}).get("total_ms")
+        if total_ms is not None:
+            whisper_ms.append(total_ms)
+
+    source = FileAudioSource(paths, realtime_factor=realtime_factor)
+    pipeline = build_monitoring_pipeline(
+        source,
+        audio_buffer=AudioBuffer(max_duration_seconds=15),
+        vad_detector=VoiceActivityDetector(aggressiveness=3),
+        speech_analyzer=speech_analyzer,
+        incident_recorder=incident_recorder,
+        on_incident=on_incident,
+        incremental=incremental,
+        distress_classifier=distress_classifier,
+        name="benchmark",
+        stats_interval=0,
+        latency_window=1_000_000
+    )
+    pipeline.get_stage("threat").verbose = False
+    pipeline.get_stage("threat").shouting_rule = shouting_rule
+
+    started = time.perf_counter()
+    pipeline.run()
+    elapsed = time.perf_counter() - started
+
+    incident_recorder.flush()
+    stats = pipeline.stats()
+    audio_seconds = source.samples_emitted / source.sample_rate
+    latencies_ms = [latency * 1000 for latency in pipeline.latencies]
+    return {
+        "files": len(source.files),
+        "audio_seconds": round(audio_seconds, 1),
+        "wall_seconds": round(elapsed, 3),
+        "realtime_speedup": round(audio_seconds / elapsed, 1) if elapsed > 0 else None,
+        "chunks": stats["total_chunks"],
+        "chunks_per_sec": round(stats["total_chunks"] / elapsed, 1) if elapsed > 0 else None,
+        "vad_frames_per_sec": round(stats["stages"]["vad"]["frames_processed"] / elapsed, 1) if elapsed > 0 else None,
+        "speech_chunks": stats["speech_chunks"],
+        "high_threat_chunks": stats["high_threat_chunks"],
+        "incidents": stats["stages"]["incident"]["completed"],
+        "latency_ms": dict(percentiles(latencies_ms), max=round(max(latencies_ms), 2) if latencies_ms else None),
+        "whisper_ms_per_incident": dict(percentiles(whisper_ms, (50, 95)), count=len(whisper_ms)),
+        "transcripts": stats["stages"]["incident"].get("transcripts"),
+        "distress": dict(stats["stages"]["distress"],
+                         segments_transcribed=stats["stages"]["vad"].get("segments_transcribed"),
+                         segments_gated=stats["stages"]["vad"].get("segments_gated"))
+                    if distress_classifier is not None else None,
+        "evidence": incident_recorder.evidence_writer.stats(),
+        "models": models,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "output_dir": output_dir,
+    }
+
+
+def print_report(report):
+    print()
+    print("📊 VoiceGuard replay benchmark")
+    print("=" * 50)
+    print(f"   Audio:          {report['audio_seconds']}s in {report['files']} file(s), "
+          f"replayed in {report['wall_seconds']}s ({report['realtime_speedup']}x real time)")
+    print(f"   Chunks/sec:     {report['chunks_per_sec']}")
+    print(f"   VAD frames/sec: {report['vad_frames_per_sec']}")
+    print(f"   Latency (ms):   {report['latency_ms']}")
+    print(f"   Speech chunks:  {report['speech_chunks']} | High threat: {report['high_threat_chunks']} | "
+          f"Incidents: {report['incidents']}")
+    print(f"   Whisper (ms):   {report['whisper_ms_per_incident']}")
+    if report["transcripts"]:
+        transcripts = report["transcripts"]
+        print(f"   Incremental:    {transcripts['transcribed']} segment(s) transcribed in the background, "
+              f"{transcripts['cached_seconds']}s of incident windows cached, "
+              f"{transcripts['tail_seconds']}s transcribed at incident time")
+    if report["distress"]:
+        distress = report["distress"]
+        print(f"   Distress gate:  {distress['gated']} of {distress['scored']} scored HIGH chunk(s) gated")
+        if distress["segments_gated"] is not None:
+            print(f"                   {distress['segments_gated']} of "
+                  f"{distress['segments_gated'] + distress['segments_transcribed']} speech segment(s) "
+                  f"kept out of background transcription")
+    for name, model in report["models"].items():
+        print(f"   Model {name}: load {model['load_seconds']}s, warmup {model['warmup_seconds']}s, "
+              f"{model['weights_mb']} MB weights, +{model['rss_delta_mb']} MB RSS")
+    print(f"   Evidence:       {report['evidence']['files_written']} file(s), "
+          f"{report['evidence']['bytes_written'] / 1024:.0f} KB ({report['evidence']['format']})")
+    print(f"   Peak RSS:       {report['peak_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay audio files through the VoiceGuard pipeline")
+    parser.add_argument("paths", nargs="*", help="audio files or directories (WAV/FLAC)")
+    parser.add_argument("--synthetic", type=float, metavar="SECONDS",
+                        help="benchmark a generated clip of this length instead of a corpus")
+    parser.add_argument("--model", default="base", help="Whisper model size (default: base)")
+    parser.add_argument("--no-asr", action="store_true", help="skip Whisper, benchmark the audio path only")
+    parser.add_argument("--quantize", action="store_true", help="use the int8 dynamically quantized CPU model")
+    parser.add_argument("--no-incremental", action="store_true",
+                        help="transcribe whole evidence windows at incident time (no segment cache)")
+    parser.add_argument("--realtime-factor", type=float, default=0.0,
+                        help="0 = as fast as possible (default), 1 = real time")
+    parser.add_argument("--evidence-format", default="flac", choices=["wav", "flac", "opus"])
+    parser.add_argument("--shouting-rule", action="store_true",
+                        help="enable the experimental pitch-based shouting rule (see ThreatStage)")
+    parser.add_argument("--distress-model", metavar="FILE",
+                        help="gate Whisper with this distress classifier (see utils/distress.py)")
+    parser.add_argument("--json", metavar="FILE", help="also write the report as JSON")
+    parser.add_argument("--min-chunks-per-sec", type=float, help="fail if throughput drops below this")
+    parser.add_argument("--max-p95-ms", type=float, help="fail if p95 chunk latency exceeds this")
+    args = parser.parse_args()
+
+    output_dir = tempfile.mkdtemp(prefix="voiceguard_bench_")
+    paths = list(args.paths)
+    if args.synthetic:
+        paths.append(write_synthetic_corpus(output_dir, args.synthetic))
+    if not paths:
+        parser.error("give audio paths or --synthetic SECONDS")
+
+    report = run_benchmark(paths, model_size=None if args.no_asr else args.model,
+                           realtime_factor=args.realtime_factor, output_dir=output_dir,
+                           evidence_format=args.evidence_format, quantize=args.quantize,
+                           incremental=not args.no_incremental, shouting_rule=args.shouting_rule,
+                           distress_classifier=DistressClassifier.load(args.distress_model)
+                           if args.distress_model else None)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if args.min_chunks_per_sec and report["chunks_per_sec"] < args.min_chunks_per_sec:
+        failures.append(f"chunks/sec {report['chunks_per_sec']} < {args.min_chunks_per_sec}")
+    if args.max_p95_ms and report["latency_ms"].get("p95", 0) > args.max_p95_ms:
+        failures.append(f"p95 latency {report['latency_ms']['p95']} ms > {args.max_p95_ms} ms")
+    for failure in failures:
+        print(f"❌ Regression: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
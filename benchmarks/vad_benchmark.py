@@ -0,0 +1,91 @@
+"""
+VAD throughput benchmark for VoiceGuard
+
+Feeds synthetic 1024-sample chunks through the per-sample deque VAD that
+VoiceGuard used to ship and through the current staging-array
+VoiceActivityDetector, and reports frames/sec for each.
+
+Usage: python -m benchmarks.vad_benchmark [--seconds 120]
+"""
+import argparse
+import time
+import numpy as np
+from collections import deque
+
+import webrtcvad
+
+from utils.vad import VoiceActivityDetector
+
+
+class LegacyVoiceActivityDetector:
+    """The original deque-based VAD, kept here as the benchmark baseline"""
+    def __init__(self, sample_rate=16000, aggressiveness=3):
+        self.sample_rate = sample_rate
+        self.frame_size = int(sample_rate * 30 / 1000)
+        self.vad = webrtcvad.Vad(aggressiveness)
+        self.audio_buffer = deque()
+        self.speech_frames = deque(maxlen=20)
+        self.frames_processed = 0
+
+    def add_audio(self, audio_data):
+        self.audio_buffer.extend(audio_data)
+
+    def is_speech_detected(self):
+        speech_detected = False
+        while len(self.audio_buffer) >= self.frame_size:
+            frame = np.array([self.audio_buffer.popleft() for _ in range(self.frame_size)])
+            is_speech = self.vad.is_speech(frame.tobytes(), self.sample_rate)
+            self.speech_frames.append(is_speech)
+            self.frames_processed += 1
+            speech_detected = speech_detected or is_speech
+        return speech_detected
+
+
+def make_chunks(seconds, sample_rate=16000, chunk_size=1024, seed=0):
+    """Noise with periodic voiced bursts, split into capture-sized chunks"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sample_rate)
+    t = np.arange(n) / sample_rate
+    audio = rng.normal(0, 300, n)
+    voiced = (t % 2.0) < 0.8
+    audio += voiced * 4000 * np.sin(2 * np.pi * 220 * t) * (1 + 0.5 * np.sin(2 * np.pi * 3 * t))
+    audio = np.clip(audio, -32768, 32767).astype(np.int16)
+    return [audio[i:i + chunk_size] for i in range(0, n - chunk_size + 1, chunk_size)]
+
+
+def run(detector, chunks):
+    start = time.perf_counter()
+    speech_chunks = 0
+    for chunk in chunks:
+        detector.add_audio(chunk)
+        if detector.is_speech_detected():
+            speech_chunks += 1
+    elapsed = time.perf_counter() - start
+    return {
+        "frames": detector.frames_processed,
+        "seconds": elapsed,
+        "frames_per_sec": detector.frames_processed / elapsed,
+        "speech_chunks": speech_chunks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=120, help="seconds of audio to process")
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.seconds)
+    print(f"📊 VAD benchmark: {args.seconds:.0f}s of audio, {len(chunks)} chunks")
+
+    legacy = run(LegacyVoiceActivityDetector(), chunks)
+    current = run(VoiceActivityDetector(), chunks)
+
+    for name, result in (("deque (before)", legacy), ("staging (after)", current)):
+        print(f"   {name:<16} {result['frames_per_sec']:>10,.0f} frames/sec "
+              f"({result['frames']} frames in {result['seconds'] * 1000:.1f} ms, "
+              f"speech chunks: {result['speech_chunks']})")
+    print(f"   Speedup: {current['frames_per_sec'] / legacy['frames_per_sec']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
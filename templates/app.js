@@ -1,10 +1,62 @@
 // VoiceGuard Application JavaScript
+
+// Live monitoring events pushed by the server over server-sent events (/events)
+class MonitoringEvents {
+    static TYPES = ['stream', 'status', 'vad', 'threat', 'incident_pending', 'incident', 'sms', 'dropped'];
+
+    constructor(url = '/events') {
+        this.url = url;
+        this.handlers = {};
+        this.source = null;
+    }
+
+    on(type, handler) {
+        (this.handlers[type] ||= []).push(handler);
+        return this;
+    }
+
+    emit(type, data) {
+        (this.handlers[type] || []).forEach(handler => handler(data));
+        // Other scripts on the page can listen for 'voiceguard:<type>' too
+        window.dispatchEvent(new CustomEvent(`voiceguard:${type}`, { detail: data }));
+    }
+
+    connect() {
+        if (!window.EventSource || this.source) return this;
+        // EventSource reconnects by itself and resumes from the last event id
+        this.source = new EventSource(this.url);
+        MonitoringEvents.TYPES.forEach(type => {
+            this.source.addEventListener(type, (e) => {
+                let data;
+                try {
+                    data = JSON.parse(e.data);
+                } catch (error) {
+                    return;
+                }
+                this.emit(type, data);
+            });
+        });
+        this.source.onerror = () => this.emit('error', {});
+        return this;
+    }
+
+    close() {
+        if (this.source) {
+            this.source.close();
+            this.source = null;
+        }
+    }
+}
+
 class VoiceGuardApp {
     constructor() {
         this.currentMode = localStorage.getItem('voiceguard-mode') || 'impact';
         this.currentLang = localStorage.getItem('voiceguard-lang') || 'en';
         // --- Chatbot User ID ---
         this.chatbotUserId = this.getChatbotUserId();
+        // --- Live monitoring state per stream (from /events) ---
+        this.liveStreams = {};
+        this.liveNotice = null;
         
         this.initializeApp();
         this.setupEventListeners();
@@ -113,7 +165,11 @@ class VoiceGuardApp {
             stealth_tip4: "Create code words with trusted friends",
             chatbot_title: "Asha",
             chatbot_greeting: "Hello! I'm Asha, your support assistant. How can I help you today?",
-            chatbot_placeholder: "Type a message..."
+            chatbot_placeholder: "Type a message...",
+            live_label: "Live",
+            live_quiet: "quiet",
+            live_incident: "Incident recorded",
+            live_sms_sent: "SOS alert delivered"
         },
         hi: {
             warning_title: "सामग्री चेतावनी",
@@ -572,6 +628,60 @@ class VoiceGuardApp {
         
         // --- Load Chat History ---
         this.loadChatHistory();
+
+        // --- Live monitoring events ---
+        this.connectMonitoringEvents();
+    }
+
+    connectMonitoringEvents() {
+        if (!document.getElementById('live-status')) return;
+        this.monitoringEvents = new MonitoringEvents()
+            .on('stream', data => this.updateLiveStream(data.stream_id, { running: data.running }))
+            .on('status', data => this.updateLiveStream(data.stream_id, {
+                running: data.running, threatLevel: data.threat_level
+            }))
+            .on('threat', data => this.updateLiveStream(data.stream_id, { threatLevel: data.threat_level }))
+            .on('incident', () => this.flashLiveStatus('live_incident'))
+            .on('sms', data => {
+                if (data.results.some(result => result.ok)) this.flashLiveStatus('live_sms_sent');
+            })
+            .connect();
+    }
+
+    updateLiveStream(streamId, state) {
+        const stream = this.liveStreams[streamId] = { ...this.liveStreams[streamId], ...state };
+        if (stream.running === false) delete this.liveStreams[streamId];
+        this.renderLiveStatus();
+    }
+
+    renderLiveStatus() {
+        const badge = document.getElementById('live-status');
+        const streams = Object.values(this.liveStreams);
+        badge.hidden = streams.length === 0;
+        if (badge.hidden) return;
+
+        // Show the most severe level across streams
+        const order = ['NONE', 'LOW', 'MEDIUM', 'HIGH'];
+        const level = streams
+            .map(stream => stream.threatLevel || 'NONE')
+            .reduce((worst, current) => order.indexOf(current) > order.indexOf(worst) ? current : worst, 'NONE');
+        badge.dataset.threat = level;
+        document.getElementById('live-status-text').textContent = this.liveNotice ||
+            `${this.translate('live_label')} · ${level === 'NONE' ? this.translate('live_quiet') : level}`;
+    }
+
+    flashLiveStatus(key) {
+        this.liveNotice = this.translate(key);
+        this.renderLiveStatus();
+        clearTimeout(this.liveNoticeTimer);
+        this.liveNoticeTimer = setTimeout(() => {
+            this.liveNotice = null;
+            this.renderLiveStatus();
+        }, 5000);
+    }
+
+    translate(key) {
+        return this.i18n[this.currentLang]?.[key] || this.i18n.en[key];
     }
 
     setupEventListeners() {
@@ -739,6 +849,7 @@ class VoiceGuardApp {
     quickExit() {
         // This function redirects the user to a neutral website, replacing the current page in history.
         // It's a safety feature to prevent an abuser from seeing the site in the browser history.
+        if (this.monitoringEvents) this.monitoringEvents.close();
         window.location.replace('https://www.google.com/search?q=weather');
     }
 
@@ -933,8 +1044,15 @@ DISCLAIMER: This is an auto-generated template. Please consult with a lawyer or
         input.value = '';
         input.disabled = true;
 
+        // The answer is streamed into this bubble as it is generated
+        const chatBody = document.getElementById('chatbot-body');
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'chatbot-message bot';
+        chatBody.appendChild(messageDiv);
+        let answer = '';
+
         try {
-            const response = await fetch('/chat', {
+            const response = await fetch('/chat/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -945,23 +1063,52 @@ DISCLAIMER: This is an auto-generated template. Please consult with a lawyer or
                     language: this.currentLang,
                 }),
             });
+            if (!response.ok || !response.body) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let done = false;
+            let failed = false;
 
-            const data = await response.json();
+            while (!done) {
+                const chunk = await reader.read();
+                done = chunk.done;
+                buffer += decoder.decode(chunk.value || new Uint8Array(), { stream: !done });
+
+                // Server-sent events are separated by a blank line
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const frame = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    const dataLine = frame.split('\n').find(line => line.startsWith('data: '));
+                    if (!dataLine) continue;
+
+                    const event = JSON.parse(dataLine.slice(6));
+                    if (event.type === 'token') {
+                        answer += event.content;
+                        messageDiv.innerHTML = this.markdownToHtml(answer);
+                        chatBody.scrollTop = chatBody.scrollHeight;
+                    } else if (event.type === 'done') {
+                        answer = event.response;
+                    } else if (event.type === 'error') {
+                        failed = true;
+                    }
+                }
+            }
 
-            if (data.response) {
-                this.addChatMessage(data.response, 'bot');
-                this.saveMessageToHistory(data.response, 'bot');
-            } else {
-                const errorMessage = 'Sorry, something went wrong.';
-                this.addChatMessage(errorMessage, 'bot');
-                this.saveMessageToHistory(errorMessage, 'bot');
+            if (failed || !answer) {
+                answer = 'Sorry, something went wrong.';
             }
         } catch (error) {
             console.error('Chatbot error:', error);
-            const errorMessage = 'Sorry, I cannot connect to the server right now.';
-            this.addChatMessage(errorMessage, 'bot');
-            this.saveMessageToHistory(errorMessage, 'bot');
+            answer = 'Sorry, I cannot connect to the server right now.';
         } finally {
+            messageDiv.innerHTML = this.markdownToHtml(answer);
+            chatBody.scrollTop = chatBody.scrollHeight;
+            this.saveMessageToHistory(answer, 'bot');
             input.disabled = false;
             input.focus();
         }
@@ -0,0 +1,419 @@
+"""
+Background speech analysis for VoiceGuard
+
+Whisper takes seconds on CPU, so incident analysis runs on a dedicated
+worker thread fed through a small bounded job queue. The monitoring loop
+only submits jobs and keeps draining capture + VAD in real time.
+
+Overload policy: when a stream already has max_pending jobs waiting, its
+new job is coalesced into that stream's newest pending job instead of
+being dropped. The two evidence windows are merged by absolute sample
+offset (capped at max_window_seconds, newest audio wins), a single
+incident is recorded, and every caller's future resolves to that incident.
+
+One worker can serve many streams: with batch_size > 1 it takes up to that
+many pending jobs at once and transcribes them in a single padded Whisper
+call (SpeechAnalyzer.analyze_audio_batch).
+
+With incremental=True the worker also transcribes speech segments in the
+background while it has no incident to analyze (see utils/transcript_cache.py),
+one segment per Whisper call so incidents are never stuck behind a batch.
+Incident jobs always go first; at incident time only the part of the
+window not covered by cached segments is transcribed.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from utils.metrics import QUEUE_BUCKETS, Trace, metrics
+from utils.transcript_cache import TranscriptCache
+
+WHISPER_MS = metrics.histogram("voiceguard_whisper_ms",
+                               "Speech analysis (Whisper + text analysis) per call (ms)", ("mode",))
+ANALYSIS_QUEUE = metrics.histogram("voiceguard_analysis_queue_depth",
+                                   "Incident jobs already waiting when a new one is submitted",
+                                   buckets=QUEUE_BUCKETS)
+ANALYSIS_JOBS = metrics.counter("voiceguard_analysis_jobs_total", "Incident analysis jobs", ("outcome",))
+
+
+class AnalysisJob:
+    def __init__(self, audio_data, start_offset, sample_rate=16000, volume=0.0,
+                 speech_confidence=0.0, threat_level="HIGH", timestamp=None, stream_id=None,
+                 acoustic_features=None, priority=0.0):
+        """
+        audio_data: int16 evidence window
+        start_offset: absolute sample offset of audio_data[0] (see AudioBuffer)
+        stream_id: name of the monitored stream the audio came from
+        acoustic_features: feature summary of the trigger (see utils/features.py)
+        priority: higher is analyzed first (e.g. the acoustic distress score)
+        """
+        self.priority = priority
+        self.stream_id = stream_id
+        self.acoustic_features = acoustic_features
+        self.audio_data = audio_data
+        self.start_offset = start_offset
+        self.sample_rate = sample_rate
+        self.volume = volume
+        self.speech_confidence = speech_confidence
+        self.threat_level = threat_level
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.submitted_at = time.time()
+        self.futures = [Future()]
+        self.coalesced = 1
+        # Spans from the trigger chunk's capture time, stored with the incident
+        self.trace = Trace(self.timestamp)
+        self.trace.add("trigger", self.timestamp, self.submitted_at)
+
+    @property
+    def future(self):
+        return self.futures[0]
+
+    @property
+    def end_offset(self):
+        return self.start_offset + len(self.audio_data)
+
+    def merge(self, other, max_samples):
+        """Fold a newer job into this one, keeping at most max_samples of audio"""
+        if other.end_offset > self.end_offset:
+            if other.start_offset <= self.end_offset:
+                # Overlapping windows: append only the new tail
+                tail = other.audio_data[self.end_offset - other.start_offset:]
+                self.audio_data = np.concatenate((self.audio_data, tail))
+            else:
+                # Disjoint windows: keep the newer one
+                self.audio_data = other.audio_data
+                self.start_offset = other.start_offset
+
+        excess = len(self.audio_data) - max_samples
+        if excess > 0:
+            self.audio_data = self.audio_data[excess:]
+            self.start_offset += excess
+
+        self.volume = max(self.volume, other.volume)
+        self.speech_confidence = max(self.speech_confidence, other.speech_confidence)
+        self.timestamp = other.timestamp
+        self.acoustic_features = other.acoustic_features or self.acoustic_features
+        self.priority = max(self.priority, other.priority)
+        self.futures.extend(other.futures)
+        self.coalesced += other.coalesced
+
+
+class AnalysisWorker:
+    def __init__(self, speech_analyzer, incident_recorder, max_pending=2,
+                 max_window_seconds=30, on_incident=None, batch_size=1, incremental=False,
+                 max_pending_segments=32):
+        """
+        speech_analyzer: SpeechAnalyzer used for transcription + text analysis,
+                         or a zero-argument factory that builds one on the
+                         worker thread (so slow model loads never block callers)
+        incident_recorder: IncidentRecorder that stores the results
+        max_pending: jobs per stream allowed to wait while others are analyzed
+        on_incident: optional callback(incident, job) run after recording
+        batch_size: most incident jobs transcribed together in one Whisper call
+        incremental: transcribe speech segments in the background and reuse
+                     them at incident time (needs SpeechAnalyzer support)
+        max_pending_segments: segments waiting for transcription; the oldest
+                              is skipped when more arrive
+        """
+        self.speech_analyzer = speech_analyzer
+        self.batch_size = max(1, batch_size)
+        self.incident_recorder = incident_recorder
+        self.max_pending = max(1, max_pending)
+        self.max_window_seconds = max_window_seconds
+        self.on_incident = on_incident
+        self.incremental = incremental
+        self.transcript_cache = TranscriptCache() if incremental else None
+
+        self.pending = deque()
+        self.pending_segments = deque()
+        self.max_pending_segments = max_pending_segments
+        self.condition = threading.Condition()
+        self.is_running = False
+        self.busy = False
+        self.thread = None
+        self.error = None  # set when the speech analyzer could not be built
+
+        self.jobs_submitted = 0
+        self.jobs_completed = 0
+        self.jobs_coalesced = 0
+        self.jobs_failed = 0
+        self.batches = 0
+
+    def start(self):
+        """Start the worker thread"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="analysis-worker")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """Stop after the pending jobs have been processed"""
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def submit(self, job):
+        """Queue a job; returns a Future that resolves to the recorded incident"""
+        with self.condition:
+            self.jobs_submitted += 1
+            if self.error is not None:
+                # The worker is gone; fail fast instead of queueing forever
+                self.jobs_failed += 1
+                ANALYSIS_JOBS.labels("failed").inc()
+                job.future.set_exception(self.error)
+                return job.future
+            ANALYSIS_QUEUE.observe(len(self.pending))
+            same_stream = [pending for pending in self.pending if pending.stream_id == job.stream_id]
+            if len(same_stream) >= self.max_pending:
+                max_samples = int(self.max_window_seconds * job.sample_rate)
+                same_stream[-1].merge(job, max_samples)
+                self.jobs_coalesced += 1
+                ANALYSIS_JOBS.labels("coalesced").inc()
+                print(f"⚠️  Analysis backlog full - coalesced into pending job "
+                      f"({same_stream[-1].coalesced} triggers)")
+            else:
+                self.pending.append(job)
+            self.condition.notify()
+        return job.future
+
+    def submit_segment(self, segment):
+        """Queue a speech segment for background transcription"""
+        if not self.incremental or not self.is_running:
+            return
+        self.transcript_cache.add(segment)
+        with self.condition:
+            self.pending_segments.append(segment)
+            if len(self.pending_segments) > self.max_pending_segments:
+                self.transcript_cache.skip(self.pending_segments.popleft())
+            self.condition.notify()
+
+    def skip_segment(self, segment):
+        """
+        Record a speech segment that will not be transcribed in the
+        background; it stays in the cache so assembly stops there and an
+        incident transcribes it with the tail
+        """
+        if not self.incremental or not self.is_running:
+            return
+        self.transcript_cache.add(segment)
+        self.transcript_cache.skip(segment)
+
+    def stats(self):
+        with self.condition:
+            stats = {
+                "pending": len(self.pending),
+                "busy": self.busy,
+                "submitted": self.jobs_submitted,
+                "completed": self.jobs_completed,
+                "coalesced": self.jobs_coalesced,
+                "failed": self.jobs_failed,
+                "batches": self.batches,
+                "error": str(self.error) if self.error is not None else None,
+            }
+            if self.incremental:
+                stats["pending_segments"] = len(self.pending_segments)
+                stats["transcripts"] = self.transcript_cache.stats()
+            return stats
+
+    def _run(self):
+        if not hasattr(self.speech_analyzer, "analyze_audio_with_text"):
+            # Factory: load the model here rather than on the caller's thread
+            try:
+                self.speech_analyzer = self.speech_analyzer()
+            except Exception as e:
+                print(f"❌ Could not load speech analyzer: {e}")
+                self._fail_pending(e)
+                return
+        if self.incremental and not hasattr(self.speech_analyzer, "analyze_incremental_batch"):
+            print("⚠️  Speech analyzer cannot transcribe incrementally - using full windows")
+            self.incremental = False
+
+        while True:
+            segments = None
+            with self.condition:
+                while self.is_running and not self.pending and not self.pending_segments:
+                    self.condition.wait()
+                if self.pending:
+                    if len(self.pending) > self.batch_size:
+                        # Most urgent first (stable: FIFO among equal priorities)
+                        self.pending = deque(sorted(self.pending, key=lambda job: -job.priority))
+                    batch = [self.pending.popleft()
+                             for _ in range(min(self.batch_size, len(self.pending)))]
+                    self.busy = True
+                elif self.is_running:
+                    # Idle: get ahead on speech that may become evidence. One
+                    # segment at a time, so an incident arriving now waits
+                    # behind at most one short decode
+                    segments = [self.pending_segments.popleft()]
+                else:
+                    for segment in self.pending_segments:
+                        self.transcript_cache.skip(segment)
+                    self.pending_segments.clear()
+                    return
+
+            if segments is not None:
+                self._transcribe_segments(segments)
+                continue
+
+            try:
+                incidents = self._process(batch)
+                with self.condition:
+                    self.jobs_completed += len(batch)
+                for job, incident in zip(batch, incidents):
+                    for future in job.futures:
+                        future.set_result(incident)
+            except Exception as e:
+                print(f"❌ Analysis job failed: {e}")
+                with self.condition:
+                    self.jobs_failed += len(batch)
+                ANALYSIS_JOBS.labels("failed").inc(len(batch))
+                for job in batch:
+                    for future in job.futures:
+                        if not future.done():
+                            future.set_exception(e)
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.batches += 1
+
+    def _fail_pending(self, error):
+        """Stop the worker and fail every queued job with error"""
+        with self.condition:
+            self.error = error
+            self.is_running = False
+            batch = list(self.pending)
+            self.pending.clear()
+            self.jobs_failed += len(batch)
+            if self.transcript_cache is not None:
+                for segment in self.pending_segments:
+                    self.transcript_cache.skip(segment)
+            self.pending_segments.clear()
+        ANALYSIS_JOBS.labels("failed").inc(len(batch))
+        for job in batch:
+            for future in job.futures:
+                if not future.done():
+                    future.set_exception(error)
+
+    def _transcribe_segments(self, segments):
+        """Background transcription of queued speech segments"""
+        if not self.incremental:
+            for segment in segments:
+                self.transcript_cache.skip(segment)
+            return
+        started = time.perf_counter()
+        try:
+            # Segments share the stream sample rate in practice
+            transcriptions = self.speech_analyzer.transcribe_batch(
+                [segment.audio_data for segment in segments],
+                sample_rate=segments[0].sample_rate
+            )
+            WHISPER_MS.labels("segment").observe((time.perf_counter() - started) * 1000)
+        except Exception as e:
+            print(f"⚠️  Segment transcription failed: {e}")
+            transcriptions = [{"text": "", "error": str(e)}] * len(segments)
+        for segment, transcription in zip(segments, transcriptions):
+            text = transcription.get("text", "")
+            self.transcript_cache.complete(
+                segment,
+                text=text,
+                language=transcription.get("language", "unknown"),
+                keyword_hits=self.speech_analyzer.analyze_text_threats(text)["keyword_hits"] if text else [],
+                transcribe_ms=transcription.get("timings_ms", {}).get("total_ms"),
+                error=transcription.get("error")
+            )
+
+    def _skip_superseded(self, stream_id, start_offset, end_offset):
+        """Drop queued segments inside a window that is being transcribed anyway"""
+        with self.condition:
+            superseded = [segment for segment in self.pending_segments
+                          if segment.stream_id == stream_id and segment.start_offset >= start_offset
+                          and segment.end_offset <= end_offset]
+            for segment in superseded:
+                self.pending_segments.remove(segment)
+                self.transcript_cache.skip(segment)
+
+    def _process_incremental(self, batch):
+        """Cached segment transcripts + one (batched) Whisper call over the tails"""
+        covered, tails = [], []
+        for job in batch:
+            segments, tail_offset = self.transcript_cache.assemble(job.stream_id, job.start_offset,
+                                                                   job.end_offset)
+            self._skip_superseded(job.stream_id, tail_offset, job.end_offset)
+            covered.append(segments)
+            tails.append(job.audio_data[tail_offset - job.start_offset:])
+            self.transcript_cache.record_tail(len(tails[-1]) / job.sample_rate)
+
+        analyses = [None] * len(batch)
+        by_rate = {}
+        for i, job in enumerate(batch):
+            by_rate.setdefault(job.sample_rate, []).append(i)
+        for sample_rate, indices in by_rate.items():
+            results = self.speech_analyzer.analyze_incremental_batch(
+                [covered[i] for i in indices],
+                [tails[i] for i in indices],
+                sample_rate=sample_rate
+            )
+            for i, analysis in zip(indices, results):
+                analyses[i] = analysis
+        return analyses
+
+    def _process(self, batch):
+        analysis_started = time.time()
+        queued_for = analysis_started - min(job.submitted_at for job in batch)
+        print(f"🔍 Analyzing speech content... ({len(batch)} job(s), queued {queued_for:.1f}s)")
+
+        if self.incremental:
+            mode = "incremental"
+            analyses = self._process_incremental(batch)
+        elif len(batch) > 1 and hasattr(self.speech_analyzer, "analyze_audio_batch"):
+            # Streams share the sample rate in practice; group just in case
+            analyses = [None] * len(batch)
+            by_rate = {}
+            for i, job in enumerate(batch):
+                by_rate.setdefault(job.sample_rate, []).append(i)
+            mode = "batch"
+            for sample_rate, indices in by_rate.items():
+                results = self.speech_analyzer.analyze_audio_batch(
+                    [batch[i].audio_data for i in indices],
+                    sample_rate=sample_rate
+                )
+                for i, analysis in zip(indices, results):
+                    analyses[i] = analysis
+        else:
+            mode = "full"
+            analyses = [self.speech_analyzer.analyze_audio_with_text(job.audio_data, sample_rate=job.sample_rate)
+                        for job in batch]
+        analysis_finished = time.time()
+        WHISPER_MS.labels(mode).observe((analysis_finished - analysis_started) * 1000)
+
+        incidents = []
+        for job, speech_analysis in zip(batch, analyses):
+            job.trace.add("queue_wait", job.submitted_at, analysis_started, coalesced=job.coalesced)
+            job.trace.add("speech_analysis", analysis_started, analysis_finished, mode=mode,
+                          batch_size=len(batch))
+            incident = self.incident_recorder.record_incident(
+                threat_level=job.threat_level,
+                volume=job.volume,
+                speech_confidence=job.speech_confidence,
+                audio_data=job.audio_data,
+                speech_analysis=speech_analysis,
+                sample_rate=job.sample_rate,
+                stream_id=job.stream_id,
+                start_offset=job.start_offset,
+                acoustic_features=job.acoustic_features,
+                trace=job.trace
+            )
+            ANALYSIS_JOBS.labels("recorded" if incident else "not_recorded").inc()
+            if incident and self.on_incident:
+                self.on_incident(incident, job)
+            incidents.append(incident)
+        return incidents
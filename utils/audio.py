@@ -1,60 +1,184 @@
 """
 Audio capture utilities for VoiceGuard
+
+AudioCapture runs PortAudio in callback mode. The callback copies each
+block of samples straight into a preallocated ring of chunk-sized slots
+(no per-chunk allocation on the audio thread) and wakes the consumer
+through a Condition, so get_audio_chunk blocks until data is ready instead
+of polling.
+
+The hand-off is bounded: when the consumer falls a full ring behind, the
+oldest unread chunk is overwritten and counted as dropped, so a slow
+pipeline costs audio, never unbounded memory. Input overflows reported by
+PortAudio (the device buffer overran before the callback ran) are counted
+separately.
 """
 import pyaudio
 import numpy as np
 import threading
-import queue
 import time
 
+from utils.metrics import metrics
+
+DROPPED_CHUNKS = metrics.counter("voiceguard_capture_dropped_chunks_total",
+                                 "Captured chunks overwritten before the pipeline read them")
+INPUT_OVERFLOWS = metrics.counter("voiceguard_capture_input_overflows_total",
+                                  "PortAudio input overflows (device buffer overran)")
+
 class AudioCapture:
-    def __init__(self, sample_rate=16000, chunk_size=1024):
+    def __init__(self, sample_rate=16000, chunk_size=1024, input_device_index=None, ring_chunks=64):
+        """
+        input_device_index: PyAudio input device (None = system default)
+        ring_chunks: chunks the ring holds before the oldest unread one is
+                     dropped (64 x 1024 samples = ~4 s at 16 kHz)
+        """
         self.sample_rate = sample_rate
         self.chunk_size = chunk_size
-        self.audio_queue = queue.Queue()
+        self.input_device_index = input_device_index
+        self.ring_chunks = ring_chunks
+
+        # Preallocated ring: one int16 slot per chunk plus its capture time.
+        # The callback copies PortAudio's bytes into these byte views.
+        self.slots = np.zeros((ring_chunks, chunk_size), dtype=np.int16)
+        self.slot_bytes = [memoryview(slot).cast('B') for slot in self.slots]
+        self.timestamps = np.zeros(ring_chunks, dtype=np.float64)
+        self.write_index = 0   # chunks written since start (slot = index % ring_chunks)
+        self.read_index = 0    # chunks consumed or dropped
+        self.condition = threading.Condition()
+
+        self.pyaudio = None
+        self.stream = None
         self.is_recording = False
-        
+
+        self.chunks_captured = 0
+        self.chunks_delivered = 0
+        self.dropped_chunks = 0
+        self.input_overflows = 0
+        self.short_reads = 0
+        self.max_backlog = 0
+
     def start_recording(self):
         """Start capturing audio"""
         if self.is_recording:
             print("Already recording!")
             return
-            
-        self.is_recording = True
-        
+
+        with self.condition:
+            self.write_index = 0
+            self.read_index = 0
+
         # Initialize PyAudio
-        p = pyaudio.PyAudio()
-        
-        # Open stream
-        stream = p.open(
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=self.sample_rate,
-            input=True,
-            frames_per_buffer=self.chunk_size
-        )
-        
-        print("🎤 Audio recording started...")
-        
-        def record_loop():
-            while self.is_recording:
-                data = stream.read(self.chunk_size)
-                audio_data = np.frombuffer(data, dtype=np.int16)
-                self.audio_queue.put((audio_data, time.time()))
-                
-        # Start recording thread
-        self.record_thread = threading.Thread(target=record_loop)
-        self.record_thread.daemon = True
-        self.record_thread.start()
-        
-    def get_audio_chunk(self):
-        """Get next audio chunk"""
+        self.pyaudio = pyaudio.PyAudio()
         try:
-            return self.audio_queue.get(timeout=0.1)
-        except queue.Empty:
-            return None
-            
+            self.is_recording = True
+            self.stream = self.pyaudio.open(
+                format=pyaudio.paInt16,
+                channels=1,
+                rate=self.sample_rate,
+                input=True,
+                input_device_index=self.input_device_index,
+                frames_per_buffer=self.chunk_size,
+                stream_callback=self._callback
+            )
+        except Exception:
+            self.is_recording = False
+            self.pyaudio.terminate()
+            self.pyaudio = None
+            raise
+
+        print("🎤 Audio recording started...")
+
+    def _callback(self, in_data, frame_count, time_info, status_flags):
+        """PortAudio thread: copy the block into the next ring slot"""
+        if not self.is_recording:
+            return (None, pyaudio.paComplete)
+        if status_flags & pyaudio.paInputOverflow:
+            self.input_overflows += 1
+            INPUT_OVERFLOWS.inc()
+        if frame_count != self.chunk_size or in_data is None:
+            # frames_per_buffer is fixed, so this should not happen
+            self.short_reads += 1
+            return (None, pyaudio.paContinue)
+
+        now = time.time()
+        with self.condition:
+            slot = self.write_index % self.ring_chunks
+            self.slot_bytes[slot][:] = in_data
+            self.timestamps[slot] = now
+            self.write_index += 1
+            self.chunks_captured += 1
+
+            backlog = self.write_index - self.read_index
+            if backlog > self.ring_chunks:
+                # Consumer is a whole ring behind: the oldest chunk was just overwritten
+                self.read_index += 1
+                self.dropped_chunks += 1
+                DROPPED_CHUNKS.inc()
+                backlog -= 1
+            if backlog > self.max_backlog:
+                self.max_backlog = backlog
+            self.condition.notify()
+        return (None, pyaudio.paContinue)
+
+    @property
+    def backlog(self):
+        """Chunks captured but not read yet (unlocked read, for metrics)"""
+        return self.write_index - self.read_index
+
+    def get_audio_chunk(self, timeout=None):
+        """
+        Get the next (audio_data, timestamp), blocking until a chunk is
+        ready or `timeout` seconds pass (None = until data or stop).
+        Returns None on timeout and once recording has stopped.
+        """
+        with self.condition:
+            if self.read_index == self.write_index:
+                if not self.is_recording:
+                    return None
+                self.condition.wait_for(
+                    lambda: self.read_index < self.write_index or not self.is_recording, timeout)
+                if self.read_index == self.write_index:
+                    return None
+            slot = self.read_index % self.ring_chunks
+            # Copy out so the slot can be reused while the pipeline holds the chunk
+            item = (self.slots[slot].copy(), float(self.timestamps[slot]))
+            self.read_index += 1
+            self.chunks_delivered += 1
+            return item
+
     def stop_recording(self):
-        """Stop recording"""
-        self.is_recording = False
+        """Stop recording and release the stream and PortAudio"""
+        with self.condition:
+            # Pipeline.stop and the pipeline thread may both get here
+            if not self.is_recording:
+                return
+            self.is_recording = False
+            stream, self.stream = self.stream, None
+            audio, self.pyaudio = self.pyaudio, None
+            # Wake up a consumer blocked in get_audio_chunk
+            self.condition.notify_all()
+
+        try:
+            if stream is not None:
+                stream.stop_stream()
+                stream.close()
+        except Exception as e:
+            print(f"⚠️  Error closing audio stream: {e}")
+        finally:
+            if audio is not None:
+                audio.terminate()
         print("🛑 Audio recording stopped")
+
+    def stats(self):
+        with self.condition:
+            backlog = self.write_index - self.read_index
+        return {
+            "captured": self.chunks_captured,
+            "delivered": self.chunks_delivered,
+            "dropped": self.dropped_chunks,
+            "input_overflows": self.input_overflows,
+            "short_reads": self.short_reads,
+            "backlog": backlog,
+            "max_backlog": self.max_backlog,
+            "ring_chunks": self.ring_chunks
+        }
@@ -1,32 +1,110 @@
 """
 Audio buffer for evidence collection
 """
+import time
 import numpy as np
-from collections import deque
 
 class AudioBuffer:
     def __init__(self, max_duration_seconds=10, sample_rate=16000):
         """
-        Keep a rolling buffer of audio for evidence collection
+        Keep a rolling buffer of audio for evidence collection.
+
+        Audio is stored in a preallocated int16 ring with a write cursor, so
+        adding a chunk is a slice assignment and reading is at most one copy.
+        Every sample also has an absolute offset (samples written since the
+        buffer was created), which lets callers address audio by offset or
+        by wall-clock timestamp.
         """
-        self.max_samples = max_duration_seconds * sample_rate
+        self.max_samples = int(max_duration_seconds * sample_rate)
         self.sample_rate = sample_rate
-        self.buffer = deque(maxlen=self.max_samples)
-    
-    def add_audio(self, audio_data):
-        """Add audio data to buffer"""
-        self.buffer.extend(audio_data)
-    
-    def get_recent_audio(self, duration_seconds=5):
-        """Get recent audio as numpy array"""
-        num_samples = min(int(duration_seconds * self.sample_rate), len(self.buffer))
+        self.buffer = np.zeros(self.max_samples, dtype=np.int16)
+        self.write_pos = 0
+        self.total_samples = 0      # absolute offset of the next sample
+        self.last_timestamp = None  # wall-clock time of the newest sample
+
+    def __len__(self):
+        return min(self.total_samples, self.max_samples)
+
+    @property
+    def start_offset(self):
+        """Absolute offset of the oldest sample still in the buffer"""
+        return self.total_samples - len(self)
+
+    def add_audio(self, audio_data, timestamp=None):
+        """
+        Add audio data to buffer.
+        timestamp: wall-clock time of the end of the chunk (defaults to now)
+        """
+        audio_data = np.asarray(audio_data)
+        if audio_data.dtype != np.int16:
+            audio_data = (audio_data * 32767).astype(np.int16)
+
+        num_samples = len(audio_data)
         if num_samples == 0:
+            return
+
+        # Only the newest max_samples can survive the write; the ring index
+        # of a sample is always its absolute offset modulo max_samples
+        data = audio_data[-self.max_samples:]
+        n = len(data)
+        self.write_pos = (self.total_samples + num_samples - n) % self.max_samples
+        end = self.write_pos + n
+        if end <= self.max_samples:
+            self.buffer[self.write_pos:end] = data
+        else:
+            first = self.max_samples - self.write_pos
+            self.buffer[self.write_pos:] = data[:first]
+            self.buffer[:n - first] = data[first:]
+        self.write_pos = end % self.max_samples
+
+        self.total_samples += num_samples
+        self.last_timestamp = time.time() if timestamp is None else timestamp
+
+    def get_audio_range(self, start_offset, end_offset=None, copy=True):
+        """
+        Get audio between two absolute sample offsets (end exclusive).
+        Offsets outside the buffered window are clamped.
+
+        With copy=False a view into the ring is returned when the range does
+        not wrap around; the view is only valid until the next add_audio().
+        """
+        if end_offset is None:
+            end_offset = self.total_samples
+        start_offset = max(start_offset, self.start_offset)
+        end_offset = min(end_offset, self.total_samples)
+        if end_offset <= start_offset:
             return np.array([], dtype=np.int16)
-        
-        # Get last N samples
-        recent_samples = list(self.buffer)[-num_samples:]
-        return np.array(recent_samples, dtype=np.int16)
-    
+
+        start = start_offset % self.max_samples
+        length = end_offset - start_offset
+        if start + length <= self.max_samples:
+            view = self.buffer[start:start + length]
+            return view.copy() if copy else view
+
+        # Wrapped range: a single contiguous copy
+        first = self.max_samples - start
+        return np.concatenate((self.buffer[start:], self.buffer[:length - first]))
+
+    def get_recent_audio(self, duration_seconds=5, copy=True):
+        """Get recent audio as numpy array"""
+        num_samples = min(int(duration_seconds * self.sample_rate), len(self))
+        return self.get_audio_range(self.total_samples - num_samples, copy=copy)
+
+    def timestamp_to_offset(self, timestamp):
+        """Map a wall-clock timestamp to an absolute sample offset"""
+        if self.last_timestamp is None:
+            return self.total_samples
+        samples_ago = int(round((self.last_timestamp - timestamp) * self.sample_rate))
+        return self.total_samples - samples_ago
+
+    def get_audio_since(self, timestamp, until=None, copy=True):
+        """Get audio recorded from a wall-clock timestamp (up to `until`)"""
+        start_offset = self.timestamp_to_offset(timestamp)
+        end_offset = None if until is None else self.timestamp_to_offset(until)
+        return self.get_audio_range(start_offset, end_offset, copy=copy)
+
     def clear(self):
         """Clear the buffer"""
-        self.buffer.clear()
+        self.write_pos = 0
+        self.total_samples = 0
+        self.last_timestamp = None
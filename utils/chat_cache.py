@@ -0,0 +1,146 @@
+"""
+Response cache for first-turn chatbot questions
+
+Many conversations open with the same few questions ("what is 1091",
+"how do I file a domestic violence complaint", and their Hindi
+equivalents). Answers to a first message, where there is no history to
+change the answer, are cached under the normalized message text, the
+detected language and a hash of the system prompt, with LRU eviction, a
+TTL and a size bound.
+
+An optional second, fuzzy key (off by default) tolerates greetings,
+articles, politeness and contractions ("Hi, what's the 1091 helpline
+please?" ~ "what is 1091 helpline") without needing embeddings. It is built
+from order-preserving word shingles, and keeps pronouns, modals and
+negations, because on a legal-help line "my husband hit me" and "I hit my
+husband", or "can I" and "should I", need different answers.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_CONTRACTION = re.compile(r"\b(cannot|can't|won't|\w+n't|i'm|(?:what|who|where|how|it|that|there|he|she)'s|\w+'re)\b")
+_CONTRACTIONS = {"cannot": "can not", "can't": "can not", "won't": "will not", "i'm": "i am"}
+
+
+def _expand(match):
+    word = match.group()
+    if word in _CONTRACTIONS:
+        return _CONTRACTIONS[word]
+    if word.endswith("n't"):
+        return word[:-3] + " not"
+    if word.endswith("'re"):
+        return word[:-3] + " are"
+    return word[:-2] + " is"
+
+
+# Filler dropped from the fuzzy key: greetings, articles and politeness only
+# (English + Hindi/Hinglish). Anything that can change who did what, or what
+# is being asked, stays in.
+FILLER_WORDS = frozenset("""
+a an the hi hello hey please pls plz kindly dear sir madam ji namaste namaskar
+bataiye batao batayein
+नमस्ते नमस्कार कृपया जी बताइए बताओ
+""".split())
+
+SHINGLE_SIZE = 2
+
+
+def normalize_message(text):
+    """Lowercase words only: punctuation and extra whitespace removed"""
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def fuzzy_key(text):
+    """
+    Hash of the message's word shingles (runs of SHINGLE_SIZE words, in
+    order) after contractions are expanded and filler words dropped
+    """
+    text = _CONTRACTION.sub(_expand, text.lower().replace("\u2019", "'"))
+    words = [word for word in _WORD.findall(text) if word not in FILLER_WORDS]
+    if not words:
+        return None
+    size = min(SHINGLE_SIZE, len(words))
+    shingles = sorted({" ".join(words[i:i + size]) for i in range(len(words) - size + 1)})
+    return hashlib.sha1("|".join(shingles).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1024, ttl_seconds=6 * 3600, fuzzy=False):
+        """
+        max_entries: LRU size bound (each answer is stored once per key kind)
+        ttl_seconds: answers older than this are not served
+        fuzzy: also match on the shingle key (see fuzzy_key)
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.fuzzy = fuzzy
+        self.entries = OrderedDict()  # key -> (stored_at, response)
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _keys(self, message, language, prompt_hash):
+        keys = [("exact", language, prompt_hash, normalize_message(message))]
+        if self.fuzzy:
+            key = fuzzy_key(message)
+            if key:
+                keys.append(("fuzzy", language, prompt_hash, key))
+        return keys
+
+    def get(self, message, language, prompt_hash):
+        """Cached answer for a first-turn message, or None"""
+        now = time.monotonic()
+        with self.lock:
+            for key in self._keys(message, language, prompt_hash):
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                stored_at, response = entry
+                if now - stored_at > self.ttl_seconds:
+                    del self.entries[key]
+                    self.expirations += 1
+                    continue
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if key[0] == "fuzzy":
+                    self.fuzzy_hits += 1
+                return response
+            self.misses += 1
+            return None
+
+    def put(self, message, language, prompt_hash, response):
+        if not response:
+            return
+        now = time.monotonic()
+        with self.lock:
+            for key in self._keys(message, language, prompt_hash):
+                self.entries[key] = (now, response)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
@@ -1,11 +1,11 @@
 import os
 import time
-import asyncio
+import hashlib
 from openai import OpenAI
 from dotenv import load_dotenv
-from collections import defaultdict, deque
-import threading
-from datetime import datetime, timedelta
+from datetime import datetime
+from utils.chat_cache import ResponseCache
+from utils.session_store import create_session_store, estimate_tokens, message_tokens
 
 load_dotenv()
 
@@ -16,30 +16,9 @@ client = OpenAI(
 )
 model_id = os.getenv("MODEL_ID")
 
-# Session management
-user_sessions = defaultdict(lambda: {
-    'history': deque(maxlen=20),  # Keep last 20 messages
-    'last_activity': datetime.now(),
-    'language_preference': 'auto'
-})
-
-SESSION_TIMEOUT = timedelta(hours=2)
-
-def cleanup_sessions():
-    """Remove inactive sessions to save memory"""
-    while True:
-        current_time = datetime.now()
-        inactive_sessions = [
-            user_id for user_id, session in user_sessions.items()
-            if current_time - session['last_activity'] > SESSION_TIMEOUT
-        ]
-        for user_id in inactive_sessions:
-            del user_sessions[user_id]
-        time.sleep(1800)  # Check every 30 minutes
-
-# Start cleanup thread
-cleanup_thread = threading.Thread(target=cleanup_sessions, daemon=True)
-cleanup_thread.start()
+# Session management: bounded, lazily expiring, token-budgeted
+# (CHAT_SESSION_BACKEND=sqlite shares sessions between worker processes)
+session_store = create_session_store()
 
 # Language-specific system prompts
 SYSTEM_PROMPTS = {
@@ -68,6 +47,28 @@ SYSTEM_PROMPTS = {
     }
 }
 
+def system_prompt_text(language):
+    system_prompt = SYSTEM_PROMPTS[language]
+    return f"{system_prompt['role']}\n\nRules:\n" + "\n".join(f"- {rule}" for rule in system_prompt['rules'])
+
+# System messages are built once; every request reuses the same message, so
+# the prompt prefix is byte-identical across turns and provider-side prompt
+# caching can reuse it
+SYSTEM_MESSAGES = {
+    language: {"role": "system", "content": system_prompt_text(language)}
+    for language in SYSTEM_PROMPTS
+}
+SYSTEM_PROMPT_TOKENS = {language: message_tokens(message) for language, message in SYSTEM_MESSAGES.items()}
+
+# Cache key part: a prompt or model change invalidates cached answers
+SYSTEM_PROMPT_HASHES = {
+    language: hashlib.sha1(f"{model_id}\n{SYSTEM_MESSAGES[language]['content']}".encode("utf-8")).hexdigest()[:16]
+    for language in SYSTEM_PROMPTS
+}
+
+# Answers to first-turn questions (see utils/chat_cache.py)
+response_cache = ResponseCache()
+
 def detect_language(text: str) -> str:
     """Simple language detection based on script"""
     hindi_chars = sum(1 for char in text if '\u0900' <= char <= '\u097F')
@@ -77,27 +78,60 @@ def detect_language(text: str) -> str:
     hindi_ratio = hindi_chars / total_chars
     return 'hindi' if hindi_ratio > 0.3 else 'english'
 
+def build_prompt(user_id, current_message, language):
+    """
+    Messages for a request (system prompt, history, new message) and their
+    estimated token count. Only the new message is appended to what the
+    previous turn sent, so the prefix stays identical between turns.
+    """
+    session = session_store.get(user_id)
+    history = session['history'] if session else []
+    messages = [SYSTEM_MESSAGES[language], *history, {"role": "user", "content": current_message}]
+    prompt_tokens = (SYSTEM_PROMPT_TOKENS[language]
+                     + (session.get('history_tokens', 0) if session else 0)
+                     + estimate_tokens(current_message) + 4)
+    return messages, prompt_tokens
+
 def build_conversation_context(user_id, current_message, language):
     """Build conversation context with history"""
-    session = user_sessions[user_id]
-    system_prompt = SYSTEM_PROMPTS[language]
-    
-    messages = [
-        {
-            "role": "system", 
-            "content": f"{system_prompt['role']}\n\nRules:\n" + "\n".join(f"- {rule}" for rule in system_prompt['rules'])
-        }
-    ]
-    messages.extend(session['history'])
-    messages.append({"role": "user", "content": current_message})
-    return messages
+    return build_prompt(user_id, current_message, language)[0]
+
+def prompt_usage(estimated_tokens, usage=None):
+    """Prompt size for a response: the provider's count when it sends one"""
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    if not prompt_tokens:
+        return {"prompt_tokens": estimated_tokens, "prompt_tokens_estimated": True}
+    info = {"prompt_tokens": prompt_tokens, "prompt_tokens_estimated": False}
+    cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    if cached_tokens is not None:
+        info["cached_prompt_tokens"] = cached_tokens
+    return info
+
+def is_first_turn(user_id):
+    return not session_store.history(user_id)
+
+def get_cached_response(user_id, message, language):
+    """Cached answer if this is the user's first message, else None"""
+    if not is_first_turn(user_id):
+        return None
+    return response_cache.get(message, language, SYSTEM_PROMPT_HASHES[language])
+
+def cache_response(message, language, ai_response):
+    response_cache.put(message, language, SYSTEM_PROMPT_HASHES[language], ai_response)
 
 def update_session_history(user_id, user_message, ai_response):
-    """Update user session with new messages"""
-    session = user_sessions[user_id]
-    session['history'].append({"role": "user", "content": user_message})
-    session['history'].append({"role": "assistant", "content": ai_response})
-    session['last_activity'] = datetime.now()
+    """Update user session with new messages; returns the history length"""
+    return session_store.append(user_id, user_message, ai_response)
+
+def resolve_language(message, language="auto"):
+    """Map the UI language code to a system prompt language"""
+    lang_map = {
+        'en': 'english',
+        'hi': 'hindi',
+    }
+    if language == 'auto':
+        return detect_language(message)
+    return lang_map.get(language, 'english')
 
 # --- Main Chat Function ---
 def chat(user_id: str, message: str, language: str = "auto") -> dict:
@@ -106,72 +140,157 @@ def chat(user_id: str, message: str, language: str = "auto") -> dict:
         return {"error": "No message provided"}
     
     # --- Language Handling ---
-    lang_map = {
-        'en': 'english',
-        'hi': 'hindi',
-    }
-    
-    effective_language = lang_map.get(language, 'english')
-    if language == 'auto':
-        effective_language = detect_language(message)
+    effective_language = resolve_language(message, language)
 
+    first_turn = is_first_turn(user_id)
+    cached = get_cached_response(user_id, message, effective_language)
+    usage = {}
     try:
-        messages = build_conversation_context(user_id, message, effective_language)
-        response = client.chat.completions.create(
-            model=model_id,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=800,
-            stream=False
-        )
-        ai_response = response.choices[0].message.content
-        update_session_history(user_id, message, ai_response)
+        if cached is not None:
+            ai_response = cached
+        else:
+            messages, prompt_tokens = build_prompt(user_id, message, effective_language)
+            response = client.chat.completions.create(
+                model=model_id,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=800,
+                stream=False
+            )
+            usage = prompt_usage(prompt_tokens, response.usage)
+            ai_response = response.choices[0].message.content
+            if first_turn:
+                cache_response(message, effective_language, ai_response)
+        session_length = update_session_history(user_id, message, ai_response)
         return {
             "response": ai_response,
             "language": effective_language,
             "user_id": user_id,
-            "session_length": len(user_sessions[user_id]['history'])
+            "session_length": session_length,
+            "cached": cached is not None,
+            **usage
         }
     except Exception as e:
         return {"error": str(e)}
 
+def chat_stream(user_id: str, message: str, language: str = "auto"):
+    """
+    Streaming variant of chat(): yields events as the answer is generated.
+      {"type": "start", "language": ...}
+      {"type": "token", "content": ...}          (one per streamed delta)
+      {"type": "done", "response": ..., "session_length": ...,
+       "time_to_first_token_ms": ..., "total_ms": ...}
+      {"type": "error", "error": ...}
+    Session history is only updated once the whole answer has arrived.
+    """
+    if not message:
+        yield {"type": "error", "error": "No message provided"}
+        return
+
+    effective_language = resolve_language(message, language)
+    yield {"type": "start", "language": effective_language, "user_id": user_id}
+
+    started = time.perf_counter()
+    cached = get_cached_response(user_id, message, effective_language)
+    if cached is not None:
+        yield {"type": "token", "content": cached}
+        session_length = update_session_history(user_id, message, cached)
+        yield {
+            "type": "done",
+            "response": cached,
+            "language": effective_language,
+            "user_id": user_id,
+            "session_length": session_length,
+            "time_to_first_token_ms": round((time.perf_counter() - started) * 1000, 1),
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            "cached": True
+        }
+        return
+
+    first_turn = is_first_turn(user_id)
+    first_token_ms = None
+    parts = []
+    try:
+        messages, prompt_tokens = build_prompt(user_id, message, effective_language)
+        usage = prompt_usage(prompt_tokens)
+        stream = client.chat.completions.create(
+            model=model_id,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=800,
+            stream=True
+        )
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = prompt_usage(prompt_tokens, chunk.usage)
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if not content:
+                continue
+            if first_token_ms is None:
+                first_token_ms = (time.perf_counter() - started) * 1000
+            parts.append(content)
+            yield {"type": "token", "content": content}
+    except Exception as e:
+        yield {"type": "error", "error": str(e)}
+        return
+
+    ai_response = "".join(parts)
+    if first_turn:
+        cache_response(message, effective_language, ai_response)
+    session_length = update_session_history(user_id, message, ai_response)
+    yield {
+        "type": "done",
+        "response": ai_response,
+        "language": effective_language,
+        "user_id": user_id,
+        "session_length": session_length,
+        "time_to_first_token_ms": round(first_token_ms, 1) if first_token_ms is not None else None,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        "cached": False,
+        **usage
+    }
+
 # --- Utility Functions ---
 def get_history(user_id: str):
-    if user_id not in user_sessions:
+    session = session_store.get(user_id)
+    if session is None:
         return {"history": [], "message": "No history found"}
-    session = user_sessions[user_id]
     return {
-        "history": list(session['history']),
-        "last_activity": session['last_activity'].isoformat(),
+        "history": session['history'],
+        "last_activity": datetime.fromtimestamp(session['last_activity']).isoformat(),
         "session_length": len(session['history'])
     }
 
 def clear_history(user_id: str):
-    if user_id in user_sessions:
-        user_sessions[user_id]['history'].clear()
+    if session_store.clear(user_id):
         return {"message": "History cleared successfully"}
     return {"message": "No history found for user"}
 
 def get_sessions():
+    sessions = session_store.list_sessions()
     sessions_info = {
         user_id: {
             "message_count": len(session['history']),
-            "last_activity": session['last_activity'].isoformat(),
+            "last_activity": datetime.fromtimestamp(session['last_activity']).isoformat(),
             "language_preference": session.get('language_preference', 'auto')
         }
-        for user_id, session in user_sessions.items()
+        for user_id, session in sessions
     }
     return {
-        "active_sessions": len(user_sessions),
+        "active_sessions": len(sessions),
         "sessions": sessions_info
     }
 
 def health_check():
     return {
         "status": "healthy",
-        "active_sessions": len(user_sessions),
+        "active_sessions": len(session_store),
+        "session_store": session_store.stats(),
         "timestamp": datetime.now().isoformat(),
-        "model": model_id
+        "model": model_id,
+        "response_cache": response_cache.stats()
     }
 
 # --- Example usage if run standalone ---
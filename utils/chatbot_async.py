@@ -0,0 +1,391 @@
+"""
+Asyncio chatbot backend for VoiceGuard
+
+All upstream model calls run on one event loop thread with a single
+AsyncOpenAI client, so hundreds of concurrent chat sessions share one
+keep-alive connection pool instead of each holding a worker thread on a
+blocking request. Upstream concurrency is capped with a semaphore (extra
+requests queue, and are rejected once the queue is full), every user has
+a token-bucket rate limit, and requests that run past their timeout are
+cancelled.
+
+Conversation state, prompts and language handling are shared with
+utils/chatbot.py. Session store calls block (SQLiteSessionStore can wait
+up to its 10 s lock timeout), so they run on a small thread pool and never
+on the loop itself.
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from utils.chatbot import (build_prompt, cache_response, get_cached_response, is_first_turn,
+                           model_id, prompt_usage, resolve_language, response_cache,
+                           update_session_history)
+from utils.metrics import metrics
+
+UPSTREAM_MS = metrics.histogram("voiceguard_chat_upstream_ms",
+                                "Upstream model call, request to last token (ms)", ("mode", "outcome"))
+FIRST_TOKEN_MS = metrics.histogram("voiceguard_chat_first_token_ms",
+                                   "Streamed chat: request to first upstream token (ms)")
+CHAT_REJECTED = metrics.counter("voiceguard_chat_rejected_total", "Chat requests refused", ("reason",))
+
+
+class ChatRejected(Exception):
+    """Request refused before reaching the model (rate limit, overload, timeout)"""
+    def __init__(self, message, status_code, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Per-user rate limit: `rate` requests per second, bursts up to `capacity`"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take a token; returns 0 on success or the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AsyncChatbot:
+    def __init__(self, base_url=None, api_key=None, model=None, max_concurrency=32,
+                 max_waiting=512, request_timeout=60.0, rate_per_minute=20, burst=5, store_threads=4):
+        """
+        max_concurrency: most upstream requests in flight at once
+        max_waiting: most requests queued for a free slot before new ones get 503
+        request_timeout: seconds before an upstream call is cancelled (504)
+        rate_per_minute/burst: per-user token bucket (429 when empty)
+        store_threads: threads for session store and cache calls, kept off the loop
+        """
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL", "https://openrouter.ai/api/v1")
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.model = model or model_id
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.request_timeout = request_timeout
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.store_threads = store_threads
+        self.store_executor = None
+
+        self.buckets = {}  # user_id -> TokenBucket (only touched on the loop thread)
+        self.loop = None
+        self.thread = None
+        self.client = None
+        self.semaphore = None
+        self.start_lock = threading.Lock()
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = {"rate_limited": 0, "overloaded": 0, "timed_out": 0}
+
+    # --- event loop thread ---
+    def start(self):
+        """Start the event loop thread (done automatically on first use)"""
+        with self.start_lock:
+            if self.thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self.store_executor = ThreadPoolExecutor(self.store_threads, thread_name_prefix="chatbot-store")
+            ready = threading.Event()
+            self.thread = threading.Thread(target=self._run_loop, args=(ready,), name="chatbot-async")
+            self.thread.daemon = True
+            self.thread.start()
+            ready.wait()
+
+    def _run_loop(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        # One pooled HTTP client for every session
+        self.client = AsyncOpenAI(
+            base_url=self.base_url,
+            api_key=self.api_key,
+            timeout=self.request_timeout,
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency
+            ))
+        )
+        ready.set()
+        self.loop.run_forever()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.thread = None
+        self.store_executor.shutdown()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the chatbot loop; returns a concurrent Future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def call(self, coro):
+        """Await a chatbot coroutine from any other event loop (e.g. the ASGI server's)"""
+        return await asyncio.wrap_future(self.submit(coro))
+
+    async def _store(self, fn, *args):
+        """Run a blocking session store / cache call off the loop"""
+        return await self.loop.run_in_executor(self.store_executor, functools.partial(fn, *args))
+
+    # --- admission control ---
+    def _check_rate(self, user_id):
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > 10000:
+                # Forget users whose bucket has refilled
+                now = time.monotonic()
+                for uid in [u for u, b in self.buckets.items()
+                            if b.tokens + (now - b.updated) * b.rate >= b.capacity]:
+                    del self.buckets[uid]
+        wait = bucket.take()
+        if wait:
+            self.rejected["rate_limited"] += 1
+            CHAT_REJECTED.labels("rate_limited").inc()
+            raise ChatRejected("Too many messages, please slow down.", 429, retry_after=round(wait, 1))
+
+    async def _acquire(self):
+        if self.semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected["overloaded"] += 1
+            CHAT_REJECTED.labels("overloaded").inc()
+            raise ChatRejected("Chat service is busy, please try again shortly.", 503, retry_after=5)
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    def _observe_upstream(self, mode, started, outcome):
+        UPSTREAM_MS.labels(mode, outcome).observe((time.perf_counter() - started) * 1000)
+
+    def _timed_out(self, mode, upstream_started):
+        self.rejected["timed_out"] += 1
+        CHAT_REJECTED.labels("timed_out").inc()
+        if upstream_started is not None:
+            self._observe_upstream(mode, upstream_started, "timeout")
+
+    # --- chat ---
+    async def chat(self, user_id, message, language="auto"):
+        """Async version of utils.chatbot.chat(); same response dict"""
+        if not message:
+            return {"error": "No message provided"}
+        effective_language = resolve_language(message, language)
+
+        cached = None
+        usage = {}
+        upstream_started = None
+        try:
+            self._check_rate(user_id)
+            first_turn = await self._store(is_first_turn, user_id)
+            # Cached first-turn answers skip the upstream queue entirely
+            cached = await self._store(get_cached_response, user_id, message, effective_language)
+            if cached is None:
+                await self._acquire()
+                try:
+                    messages, prompt_tokens = await self._store(
+                        build_prompt, user_id, message, effective_language)
+                    upstream_started = time.perf_counter()
+                    response = await asyncio.wait_for(self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=800,
+                        stream=False
+                    ), self.request_timeout)
+                    self._observe_upstream("chat", upstream_started, "ok")
+                    usage = prompt_usage(prompt_tokens, response.usage)
+                finally:
+                    self._release()
+        except ChatRejected as e:
+            return {"error": str(e), "status_code": e.status_code, "retry_after": e.retry_after}
+        except asyncio.TimeoutError:
+            self._timed_out("chat", upstream_started)
+            return {"error": "The assistant took too long to answer.", "status_code": 504}
+        except Exception as e:
+            if upstream_started is not None:
+                self._observe_upstream("chat", upstream_started, "error")
+            return {"error": str(e)}
+
+        if cached is not None:
+            ai_response = cached
+        else:
+            ai_response = response.choices[0].message.content
+            if first_turn:
+                await self._store(cache_response, message, effective_language, ai_response)
+        session_length = await self._store(update_session_history, user_id, message, ai_response)
+        self.completed += 1
+        return {
+            "response": ai_response,
+            "language": effective_language,
+            "user_id": user_id,
+            "session_length": session_length,
+            "cached": cached is not None,
+            **usage
+        }
+
+    async def chat_stream(self, user_id, message, language="auto"):
+        """Async version of utils.chatbot.chat_stream(); same events"""
+        if not message:
+            yield {"type": "error", "error": "No message provided"}
+            return
+        effective_language = resolve_language(message, language)
+
+        started = time.perf_counter()
+        try:
+            self._check_rate(user_id)
+        except ChatRejected as e:
+            yield {"type": "error", "error": str(e), "status_code": e.status_code, "retry_after": e.retry_after}
+            return
+
+        first_turn = await self._store(is_first_turn, user_id)
+        cached = await self._store(get_cached_response, user_id, message, effective_language)
+        if cached is not None:
+            yield {"type": "start", "language": effective_language, "user_id": user_id}
+            yield {"type": "token", "content": cached}
+            session_length = await self._store(update_session_history, user_id, message, cached)
+            self.completed += 1
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            yield {
+                "type": "done",
+                "response": cached,
+                "language": effective_language,
+                "user_id": user_id,
+                "session_length": session_length,
+                "time_to_first_token_ms": elapsed_ms,
+                "total_ms": elapsed_ms,
+                "cached": True
+            }
+            return
+
+        try:
+            await self._acquire()
+        except ChatRejected as e:
+            yield {"type": "error", "error": str(e), "status_code": e.status_code, "retry_after": e.retry_after}
+            return
+
+        deadline = time.monotonic() + self.request_timeout
+        first_token_ms = None
+        upstream_started = None
+        parts = []
+        try:
+            yield {"type": "start", "language": effective_language, "user_id": user_id}
+            messages, prompt_tokens = await self._store(build_prompt, user_id, message, effective_language)
+            usage = prompt_usage(prompt_tokens)
+            upstream_started = time.perf_counter()
+            stream = await asyncio.wait_for(self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=800,
+                stream=True
+            ), self.request_timeout)
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), deadline - time.monotonic())
+                    except StopAsyncIteration:
+                        break
+                    if getattr(chunk, "usage", None):
+                        usage = prompt_usage(prompt_tokens, chunk.usage)
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - started) * 1000
+                        FIRST_TOKEN_MS.observe((time.perf_counter() - upstream_started) * 1000)
+                    parts.append(content)
+                    yield {"type": "token", "content": content}
+            finally:
+                await stream.close()
+            self._observe_upstream("stream", upstream_started, "ok")
+        except asyncio.TimeoutError:
+            self._timed_out("stream", upstream_started)
+            yield {"type": "error", "error": "The assistant took too long to answer.", "status_code": 504}
+            return
+        except Exception as e:
+            if upstream_started is not None:
+                self._observe_upstream("stream", upstream_started, "error")
+            yield {"type": "error", "error": str(e)}
+            return
+        finally:
+            self._release()
+
+        ai_response = "".join(parts)
+        if first_turn:
+            await self._store(cache_response, message, effective_language, ai_response)
+        session_length = await self._store(update_session_history, user_id, message, ai_response)
+        self.completed += 1
+        yield {
+            "type": "done",
+            "response": ai_response,
+            "language": effective_language,
+            "user_id": user_id,
+            "session_length": session_length,
+            "time_to_first_token_ms": round(first_token_ms, 1) if first_token_ms is not None else None,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            "cached": False,
+            **usage
+        }
+
+    def stream(self, user_id, message, language="auto"):
+        """Iterate chat_stream() events from a plain (non-async) thread"""
+        events = self.chat_stream(user_id, message, language)
+        try:
+            while True:
+                try:
+                    yield self.submit(events.__anext__()).result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            # Client went away mid-answer: cancel the upstream request
+            self.submit(events.aclose()).result()
+
+    async def astream(self, user_id, message, language="auto"):
+        """Iterate chat_stream() events from another event loop (e.g. the ASGI server's)"""
+        events = self.chat_stream(user_id, message, language)
+        try:
+            while True:
+                try:
+                    yield await self.call(events.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            # Not awaited: the caller's task may already be cancelled (client left)
+            self.submit(events.aclose())
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": dict(self.rejected),
+            "max_concurrency": self.max_concurrency,
+            "tracked_users": len(self.buckets),
+            "response_cache": response_cache.stats()
+        }
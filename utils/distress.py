@@ -0,0 +1,250 @@
+"""
+Acoustic distress classifier for VoiceGuard
+
+A small CPU model that scores short clips for screaming, crying and
+aggressive tone from log-mel features, so loud but harmless audio (TV,
+sports arguments, children playing) can be kept away from Whisper.
+It gates both Whisper paths: HIGH chunks (DistressStage in
+utils/pipeline.py) and the background transcription of speech segments
+(SpeechSegmenter in utils/transcript_cache.py).
+
+Features: 40-band log-mel spectrogram (25 ms frames, 10 ms hop), pooled
+into the per-band mean and standard deviation over the clip (80 values).
+Model: softmax regression, or an MLP with one ReLU hidden layer, in plain
+NumPy. Weights, normalization and class labels live in one .npz file
+(default data/distress_model.npz) produced by
+`python -m benchmarks.distress_benchmark train`. Without a weights file
+the classifier is unavailable and the pipeline runs as before.
+"""
+import os
+import time
+
+import numpy as np
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  "data", "distress_model.npz")
+
+NEUTRAL_LABEL = "neutral"
+
+
+def mel_filterbank(sample_rate, n_fft, n_mels, fmin=60.0, fmax=None):
+    """Triangular mel filters, shape (n_mels, n_fft // 2 + 1)"""
+    fmax = fmax or sample_rate / 2
+    def hz_to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+    def mel_to_hz(mel):
+        return 700.0 * (10 ** (mel / 2595.0) - 1.0)
+    mels = np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), n_mels + 2)
+    bins = np.fft.rfftfreq(n_fft, 1.0 / sample_rate)
+    edges = mel_to_hz(mels)
+    filters = np.zeros((n_mels, len(bins)), dtype=np.float32)
+    for m in range(n_mels):
+        left, center, right = edges[m], edges[m + 1], edges[m + 2]
+        rising = (bins - left) / (center - left)
+        falling = (right - bins) / (right - center)
+        filters[m] = np.maximum(0, np.minimum(rising, falling))
+    return filters
+
+
+class LogMelExtractor:
+    def __init__(self, sample_rate=16000, n_mels=40, frame_ms=25, hop_ms=10, n_fft=512):
+        self.sample_rate = sample_rate
+        self.frame_size = int(sample_rate * frame_ms / 1000)
+        self.hop = int(sample_rate * hop_ms / 1000)
+        self.n_fft = max(n_fft, self.frame_size)
+        self.n_mels = n_mels
+        self.window = np.hanning(self.frame_size).astype(np.float32)
+        self.filters = mel_filterbank(sample_rate, self.n_fft, n_mels)
+
+    @property
+    def num_features(self):
+        return 2 * self.n_mels
+
+    def log_mel(self, audio):
+        """(num_frames, n_mels) log-mel spectrogram of int16 or float audio"""
+        audio = np.asarray(audio)
+        if audio.dtype == np.int16:
+            audio = audio.astype(np.float32) / 32768.0
+        if len(audio) < self.frame_size:
+            audio = np.pad(audio, (0, self.frame_size - len(audio)))
+        frames = np.lib.stride_tricks.sliding_window_view(audio, self.frame_size)[::self.hop]
+        power = np.abs(np.fft.rfft(frames * self.window, n=self.n_fft, axis=1)) ** 2
+        return np.log(power @ self.filters.T + 1e-6)
+
+    def features(self, audio):
+        """Clip-level vector: per-band mean and std of the log-mel spectrogram"""
+        mel = self.log_mel(audio)
+        return np.concatenate((mel.mean(axis=0), mel.std(axis=0))).astype(np.float32)
+
+
+class DistressClassifier:
+    def __init__(self, labels, mean, std, W2, b2, W1=None, b1=None, sample_rate=16000, n_mels=40):
+        """
+        labels: class names; NEUTRAL_LABEL is the "no distress" class
+        mean/std: feature normalization learned at training time
+        W1/b1: hidden layer (None for plain softmax regression)
+        W2/b2: output layer
+        """
+        self.labels = [str(label) for label in labels]
+        self.mean = mean.astype(np.float32)
+        self.std = std.astype(np.float32)
+        self.W1 = None if W1 is None else W1.astype(np.float32)
+        self.b1 = None if b1 is None else b1.astype(np.float32)
+        self.W2 = W2.astype(np.float32)
+        self.b2 = b2.astype(np.float32)
+        self.extractor = LogMelExtractor(sample_rate=sample_rate, n_mels=n_mels)
+        self.neutral_index = self.labels.index(NEUTRAL_LABEL) if NEUTRAL_LABEL in self.labels else None
+
+        self.inferences = 0
+        self.total_us = 0.0
+
+    @classmethod
+    def load(cls, path=DEFAULT_MODEL_PATH):
+        data = np.load(path, allow_pickle=False)
+        return cls(
+            labels=list(data["labels"]),
+            mean=data["mean"], std=data["std"],
+            W1=data["W1"] if "W1" in data else None,
+            b1=data["b1"] if "b1" in data else None,
+            W2=data["W2"], b2=data["b2"],
+            sample_rate=int(data["sample_rate"]), n_mels=int(data["n_mels"])
+        )
+
+    def save(self, path):
+        arrays = {"labels": np.array(self.labels), "mean": self.mean, "std": self.std,
+                  "W2": self.W2, "b2": self.b2,
+                  "sample_rate": self.extractor.sample_rate, "n_mels": self.extractor.n_mels}
+        if self.W1 is not None:
+            arrays.update(W1=self.W1, b1=self.b1)
+        np.savez(path, **arrays)
+
+    def predict_features(self, X):
+        """Class probabilities for a (n, num_features) feature matrix"""
+        h = (np.atleast_2d(X) - self.mean) / self.std
+        if self.W1 is not None:
+            h = np.maximum(h @ self.W1 + self.b1, 0)
+        logits = h @ self.W2 + self.b2
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def score(self, audio, sample_rate=16000):
+        """
+        Distress score for a clip: {"distress": P(not neutral), "label",
+        "classes": {label: probability}, "inference_us"}
+        """
+        start = time.perf_counter()
+        if sample_rate != self.extractor.sample_rate and len(audio) > 1:
+            num_out = int(round(len(audio) * self.extractor.sample_rate / sample_rate))
+            audio = np.interp(np.linspace(0, len(audio) - 1, num_out), np.arange(len(audio)),
+                              audio.astype(np.float32)).astype(np.int16)
+        probs = self.predict_features(self.extractor.features(audio))[0]
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        self.inferences += 1
+        self.total_us += elapsed_us
+
+        distress = 1.0 - float(probs[self.neutral_index]) if self.neutral_index is not None else float(probs.max())
+        return {
+            "distress": round(distress, 3),
+            "label": self.labels[int(probs.argmax())],
+            "classes": {label: round(float(p), 3) for label, p in zip(self.labels, probs)},
+            "inference_us": round(elapsed_us, 1)
+        }
+
+    def score_segment(self, audio, sample_rate=16000, window_seconds=1.5):
+        """
+        Distress score for a whole speech segment: the model is trained on
+        clips of window_seconds, so the segment is scored window by window
+        and the most distressed window wins (a short scream in a long
+        segment still counts). Same result dict as score().
+        """
+        window = int(window_seconds * sample_rate)
+        starts = list(range(0, max(len(audio) - window, 0) + 1, window))
+        if starts[-1] + window < len(audio):
+            starts.append(len(audio) - window)  # last window overlaps so the tail is scored too
+        best = None
+        for start in starts:
+            result = self.score(audio[start:start + window], sample_rate)
+            if best is None or result["distress"] > best["distress"]:
+                best = result
+        return best
+
+    def stats(self):
+        return {
+            "labels": self.labels,
+            "model": "mlp" if self.W1 is not None else "logistic",
+            "inferences": self.inferences,
+            "mean_inference_us": round(self.total_us / self.inferences, 1) if self.inferences else None
+        }
+
+
+def train_distress_model(X, y, labels, hidden=32, epochs=400, learning_rate=0.01, l2=1e-4,
+                         sample_rate=16000, n_mels=40, seed=0):
+    """
+    Fit a DistressClassifier on clip features with full-batch Adam.
+    X: (n, num_features) from LogMelExtractor.features
+    y: (n,) class indices into labels
+    hidden: hidden units (0 = softmax regression)
+    """
+    rng = np.random.default_rng(seed)
+    X = np.asarray(X, dtype=np.float32)
+    y = np.asarray(y)
+    mean = X.mean(axis=0)
+    std = X.std(axis=0) + 1e-6
+    Xn = (X - mean) / std
+    n, d = Xn.shape
+    k = len(labels)
+    onehot = np.eye(k, dtype=np.float32)[y]
+
+    params = {}
+    if hidden:
+        params["W1"] = (rng.standard_normal((d, hidden)) * np.sqrt(2.0 / d)).astype(np.float32)
+        params["b1"] = np.zeros(hidden, dtype=np.float32)
+        params["W2"] = (rng.standard_normal((hidden, k)) * np.sqrt(1.0 / hidden)).astype(np.float32)
+    else:
+        params["W2"] = np.zeros((d, k), dtype=np.float32)
+    params["b2"] = np.zeros(k, dtype=np.float32)
+    moments = {name: (np.zeros_like(p), np.zeros_like(p)) for name, p in params.items()}
+
+    for step in range(1, epochs + 1):
+        # Forward
+        h = np.maximum(Xn @ params["W1"] + params["b1"], 0) if hidden else Xn
+        logits = h @ params["W2"] + params["b2"]
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+
+        # Backward (softmax cross-entropy + L2)
+        dlogits = (probs - onehot) / n
+        grads = {"W2": h.T @ dlogits + l2 * params["W2"], "b2": dlogits.sum(axis=0)}
+        if hidden:
+            dh = (dlogits @ params["W2"].T) * (h > 0)
+            grads["W1"] = Xn.T @ dh + l2 * params["W1"]
+            grads["b1"] = dh.sum(axis=0)
+
+        for name, grad in grads.items():
+            m, v = moments[name]
+            m[:] = 0.9 * m + 0.1 * grad
+            v[:] = 0.999 * v + 0.001 * grad * grad
+            m_hat = m / (1 - 0.9 ** step)
+            v_hat = v / (1 - 0.999 ** step)
+            params[name] -= learning_rate * m_hat / (np.sqrt(v_hat) + 1e-8)
+
+    return DistressClassifier(labels, mean, std, params["W2"], params["b2"],
+                              W1=params.get("W1"), b1=params.get("b1"),
+                              sample_rate=sample_rate, n_mels=n_mels)
+
+
+def load_distress_classifier(path=None):
+    """The shipped/trained classifier, or None (with a note) if there is no weights file"""
+    path = path or os.getenv("DISTRESS_MODEL", DEFAULT_MODEL_PATH)
+    if not os.path.exists(path):
+        print(f"ℹ️  No distress model at {path} - every HIGH trigger and speech segment goes to Whisper")
+        return None
+    try:
+        classifier = DistressClassifier.load(path)
+        print(f"✅ Distress classifier loaded ({', '.join(classifier.labels)})")
+        return classifier
+    except Exception as e:
+        print(f"❌ Error loading distress classifier: {e}")
+        return None
@@ -0,0 +1,195 @@
+"""
+Live monitoring events for VoiceGuard
+
+The monitoring loop publishes what it sees (VAD state, threat level,
+incidents, SMS results and a periodic status line per stream) to an
+EventBroadcaster, and app.py streams them to browsers over server-sent
+events (/events).
+
+Publishing never waits on a client: every subscriber has its own bounded
+buffer, and when a slow or stalled client lets it fill up, the oldest
+event is dropped (and the client is told how many it missed). Publish is
+an append per subscriber plus waking its reader, so it is safe to call
+from the audio pipeline thread.
+
+PipelineEvents turns per-chunk pipeline state into events, only emitting
+on changes (speech start/end, threat level changes) plus a status event
+every status_interval seconds, so a stream adds a handful of events per
+second at most.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+from utils.metrics import metrics
+
+EVENTS_DROPPED = metrics.counter("voiceguard_events_dropped_total",
+                                 "Live events dropped from full client buffers")
+
+
+class Subscription:
+    """One client's bounded event buffer"""
+    def __init__(self, broadcaster, max_buffer=256, types=None):
+        """types: only these event types (None = all)"""
+        self.broadcaster = broadcaster
+        self.buffer = deque(maxlen=max_buffer)
+        self.types = set(types) if types else None
+        self.ready = threading.Event()
+        self.closed = False
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.delivered = 0
+
+    def push(self, event):
+        """Publisher side: never blocks, drops the oldest event when full"""
+        if self.types is not None and event["type"] not in self.types:
+            return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+            EVENTS_DROPPED.inc()
+        self.buffer.append(event)
+        if not self.ready.is_set():
+            self.ready.set()
+
+    def get(self, timeout=None):
+        """
+        Next event, or None after `timeout` seconds without one (or once
+        closed). After drops, a "dropped" event with the count comes first.
+        """
+        if self.closed:
+            return None
+        if not self.buffer:
+            self.ready.clear()
+            # Re-check: an event may have arrived between the test and clear()
+            if not self.buffer:
+                self.ready.wait(timeout)
+            if self.closed or not self.buffer:
+                return None
+        if self.dropped > self.reported_dropped:
+            missed = self.dropped - self.reported_dropped
+            self.reported_dropped = self.dropped
+            return {"id": None, "type": "dropped", "time": time.time(), "data": {"count": missed}}
+        self.delivered += 1
+        return self.buffer.popleft()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+        self.broadcaster.unsubscribe(self)
+
+
+class EventBroadcaster:
+    def __init__(self, history=100):
+        """history: recent events kept for clients that reconnect (Last-Event-ID)"""
+        self.subscribers = ()  # replaced, never mutated, so publish needs no lock
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.history = deque(maxlen=history)
+        self.published = 0
+
+    def subscribe(self, max_buffer=256, types=None, last_event_id=None):
+        """
+        New subscription. With last_event_id, events after it that are still
+        in the history are replayed first.
+        """
+        subscription = Subscription(self, max_buffer, types)
+        with self.lock:
+            if last_event_id is not None:
+                for event in list(self.history):
+                    if event["id"] > last_event_id:
+                        subscription.push(event)
+            self.subscribers = self.subscribers + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers = tuple(s for s in self.subscribers if s is not subscription)
+
+    def publish(self, event_type, **data):
+        """Send an event to every subscriber; returns the event"""
+        event = {"id": next(self.ids), "type": event_type, "time": time.time(), "data": data}
+        self.history.append(event)
+        self.published += 1
+        for subscription in self.subscribers:
+            subscription.push(event)
+        return event
+
+    def stats(self):
+        subscribers = self.subscribers
+        return {
+            "subscribers": len(subscribers),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in subscribers),
+            "buffered": sum(len(s.buffer) for s in subscribers)
+        }
+
+
+def format_sse(event):
+    """Server-sent events wire format for one event"""
+    lines = []
+    if event["id"] is not None:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    payload = dict(event["data"], time=event["time"])
+    lines.append(f"data: {json.dumps(payload, ensure_ascii=False, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class PipelineEvents:
+    def __init__(self, broadcaster, stream_id, status_interval=1.0):
+        """
+        Pipeline on_chunk callback that publishes a stream's state changes
+        status_interval: seconds between "status" events (0 disables)
+        """
+        self.broadcaster = broadcaster
+        self.stream_id = stream_id
+        self.status_interval = status_interval
+        self.in_speech = False
+        self.threat_level = None
+        self.last_status = 0.0
+
+    def __call__(self, pipeline, chunk):
+        publish = self.broadcaster.publish
+        if chunk.in_speech != self.in_speech:
+            self.in_speech = chunk.in_speech
+            publish("vad", stream_id=self.stream_id, in_speech=chunk.in_speech,
+                    offset=chunk.offset)
+
+        # Silence stops at the VAD stage without a threat level
+        threat_level = chunk.threat_level or "NONE"
+        if threat_level != self.threat_level:
+            self.threat_level = threat_level
+            publish("threat", stream_id=self.stream_id, threat_level=threat_level,
+                    volume=round(chunk.volume or 0.0, 1),
+                    speech_confidence=round(chunk.speech_confidence, 2),
+                    shout_ratio=round(chunk.shout_ratio, 2),
+                    distress=chunk.distress["distress"] if chunk.distress else None)
+        if chunk.incident_submitted:
+            publish("incident_pending", stream_id=self.stream_id, timestamp=chunk.timestamp)
+
+        now = time.time()
+        if self.status_interval and now - self.last_status >= self.status_interval:
+            self.last_status = now
+            publish("status", stream_id=self.stream_id, running=pipeline.is_running,
+                    total_chunks=pipeline.total_chunks, speech_chunks=pipeline.speech_chunks,
+                    high_threat_chunks=pipeline.high_threat_chunks,
+                    in_speech=self.in_speech, threat_level=self.threat_level)
+
+
+def incident_event(incident):
+    """Compact incident event payload (no audio paths or full analysis)"""
+    speech_analysis = incident.get("speech_analysis") or {}
+    transcription = speech_analysis.get("transcription") or {}
+    text_analysis = speech_analysis.get("text_analysis") or {}
+    return {
+        "incident_id": incident["incident_id"],
+        "stream_id": incident.get("stream_id"),
+        "timestamp": incident["timestamp"],
+        "threat_level": incident["threat_level"],
+        "transcript": transcription.get("text", ""),
+        "text_threat_level": text_analysis.get("threat_level"),
+        "keywords": text_analysis.get("keywords_found", []),
+        "sms_recipients": incident.get("sms_recipients", 0)
+    }
@@ -0,0 +1,220 @@
+"""
+Evidence audio writer for VoiceGuard
+
+Incident audio is written as int16 PCM (WAV), lossless FLAC or Opus on a
+background I/O thread, so recording an incident and sending alerts never
+wait on the disk. An evidence file is a stream: it starts with the
+pre-roll window that triggered the incident and can keep receiving the
+audio that arrives afterwards (post-roll) until it is closed.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+import soundfile as sf
+
+# name -> (soundfile format, subtype, file extension)
+EVIDENCE_FORMATS = {
+    "wav": ("WAV", "PCM_16", ".wav"),
+    "flac": ("FLAC", "PCM_16", ".flac"),
+    "opus": ("OGG", "OPUS", ".ogg"),
+}
+
+
+class EvidenceStream:
+    """One evidence file being written: pre-roll first, then live audio"""
+    def __init__(self, writer, incident_id, path, audio_format, sample_rate,
+                 start_offset=None, post_roll_samples=0, stream_id=None, on_complete=None):
+        self.writer = writer
+        self.incident_id = incident_id
+        self.path = path
+        self.audio_format = audio_format
+        self.sample_rate = sample_rate
+        self.stream_id = stream_id
+        self.next_offset = start_offset      # absolute sample offset of the next sample wanted
+        self.remaining = post_roll_samples   # post-roll samples still to append
+        self.on_complete = on_complete
+        self.samples_written = 0
+        self.gap_samples = 0                 # live audio lost before it could be appended
+        self.closed = False
+        self.error = None
+        self.file = None
+        self.future = Future()
+
+    def append(self, audio_data, end_offset=None):
+        """
+        Queue more audio; closes the stream once the post-roll is complete.
+        end_offset: absolute offset just past audio_data. If the audio read
+                    for [next_offset, end_offset) came back shorter (its
+                    start had already left the ring buffer), the missing
+                    samples are recorded as a gap and next_offset still
+                    moves to end_offset, so nothing is read twice.
+        """
+        if self.closed:
+            return
+        if end_offset is not None and self.next_offset is not None:
+            lost = end_offset - self.next_offset - len(audio_data)
+            if lost > 0:
+                if not self.gap_samples:
+                    print(f"⚠️  Evidence {self.incident_id}: {lost / self.sample_rate:.1f}s of "
+                          f"post-roll left the buffer before it was written")
+                self.gap_samples += lost
+            self.next_offset = end_offset
+        elif self.next_offset is not None:
+            self.next_offset += len(audio_data)
+        audio_data = audio_data[:self.remaining]
+        if len(audio_data):
+            self.remaining -= len(audio_data)
+            self.writer.submit(lambda: self._write(audio_data))
+        if self.remaining <= 0:
+            self.close()
+
+    def close(self):
+        """Finish the file (remaining post-roll is skipped)"""
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.submit(self._finish)
+
+    # --- I/O thread ---
+    def _open(self):
+        sf_format, subtype, _ = EVIDENCE_FORMATS[self.audio_format]
+        self.file = sf.SoundFile(self.path, 'w', samplerate=self.sample_rate, channels=1,
+                                 format=sf_format, subtype=subtype)
+
+    def _write(self, audio_data):
+        if self.error:
+            return
+        try:
+            if self.file is None:
+                self._open()
+            self.file.write(audio_data)
+            self.samples_written += len(audio_data)
+        except Exception as e:
+            print(f"❌ Error saving audio: {e}")
+            self.error = str(e)
+
+    def _finish(self):
+        try:
+            if self.file is not None:
+                self.file.close()
+        except Exception as e:
+            self.error = self.error or str(e)
+
+        saved = self.error is None and self.samples_written > 0
+        result = {
+            "incident_id": self.incident_id,
+            "audio_file": self.path if saved else None,
+            "audio_saved": saved,
+            "audio_format": self.audio_format,
+            "audio_bytes": os.path.getsize(self.path) if saved else 0,
+            "audio_duration_seconds": self.samples_written / self.sample_rate,
+            "audio_gap_seconds": round(self.gap_samples / self.sample_rate, 3),
+            "error": self.error,
+        }
+        self.writer.record_result(result)
+        if self.on_complete:
+            try:
+                self.on_complete(result)
+            except Exception as e:
+                print(f"❌ Evidence callback failed: {e}")
+        self.future.set_result(result)
+
+
+class EvidenceWriter:
+    def __init__(self, audio_dir="evidence", audio_format="flac", background=True):
+        """
+        audio_format: "wav" (int16 PCM), "flac" (lossless) or "opus"
+        background: write on a dedicated I/O thread (False writes inline)
+        """
+        if audio_format not in EVIDENCE_FORMATS:
+            raise ValueError(f"Unknown evidence format: {audio_format}")
+        sf_format, subtype, _ = EVIDENCE_FORMATS[audio_format]
+        if subtype not in sf.available_subtypes(sf_format):
+            print(f"⚠️  libsndfile has no {audio_format} support, writing FLAC evidence instead")
+            audio_format = "flac"
+
+        self.audio_dir = audio_dir
+        self.audio_format = audio_format
+        self.background = background
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+        self.files_written = 0
+        self.bytes_written = 0
+
+    def path_for(self, incident_id):
+        return os.path.join(self.audio_dir, incident_id + EVIDENCE_FORMATS[self.audio_format][2])
+
+    def open_stream(self, incident_id, audio_data, sample_rate=16000, start_offset=None,
+                    post_roll_seconds=0, stream_id=None, on_complete=None):
+        """
+        Start an evidence file with `audio_data` as pre-roll.
+        With post_roll_seconds > 0 the stream stays open for append();
+        start_offset (absolute sample offset of audio_data[0]) lets callers
+        continue exactly where the pre-roll ended.
+        """
+        stream = EvidenceStream(
+            self, incident_id, self.path_for(incident_id), self.audio_format, sample_rate,
+            start_offset=start_offset,
+            post_roll_samples=int(post_roll_seconds * sample_rate),
+            stream_id=stream_id,
+            on_complete=on_complete
+        )
+        if start_offset is not None:
+            stream.next_offset = start_offset + len(audio_data)
+        self.submit(lambda: stream._write(audio_data))
+        if stream.remaining <= 0:
+            stream.close()
+        return stream
+
+    def submit(self, operation):
+        if not self.background:
+            operation()
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="evidence-writer")
+                self.thread.daemon = True
+                self.thread.start()
+        self.queue.put(operation)
+
+    def _run(self):
+        while True:
+            operation = self.queue.get()
+            try:
+                if operation is None:
+                    return
+                operation()
+            finally:
+                self.queue.task_done()
+
+    def record_result(self, result):
+        with self.lock:
+            if result["audio_saved"]:
+                self.files_written += 1
+                self.bytes_written += result["audio_bytes"]
+
+    def flush(self):
+        """Block until every queued write has reached the disk"""
+        if self.background and self.thread is not None:
+            self.queue.join()
+
+    def stop(self):
+        """Flush and stop the I/O thread"""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "format": self.audio_format,
+                "files_written": self.files_written,
+                "bytes_written": self.bytes_written,
+                "queued_operations": self.queue.qsize(),
+            }
@@ -0,0 +1,195 @@
+"""
+Acoustic features for VoiceGuard
+
+FeatureExtractor computes per-frame features for a block of frames in one
+vectorized pass:
+- RMS and peak level
+- zero-crossing rate
+- spectral centroid and spectral flux (from one zero-padded real FFT)
+- a cheap pitch estimate: the autocorrelation peak in the voice range,
+  taken from the same FFT (power spectrum -> inverse FFT)
+
+The first two are the cheap level features: the VAD computes them for every
+frame it processes and shares them with its segment statistics and the
+threat scorer. The spectral ones cost an FFT per frame, so they are only
+computed on demand with compute_audio(): for loud chunks that could be
+shouting (ThreatStage) and once per incident for its trigger and speech
+segment (IncidentStage). Work buffers (float frames, window, padded FFT
+input, magnitudes) are preallocated and reused across calls.
+"""
+import numpy as np
+
+
+class FrameFeatures:
+    """
+    Feature arrays for a block of frames (one value per frame).
+    Without the spectral pass (spectral=False) centroid, flux, pitch and
+    voicing are all zero.
+    """
+    def __init__(self, rms, peak, zcr, centroid, flux, pitch, voicing, spectral=True):
+        self.rms = rms
+        self.peak = peak
+        self.zcr = zcr
+        self.centroid = centroid    # Hz
+        self.flux = flux
+        self.pitch = pitch          # Hz, 0 for unvoiced frames
+        self.voicing = voicing      # normalized autocorrelation peak, 0-1
+        self.spectral = spectral
+
+    @classmethod
+    def empty(cls):
+        nothing = np.zeros(0, dtype=np.float32)
+        return cls(nothing, nothing, nothing, nothing, nothing, nothing, nothing, spectral=False)
+
+    def __len__(self):
+        return len(self.rms)
+
+    @property
+    def overall_rms(self):
+        """RMS over every frame together"""
+        return float(np.sqrt(np.mean(self.rms ** 2))) if len(self.rms) else 0.0
+
+    def shout_ratio(self, loud_rms, min_pitch=250.0):
+        """Fraction of frames that are loud and voiced at a raised pitch"""
+        if not len(self.rms):
+            return 0.0
+        return float(np.mean((self.rms > loud_rms) & (self.pitch >= min_pitch)))
+
+    def summary(self):
+        """Compact per-block summary (for logs and incident metadata)"""
+        if not len(self.rms):
+            return {"frames": 0}
+        summary = {
+            "frames": len(self.rms),
+            "rms": round(self.overall_rms, 1),
+            "peak": int(self.peak.max()),
+            "zcr": round(float(self.zcr.mean()), 3),
+        }
+        if self.spectral:
+            voiced = self.pitch > 0
+            summary.update({
+                "centroid_hz": round(float(self.centroid.mean()), 1),
+                "flux": round(float(self.flux.mean()), 2),
+                "voiced_ratio": round(float(voiced.mean()), 3),
+                "pitch_hz": round(float(np.median(self.pitch[voiced])), 1) if voiced.any() else None
+            })
+        return summary
+
+
+class FeatureExtractor:
+    def __init__(self, sample_rate=16000, frame_size=480, n_fft=1024, min_pitch=60, max_pitch=500,
+                 voicing_threshold=0.3, min_voiced_rms=100, max_frames=8):
+        """
+        frame_size: samples per frame (480 = the VAD's 30 ms at 16 kHz)
+        n_fft: FFT length; at least 2 x frame_size so the autocorrelation
+               taken from the power spectrum does not wrap around
+        min_pitch/max_pitch: pitch search range (Hz)
+        voicing_threshold: autocorrelation peak needed to call a frame voiced
+        min_voiced_rms: quieter frames never get a pitch
+        max_frames: initial buffer capacity (grown on demand)
+        """
+        self.sample_rate = sample_rate
+        self.frame_size = frame_size
+        self.n_fft = max(n_fft, 2 * frame_size)
+        self.voicing_threshold = voicing_threshold
+        self.min_voiced_rms = min_voiced_rms
+        self.min_lag = max(1, int(sample_rate / max_pitch))
+        self.max_lag = min(frame_size - 1, int(sample_rate / min_pitch))
+
+        self.window = np.hanning(frame_size).astype(np.float32)
+        # Magnitudes scaled to sample amplitude units
+        self.magnitude_scale = np.float32(2.0 / self.window.sum())
+        self.freqs = np.fft.rfftfreq(self.n_fft, 1.0 / sample_rate).astype(np.float32)
+        self.prev_magnitude = np.zeros(self.n_fft // 2 + 1, dtype=np.float32)
+        self.has_prev = False
+        self.capacity = 0
+        self._allocate(max_frames)
+        self.frames_processed = 0
+
+    def _allocate(self, frames):
+        self.capacity = frames
+        self.frames_float = np.zeros((frames, self.frame_size), dtype=np.float32)
+        self.padded = np.zeros((frames, self.n_fft), dtype=np.float32)
+        self.magnitude = np.zeros((frames, self.n_fft // 2 + 1), dtype=np.float32)
+        self.power = np.zeros((frames, self.n_fft // 2 + 1), dtype=np.float32)
+
+    def reset(self):
+        """Forget the previous spectrum (start of a new stream, or a gap)"""
+        self.has_prev = False
+
+    def compute(self, frames, spectral=True):
+        """
+        Features for a (num_frames, frame_size) int16 or float array of
+        consecutive frames; spectral flux continues across calls.
+        spectral: False for the cheap level features only (RMS, peak, ZCR),
+                  with zero centroid/flux/pitch
+        """
+        n = len(frames)
+        if n == 0:
+            return FrameFeatures.empty()
+        if n > self.capacity:
+            self._allocate(max(n, 2 * self.capacity))
+
+        x = self.frames_float[:n]
+        np.copyto(x, frames, casting='unsafe')
+
+        # Level
+        rms = np.sqrt(np.einsum('ij,ij->i', x, x) / self.frame_size)
+        peak = np.abs(x).max(axis=1)
+        signs = np.signbit(x)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (self.frame_size - 1)
+        self.frames_processed += n
+
+        if not spectral:
+            self.reset()
+            zeros = np.zeros(n, dtype=np.float32)
+            return FrameFeatures(rms, peak, zcr, zeros, zeros, zeros, zeros, spectral=False)
+        return self._spectral(x, rms, peak, zcr)
+
+    def compute_audio(self, audio, spectral=True):
+        """
+        Features for a stretch of int16 audio cut into frames (a trailing
+        partial frame is dropped); flux starts fresh at its first frame
+        """
+        self.reset()
+        n = len(audio) // self.frame_size
+        return self.compute(np.asarray(audio[:n * self.frame_size]).reshape(n, self.frame_size),
+                            spectral=spectral)
+
+    def _spectral(self, x, rms, peak, zcr):
+        n = len(x)
+
+        # Spectrum: windowed frames in the zero-padded FFT buffer
+        padded = self.padded[:n]
+        np.multiply(x, self.window, out=padded[:, :self.frame_size])
+        spectrum = np.fft.rfft(padded, axis=1)
+        magnitude = np.abs(spectrum, out=self.magnitude[:n])
+        magnitude *= self.magnitude_scale
+
+        total = magnitude.sum(axis=1)
+        centroid = (magnitude @ self.freqs) / np.maximum(total, 1e-9)
+
+        # Flux: positive spectral change from the previous frame
+        flux = np.zeros(n, dtype=np.float32)
+        if self.has_prev:
+            rise = np.maximum(magnitude[0] - self.prev_magnitude, 0)
+            flux[0] = np.sqrt(np.dot(rise, rise))
+        if n > 1:
+            rises = np.maximum(magnitude[1:] - magnitude[:-1], 0)
+            flux[1:] = np.sqrt(np.einsum('ij,ij->i', rises, rises))
+        self.prev_magnitude[:] = magnitude[-1]
+        self.has_prev = True
+
+        # Pitch: autocorrelation (inverse FFT of the power spectrum), peak in the voice range
+        loud_enough = rms >= self.min_voiced_rms
+        if not loud_enough.any():
+            zeros = np.zeros(n, dtype=np.float32)
+            return FrameFeatures(rms, peak, zcr, centroid, flux, zeros, zeros)
+        power = np.square(magnitude, out=self.power[:n])
+        autocorr = np.fft.irfft(power, n=self.n_fft, axis=1)
+        search = autocorr[:, self.min_lag:self.max_lag + 1]
+        lag = search.argmax(axis=1)
+        voicing = search[np.arange(n), lag] / np.maximum(autocorr[:, 0], 1e-9)
+        voiced = (voicing >= self.voicing_threshold) & loud_enough
+        pitch = np.where(voiced, self.sample_rate / (lag + self.min_lag), 0.0)
+        return FrameFeatures(rms, peak, zcr, centroid, flux, pitch, np.clip(voicing, 0, 1))
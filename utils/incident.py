@@ -2,52 +2,85 @@
 Incident recording and management for VoiceGuard (Updated with Speech Analysis)
 """
 import json
-import time
 import os
-import numpy as np
-import soundfile as sf
+import threading
+import time
 from datetime import datetime
+from utils.evidence import EvidenceWriter
+from utils.incident_index import IncidentIndex
+from utils.metrics import add_trace_spans, metrics
+
+INCIDENT_WRITE_MS = metrics.histogram("voiceguard_incident_write_ms",
+                                      "Incident JSON write (ms)")
+INCIDENTS = metrics.counter("voiceguard_incidents_total", "Incidents recorded", ("threat_level",))
 
 class IncidentRecorder:
-    def __init__(self, incidents_dir="incidents", audio_dir="evidence"):
+    def __init__(self, incidents_dir="incidents", audio_dir="evidence", evidence_format="flac",
+                 post_roll_seconds=0, background_writes=True, outbox=None, alert_contacts=None,
+                 on_alert=None):
+        """
+        evidence_format: "wav" (int16 PCM), "flac" or "opus"
+        post_roll_seconds: keep appending live audio to the evidence file
+                           for this long after the incident (needs an
+                           EvidenceStage in the pipeline to feed it)
+        background_writes: write evidence audio on a background I/O thread
+        outbox: AlertOutbox that SOS alerts for recorded incidents are queued in
+        alert_contacts: phone numbers alerted for every incident (see set_alert_contacts)
+        on_alert: optional callback(incident_id, results) after SMS results are stored
+        """
         self.incidents_dir = incidents_dir
         self.audio_dir = audio_dir
         self.incident_count = 0
+        self.post_roll_seconds = post_roll_seconds
+        self.lock = threading.Lock()
+        self.open_streams = {}  # incident_id -> EvidenceStream still receiving audio
+        self.pending_spans = {}  # incident_id -> trace spans added when the evidence is done
         
         # Create directories
         os.makedirs(incidents_dir, exist_ok=True)
         os.makedirs(audio_dir, exist_ok=True)
+
+        self.alert_contacts = list(alert_contacts or [])
+        self.on_alert = on_alert
+        self.outbox = outbox
+        if outbox is not None:
+            outbox.on_delivery = self.record_alert_results
+            outbox.start()
+
+        self.evidence_writer = EvidenceWriter(audio_dir, evidence_format, background=background_writes)
+
+        # Index for summaries and queries; import existing JSON files the
+        # first time an index is created next to them
+        self.index = IncidentIndex(os.path.join(incidents_dir, "index.db"))
+        if self.index.count() == 0 and any(f.endswith('.json') for f in os.listdir(incidents_dir)):
+            imported = self.index.rebuild(incidents_dir)
+            print(f"   Indexed {imported} existing incident(s)")
         
         print(f"📁 Incident recorder initialized")
         print(f"   Incidents: {incidents_dir}/")
-        print(f"   Audio evidence: {audio_dir}/")
+        print(f"   Audio evidence: {audio_dir}/ ({self.evidence_writer.audio_format})")
     
     def record_incident(self, threat_level, volume, speech_confidence, audio_data, 
-                       speech_analysis=None, sample_rate=16000):
-        """Record a new incident with audio evidence and speech analysis"""
+                       speech_analysis=None, sample_rate=16000, stream_id=None, start_offset=None,
+                       acoustic_features=None, trace=None):
+        """
+        Record a new incident with audio evidence and speech analysis.
+        The JSON is written right away; the evidence audio is written in the
+        background and the JSON is updated with its size once it is done.
+        start_offset: absolute sample offset of audio_data[0], needed to
+                      stream post-roll audio into the same file
+        acoustic_features: level/pitch/spectral summary of the trigger
+        trace: Trace of the analysis so far (see utils/metrics.py); the
+               write, evidence and SMS spans are added as they finish
+        """
         self.incident_count += 1
         timestamp = datetime.now()
         
         # Generate filenames
         incident_id = f"incident_{timestamp.strftime('%Y%m%d_%H%M%S')}_{self.incident_count:03d}"
-        json_file = os.path.join(self.incidents_dir, f"{incident_id}.json")
-        audio_file = os.path.join(self.audio_dir, f"{incident_id}.wav")
-        
-        # Save audio evidence
-        try:
-            # Convert int16 to float32 for soundfile
-            if audio_data.dtype == np.int16:
-                audio_float = audio_data.astype(np.float32) / 32768.0
-            else:
-                audio_float = audio_data.astype(np.float32)
-                
-            sf.write(audio_file, audio_float, sample_rate)
-            audio_saved = True
-            audio_duration = len(audio_data) / sample_rate
-        except Exception as e:
-            print(f"❌ Error saving audio: {e}")
-            audio_saved = False
-            audio_duration = 0
+        json_file = self.json_path(incident_id)
+        audio_file = self.evidence_writer.path_for(incident_id)
+        post_roll_seconds = self.post_roll_seconds if start_offset is not None else 0
         
         # Create incident record
         incident_data = {
@@ -56,21 +89,39 @@ class IncidentRecorder:
             "threat_level": threat_level,
             "volume": float(volume),
             "speech_confidence": float(speech_confidence),
-            "audio_file": audio_file if audio_saved else None,
-            "audio_duration_seconds": audio_duration,
-            "audio_saved": audio_saved,
+            "audio_file": audio_file,
+            "audio_format": self.evidence_writer.audio_format,
+            "audio_duration_seconds": len(audio_data) / sample_rate,
+            "audio_post_roll_seconds": post_roll_seconds,
+            "audio_saved": False,
+            "audio_status": "writing",
             "sample_rate": sample_rate,
+            "sms_recipients": len(self.alert_contacts) if self.outbox is not None else 0,
             "detection_system": "VoiceGuard v1.0"
         }
         
+        # Tag the monitored stream when running several
+        if stream_id is not None:
+            incident_data["stream_id"] = stream_id
+
+        if acoustic_features:
+            incident_data["acoustic_features"] = acoustic_features
+
         # Add speech analysis if available
         if speech_analysis:
             incident_data["speech_analysis"] = speech_analysis
+
+        if trace is not None:
+            incident_data["trace"] = trace.to_dict()
         
         # Save incident JSON
         try:
-            with open(json_file, 'w') as f:
-                json.dump(incident_data, f, indent=2)
+            write_started = time.time()
+            with self.lock:
+                self._write_json(json_file, incident_data)
+            write_finished = time.time()
+            INCIDENT_WRITE_MS.observe((write_finished - write_started) * 1000)
+            INCIDENTS.labels(threat_level).inc()
             
             print(f"🚨 INCIDENT RECORDED: {incident_id}")
             print(f"   Threat: {threat_level}")
@@ -88,29 +139,174 @@ class IncidentRecorder:
                 if keywords:
                     print(f"   ⚠️  Keywords: {', '.join(keywords)}")
             
-            print(f"   💾 Evidence: {audio_file if audio_saved else 'Failed to save'}")
-            print(f"   ⏱️  Duration: {audio_duration:.1f}s")
-            
-            return incident_data
-            
         except Exception as e:
             print(f"❌ Error saving incident: {e}")
             return None
-    
-    def get_incident_summary(self):
-        """Get summary of all incidents"""
-        incidents = []
-        
-        if os.path.exists(self.incidents_dir):
-            for filename in os.listdir(self.incidents_dir):
-                if filename.endswith('.json'):
-                    try:
-                        with open(os.path.join(self.incidents_dir, filename), 'r') as f:
-                            incidents.append(json.load(f))
-                    except Exception as e:
-                        print(f"Error reading {filename}: {e}")
+
+        # The index is a side table: a failed insert must not drop the alert
+        # or the evidence (`python -m utils.incident_index rebuild` repairs it)
+        try:
+            self.index.add(incident_data, json_file=json_file)
+        except Exception as e:
+            print(f"⚠️  Error indexing incident {incident_id}: {e}")
+
+        # Queue SOS alerts; the outbox delivers them off the detection path
+        if self.outbox is not None and self.alert_contacts:
+            queued = self.outbox.enqueue(incident_id, self.alert_contacts)
+            print(f"   📮 SOS queued for {queued} contact(s)")
+
+        # The evidence update rewrites the JSON anyway; the spans go along
+        if trace is not None:
+            with self.lock:
+                self.pending_spans[incident_id] = [
+                    ("incident_write", write_started, write_finished, {}),
+                    ("evidence", time.time(), None, {"post_roll_seconds": post_roll_seconds}),
+                ]
+
+        # Save audio evidence (background I/O thread)
+        stream = self.evidence_writer.open_stream(
+            incident_id, audio_data,
+            sample_rate=sample_rate,
+            start_offset=start_offset,
+            post_roll_seconds=post_roll_seconds,
+            stream_id=stream_id,
+            on_complete=self._evidence_complete
+        )
+        if not stream.closed:
+            with self.lock:
+                self.open_streams[incident_id] = stream
+        print(f"   💾 Evidence: {audio_file}")
+        print(f"   ⏱️  Duration: {len(audio_data) / sample_rate:.1f}s"
+              + (f" + {post_roll_seconds}s post-roll" if post_roll_seconds else ""))
         
+        return incident_data
+
+    def json_path(self, incident_id):
+        return os.path.join(self.incidents_dir, f"{incident_id}.json")
+
+    def _write_json(self, json_file, incident_data):
+        # Write-then-rename so readers never see a half-written file
+        temp_file = json_file + ".tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(incident_data, f, indent=2)
+        os.replace(temp_file, json_file)
+
+    def update_incident(self, incident_id, updates):
+        """
+        Merge fields into an incident's JSON record.
+        updates: dict, or a function(incident_data) returning one
+        """
+        json_file = self.json_path(incident_id)
+        try:
+            with self.lock:
+                with open(json_file, 'r') as f:
+                    incident_data = json.load(f)
+                incident_data.update(updates(incident_data) if callable(updates) else updates)
+                self._write_json(json_file, incident_data)
+            return incident_data
+        except Exception as e:
+            print(f"❌ Error updating incident {incident_id}: {e}")
+            return None
+
+    def set_alert_contacts(self, contacts):
+        """Contacts alerted for incidents recorded from now on"""
+        self.alert_contacts = list(contacts)
+
+    def record_alert_results(self, incident_id, results):
+        """
+        Store per-recipient SMS results (attempts, time to delivery) with the
+        incident; results for recipients already recorded replace the old ones
+        """
+        settled_at = time.time()
+        def merge(incident_data):
+            alerts = {r["phone"]: r for r in incident_data.get("sms_alerts", [])}
+            alerts.update((r["phone"], r) for r in results)
+            queued_ms = max(r["queued_ms"] for r in results)
+            updates = {
+                "sms_alerts": list(alerts.values()),
+                "sms_delivered": sum(1 for r in alerts.values() if r["ok"]),
+                "sms_recipients": max(len(alerts), incident_data.get("sms_recipients", 0)),
+            }
+            updates.update(add_trace_spans(incident_data, [
+                ("sms", settled_at - queued_ms / 1000, settled_at,
+                 {"recipients": len(results), "delivered": sum(1 for r in results if r["ok"])})
+            ]))
+            return updates
+        incident_data = self.update_incident(incident_id, merge)
+        if self.on_alert:
+            self.on_alert(incident_id, results)
+        return incident_data
+
+    def _evidence_complete(self, result):
+        finished = time.time()
+        with self.lock:
+            self.open_streams.pop(result["incident_id"], None)
+            spans = self.pending_spans.pop(result["incident_id"], [])
+        def merge(incident_data):
+            updates = {
+                "audio_file": result["audio_file"],
+                "audio_saved": result["audio_saved"],
+                "audio_status": "saved" if result["audio_saved"] else "failed",
+                "audio_bytes": result["audio_bytes"],
+                "audio_duration_seconds": result["audio_duration_seconds"],
+            }
+            if result.get("audio_gap_seconds"):
+                updates["audio_gap_seconds"] = result["audio_gap_seconds"]
+            updates.update(add_trace_spans(incident_data, [
+                (name, start, end or finished, attrs) for name, start, end, attrs in spans
+            ]))
+            return updates
+        self.update_incident(result["incident_id"], merge)
+        if result["audio_saved"]:
+            print(f"💾 Evidence saved: {result['audio_file']} "
+                  f"({result['audio_bytes'] / 1024:.0f} KB, {result['audio_duration_seconds']:.1f}s)")
+        else:
+            print(f"❌ Evidence for {result['incident_id']} failed: {result['error']}")
+
+    def get_open_streams(self, stream_id=None):
+        """Evidence files still waiting for post-roll audio from a stream"""
+        with self.lock:
+            return [s for s in self.open_streams.values() if s.stream_id == stream_id]
+
+    def close_streams(self, stream_id=None):
+        """Finish every open evidence file of a stream (e.g. when it stops)"""
+        for stream in self.get_open_streams(stream_id):
+            stream.close()
+
+    def flush(self):
+        """Wait for queued evidence writes to finish"""
+        self.evidence_writer.flush()
+
+    def close(self):
+        """Finish evidence writes and stop the alert outbox (queued alerts persist)"""
+        self.flush()
+        if self.outbox is not None:
+            self.outbox.stop()
+
+    def query_incidents(self, start=None, end=None, threat_level=None, keyword=None,
+                        limit=50, offset=0, load=False):
+        """
+        Page through incidents (newest first) using the index.
+        load: return the full incident JSON instead of the index rows
+        """
+        rows = self.index.query(start, end, threat_level, keyword, limit, offset)
+        if not load:
+            return rows
+
+        incidents = []
+        for row in rows:
+            try:
+                with open(row["json_file"], 'r') as f:
+                    incidents.append(json.load(f))
+            except Exception as e:
+                print(f"Error reading {row['json_file']}: {e}")
+        return incidents
+
+    def get_incident_summary(self, limit=20):
+        """Get summary of incidents: totals plus the most recent ones"""
+        counts = self.index.counts()
         return {
-            "total_incidents": len(incidents),
-            "incidents": sorted(incidents, key=lambda x: x['timestamp'], reverse=True)
+            "total_incidents": sum(counts.values()),
+            "by_threat_level": counts,
+            "incidents": self.query_incidents(limit=limit, load=True)
         }
@@ -0,0 +1,192 @@
+"""
+Incident index for VoiceGuard
+
+Incidents are still written as one JSON file each, but every recorded
+incident is also added to a small SQLite index. Summaries and dashboard
+queries (time range, threat level, keyword, pagination) run against the
+index instead of listing and parsing the whole incidents directory, and
+per-threat-level counts are kept in a counter table so totals are O(1).
+
+Rebuild the index from existing JSON files with:
+    python -m utils.incident_index rebuild [--incidents-dir incidents]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS incidents (
+    incident_id TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    threat_level TEXT,
+    text_threat_level TEXT,
+    stream_id TEXT,
+    transcript TEXT,
+    json_file TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_incidents_timestamp ON incidents (timestamp);
+CREATE INDEX IF NOT EXISTS idx_incidents_level_time ON incidents (threat_level, timestamp);
+
+CREATE TABLE IF NOT EXISTS incident_keywords (
+    incident_id TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    PRIMARY KEY (keyword, incident_id)
+);
+
+CREATE TABLE IF NOT EXISTS incident_counts (
+    threat_level TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+"""
+
+COLUMNS = ("incident_id", "timestamp", "threat_level", "text_threat_level",
+           "stream_id", "transcript", "json_file")
+
+
+class IncidentIndex:
+    def __init__(self, db_path="incidents/index.db"):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # One connection shared by the recorder and request threads
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def add(self, incident_data, json_file=None):
+        """Index one incident (re-adding an incident_id replaces it)"""
+        analysis = incident_data.get("speech_analysis") or {}
+        transcript = (analysis.get("transcription") or {}).get("text", "")
+        text_analysis = analysis.get("text_analysis") or {}
+        keywords = {k.lower() for k in text_analysis.get("keywords_found", [])}
+        threat_level = incident_data.get("threat_level")
+
+        with self.lock, self.conn:
+            previous = self.conn.execute(
+                "SELECT threat_level FROM incidents WHERE incident_id = ?",
+                (incident_data["incident_id"],)
+            ).fetchone()
+            if previous:
+                self._bump_count(previous[0], -1)
+                self.conn.execute("DELETE FROM incident_keywords WHERE incident_id = ?",
+                                  (incident_data["incident_id"],))
+
+            self.conn.execute(
+                "INSERT OR REPLACE INTO incidents VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (incident_data["incident_id"], incident_data["timestamp"], threat_level,
+                 text_analysis.get("threat_level"), incident_data.get("stream_id"),
+                 transcript, json_file)
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO incident_keywords VALUES (?, ?)",
+                [(incident_data["incident_id"], keyword) for keyword in keywords]
+            )
+            self._bump_count(threat_level, 1)
+
+    def _bump_count(self, threat_level, delta):
+        self.conn.execute(
+            "INSERT INTO incident_counts VALUES (?, ?) "
+            "ON CONFLICT(threat_level) DO UPDATE SET count = count + excluded.count",
+            (threat_level or "UNKNOWN", delta)
+        )
+
+    def counts(self):
+        """Incidents per threat level (O(1), from the counter table)"""
+        with self.lock:
+            rows = self.conn.execute("SELECT threat_level, count FROM incident_counts WHERE count > 0").fetchall()
+        return dict(rows)
+
+    def count(self, threat_level=None):
+        counts = self.counts()
+        if threat_level is None:
+            return sum(counts.values())
+        return counts.get(threat_level, 0)
+
+    def query(self, start=None, end=None, threat_level=None, keyword=None, limit=50, offset=0):
+        """
+        Newest-first page of incidents.
+        start/end: ISO timestamps (inclusive range)
+        threat_level: audio threat level, e.g. "HIGH"
+        keyword: a keyword found in the transcript analysis
+        """
+        sql = "SELECT i.incident_id, i.timestamp, i.threat_level, i.text_threat_level, " \
+              "i.stream_id, i.transcript, i.json_file FROM incidents i"
+        where, params = [], []
+        if keyword:
+            sql += " JOIN incident_keywords k ON k.incident_id = i.incident_id"
+            where.append("k.keyword = ?")
+            params.append(keyword.lower())
+        if start:
+            where.append("i.timestamp >= ?")
+            params.append(start)
+        if end:
+            where.append("i.timestamp <= ?")
+            params.append(end)
+        if threat_level:
+            where.append("i.threat_level = ?")
+            params.append(threat_level)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY i.timestamp DESC LIMIT ? OFFSET ?"
+        params.extend([int(limit), int(offset)])
+
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM incidents")
+            self.conn.execute("DELETE FROM incident_keywords")
+            self.conn.execute("DELETE FROM incident_counts")
+
+    def rebuild(self, incidents_dir):
+        """Re-import every incident JSON file in a directory"""
+        self.clear()
+        imported = 0
+        if os.path.exists(incidents_dir):
+            for filename in os.listdir(incidents_dir):
+                if filename.endswith('.json'):
+                    path = os.path.join(incidents_dir, filename)
+                    try:
+                        with open(path, 'r') as f:
+                            self.add(json.load(f), json_file=path)
+                        imported += 1
+                    except Exception as e:
+                        print(f"Error reading {filename}: {e}")
+        return imported
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VoiceGuard incident index")
+    parser.add_argument("command", choices=["rebuild", "query"])
+    parser.add_argument("--incidents-dir", default="incidents")
+    parser.add_argument("--threat-level")
+    parser.add_argument("--keyword")
+    parser.add_argument("--start", help="ISO timestamp")
+    parser.add_argument("--end", help="ISO timestamp")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--offset", type=int, default=0)
+    args = parser.parse_args()
+
+    index = IncidentIndex(os.path.join(args.incidents_dir, "index.db"))
+    if args.command == "rebuild":
+        imported = index.rebuild(args.incidents_dir)
+        print(f"📁 Indexed {imported} incident(s) from {args.incidents_dir}/")
+    else:
+        for row in index.query(args.start, args.end, args.threat_level, args.keyword,
+                               args.limit, args.offset):
+            print(f"{row['timestamp']}  {row['incident_id']}  {row['threat_level']}  {row['transcript'] or ''}")
+        print(f"📊 Total incidents: {index.count()} {index.counts()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Compiled keyword matching for VoiceGuard threat analysis
+
+The whole lexicon (English + Hinglish, all categories) is compiled into a
+single regular expression shaped like a trie, so a transcript is scanned
+once and the work per character depends on the depth of the trie, not on
+how many terms the lexicon holds. Matches respect word boundaries, so
+"die" no longer fires on "studied" or "hit" on "white".
+"""
+import json
+import os
+import re
+
+DEFAULT_LEXICON_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    "data", "threat_keywords.json")
+
+_WILDCARD = "*"
+_FORMS = "|"  # separates the forms of one term
+_END = ""  # trie key marking the end of a term
+
+
+def _normalize(term):
+    return " ".join(term.lower().split())
+
+
+def _trie_pattern(node):
+    """Regex for a trie node: alternation of its children, optional if it is also a term end"""
+    branches = []
+    single_chars = []
+    for char, child in sorted(node.items()):
+        if char in (_END, _WILDCARD):
+            continue
+        piece = r"\s+" if char == " " else re.escape(char)
+        if len(child) == 1 and _END in child:
+            single_chars.append(piece)
+        else:
+            branches.append(piece + _trie_pattern(child))
+
+    if single_chars:
+        if len(single_chars) == 1:
+            branches.append(single_chars[0])
+        elif all(len(c) == 1 for c in single_chars):
+            branches.append("[" + "".join(single_chars) + "]")
+        else:
+            branches.extend(single_chars)
+
+    if _WILDCARD in node:
+        # Prefix term: any word ending is allowed here
+        branches.append(r"\w*")
+
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if _END in node and _WILDCARD not in node:
+        pattern = "(?:" + pattern + ")?"
+    return pattern
+
+
+class KeywordMatcher:
+    def __init__(self, categories):
+        """
+        categories: {name: {"weight": float, "terms": [str, ...]}}
+        A term ending in "*" matches any word starting with it. Forms of one
+        term are joined with "|" ("hit|hits|hitting") and count as the first.
+        """
+        self.exact = {}     # normalized form -> (term, category, weight)
+        self.prefixes = {}  # normalized prefix -> (term, category, weight)
+        trie = {}
+
+        for category, spec in categories.items():
+            weight = float(spec.get("weight", 0.0))
+            for term in spec.get("terms", []):
+                forms = [form for form in term.split(_FORMS) if form.strip()]
+                if not forms:
+                    continue
+                keyword = _normalize(forms[0].rstrip(_WILDCARD))
+                for form in forms:
+                    wildcard = form.endswith(_WILDCARD)
+                    form = _normalize(form.rstrip(_WILDCARD))
+                    if not form:
+                        continue
+                    (self.prefixes if wildcard else self.exact)[form] = (keyword, category, weight)
+
+                    node = trie
+                    for char in form:
+                        node = node.setdefault(char, {})
+                    node[_WILDCARD if wildcard else _END] = True
+
+        self.term_count = len({entry[0] for entry in self.exact.values()} |
+                              {entry[0] for entry in self.prefixes.values()})
+        body = _trie_pattern(trie)
+        self.pattern = re.compile(r"(?<!\w)" + body + r"(?!\w)") if body else None
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_LEXICON_PATH):
+        """Load a lexicon JSON file (see data/threat_keywords.json)"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f)["categories"])
+
+    def _lookup(self, matched):
+        matched = _normalize(matched)
+        entry = self.exact.get(matched)
+        if entry:
+            return entry
+        # Wildcard term: the longest lexicon prefix of the matched word
+        for end in range(len(matched), 0, -1):
+            entry = self.prefixes.get(matched[:end])
+            if entry:
+                return entry
+        return None
+
+    def match(self, text):
+        """
+        Scan text once; returns the distinct terms found, in order of
+        appearance, as dicts with keyword, category, weight and count
+        """
+        if not text or self.pattern is None:
+            return []
+
+        hits = {}
+        for m in self.pattern.finditer(text.lower()):
+            entry = self._lookup(m.group())
+            if entry is None:
+                continue
+            keyword, category, weight = entry
+            if keyword in hits:
+                hits[keyword]["count"] += 1
+            else:
+                hits[keyword] = {"keyword": keyword, "category": category, "weight": weight, "count": 1}
+        return list(hits.values())
@@ -0,0 +1,260 @@
+"""
+Metrics and tracing for VoiceGuard
+
+Counters, gauges and histograms are preaggregated in memory, so recording
+on the per-chunk hot path is an integer add (counter) or a bisect into the
+bucket bounds plus two adds (histogram). There is no logging and no lock
+per update; each labeled series is written by one thread in practice (one
+pipeline thread per stream, one analysis worker), and the occasional lost
+increment when two threads share a series is accepted in exchange. Locks
+are only taken when a new label combination is first created and when the
+registry is scraped.
+
+The shared `metrics` registry is exposed by app.py as Prometheus text
+(/metrics) and JSON (/stats). Durations are in milliseconds, like every
+other timing VoiceGuard reports.
+
+Trace collects named spans for one incident (trigger -> queue -> speech
+analysis -> write -> evidence -> SMS); the spans are stored in the
+incident JSON under "trace".
+"""
+import bisect
+import threading
+import time
+
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+QUEUE_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0
+        self.created_at = time.time()
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        elapsed = time.time() - self.created_at
+        return {"value": self.value,
+                "per_sec": round(self.value / elapsed, 2) if elapsed > 0 else 0.0}
+
+
+class GaugeValue:
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def snapshot(self):
+        return {"value": self.value}
+
+
+class HistogramValue:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # per bucket, last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate from the buckets (linear within a bucket)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                if i == len(self.bounds):
+                    return float(lower)  # +Inf bucket: best we can say
+                return lower + (self.bounds[i] - lower) * (rank - seen) / count
+            seen += count
+        return float(self.bounds[-1])
+
+    def snapshot(self):
+        snapshot = {"count": self.count, "sum": round(self.sum, 2),
+                    "mean": round(self.sum / self.count, 2) if self.count else None}
+        for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            value = self.quantile(q)
+            snapshot[name] = round(value, 2) if value is not None else None
+        return snapshot
+
+
+class Metric:
+    """A named family of series, one per combination of label values"""
+    def __init__(self, kind, name, help, labelnames=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else None
+        self.series = {}  # label values tuple -> *Value
+        self.lock = threading.Lock()
+        # Unlabeled metrics are used directly: metric.inc() / metric.observe()
+        self.default = self.labels() if not self.labelnames else None
+
+    def labels(self, *values):
+        """The series for these label values (cache it on hot paths)"""
+        values = tuple(str(value) for value in values)
+        series = self.series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self.lock:
+                series = self.series.get(values)
+                if series is None:
+                    if self.kind == "histogram":
+                        series = HistogramValue(self.buckets)
+                    elif self.kind == "gauge":
+                        series = GaugeValue()
+                    else:
+                        series = CounterValue()
+                    self.series[values] = series
+        return series
+
+    def inc(self, amount=1):
+        self.default.inc(amount)
+
+    def set(self, value):
+        self.default.set(value)
+
+    def observe(self, value):
+        self.default.observe(value)
+
+    def items(self):
+        with self.lock:
+            return list(self.series.items())
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value):
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+
+    def _get(self, kind, name, help, labelnames, buckets=None):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = Metric(kind, name, help, labelnames, buckets)
+            elif metric.kind != kind or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already registered as a {metric.kind} "
+                                 f"with labels {metric.labelnames}")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get("counter", name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get("gauge", name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS_MS):
+        return self._get("histogram", name, help, labelnames, buckets)
+
+    def render_prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for values, series in metric.items():
+                if metric.kind == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float("inf"),), list(series.counts)):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else _format_number(bound)
+                        labels = _format_labels(metric.labelnames, values, ("le", le))
+                        lines.append(f"{metric.name}_bucket{labels} {cumulative}")
+                    labels = _format_labels(metric.labelnames, values)
+                    lines.append(f"{metric.name}_sum{labels} {_format_number(float(series.sum))}")
+                    lines.append(f"{metric.name}_count{labels} {cumulative}")
+                else:
+                    labels = _format_labels(metric.labelnames, values)
+                    lines.append(f"{metric.name}{labels} {_format_number(series.value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """JSON-friendly view: {name: {"type", "help", "series": [{labels..., values...}]}}"""
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        result = {"uptime_seconds": round(time.time() - self.started_at, 1), "metrics": {}}
+        for metric in metrics:
+            result["metrics"][metric.name] = {
+                "type": metric.kind,
+                "help": metric.help,
+                "series": [dict(zip(metric.labelnames, values), **series.snapshot())
+                           for values, series in metric.items()]
+            }
+        return result
+
+
+metrics = MetricsRegistry()
+
+
+class Trace:
+    """Named spans of one incident, relative to its trigger"""
+    def __init__(self, started_at=None):
+        """started_at: wall-clock start (the trigger chunk's capture time)"""
+        self.started_at = time.time() if started_at is None else started_at
+        self.spans = []
+
+    def add(self, name, start, end=None, **attrs):
+        """Record a span from wall-clock start/end times (end defaults to now)"""
+        self.spans.append(span_dict(self.started_at, name, start, end, **attrs))
+
+    def to_dict(self):
+        return {"started_at": self.started_at, "spans": list(self.spans)}
+
+
+def span_dict(started_at, name, start, end=None, **attrs):
+    end = time.time() if end is None else end
+    span = {"name": name,
+            "start_ms": round((start - started_at) * 1000, 1),
+            "duration_ms": round((end - start) * 1000, 1)}
+    span.update(attrs)
+    return span
+
+
+def add_trace_spans(incident_data, spans):
+    """
+    Append (name, start, end, attrs) spans to an incident's stored trace;
+    used for the stages that finish after the JSON was first written
+    """
+    trace = incident_data.get("trace")
+    if not trace:
+        return {}
+    trace["spans"].extend(span_dict(trace["started_at"], name, start, end, **attrs)
+                          for name, start, end, attrs in spans)
+    return {"trace": trace}
@@ -0,0 +1,182 @@
+"""
+Whisper model registry for VoiceGuard
+
+Keeps one loaded Whisper model per variant (size, device, int8) for the
+whole process, so starting and stopping monitoring never reloads the
+model. A model is loaded lazily on first use, or in the background at
+server boot with preload(), and gets a warmup inference on a silent clip
+so the first real incident does not pay for lazy initialization.
+
+quantize=True loads the model on the CPU and applies PyTorch int8
+dynamic quantization to its Linear layers (smaller and faster on CPU-only
+machines, at a small accuracy cost).
+
+Load time, warmup time and memory of every variant are reported by stats().
+"""
+import io
+import os
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+import whisper
+
+WARMUP_SECONDS = 1.0
+
+
+def current_rss_mb():
+    """Resident memory of this process (falls back to peak RSS off Linux)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def model_size_mb(model):
+    """Serialized size of the weights (counts packed int8 weights too)"""
+    import torch
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / (1024 * 1024)
+
+
+def quantize_int8(model):
+    """int8 dynamic quantization of every Linear layer (CPU only)"""
+    import torch
+    # Whisper's Linear subclass only adds a dtype cast in forward(), which a
+    # float32 CPU model does not need; make the layers plain nn.Linear so
+    # quantize_dynamic recognizes them
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear):
+            module.__class__ = torch.nn.Linear
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class ModelHandle:
+    """One model variant: its loading state, the model and load statistics"""
+    def __init__(self, model_size, device=None, quantize=False):
+        self.model_size = model_size
+        self.device = device
+        self.quantize = quantize
+        self.model = None
+        self.status = "pending"
+        self.error = None
+        self.ready = threading.Event()
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.rss_delta_mb = None
+        self.weights_mb = None
+
+    @property
+    def name(self):
+        return f"{self.model_size}{'-int8' if self.quantize else ''}@{self.device or 'auto'}"
+
+    def stats(self):
+        return {
+            "model_size": self.model_size,
+            "device": str(self.device or "auto"),
+            "quantized": self.quantize,
+            "status": self.status,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "rss_delta_mb": self.rss_delta_mb,
+            "weights_mb": self.weights_mb,
+        }
+
+
+class ModelRegistry:
+    def __init__(self):
+        self.handles = {}  # (model_size, device, quantize) -> ModelHandle
+        self.lock = threading.Lock()
+
+    def _handle(self, model_size, device, quantize):
+        """Get or register a variant; returns (handle, created)"""
+        if quantize:
+            device = "cpu"  # dynamic quantization only runs on the CPU
+        key = (model_size, device, quantize)
+        with self.lock:
+            handle = self.handles.get(key)
+            if handle is not None:
+                return handle, False
+            handle = self.handles[key] = ModelHandle(model_size, device, quantize)
+            handle.status = "loading"
+            return handle, True
+
+    def get(self, model_size="base", device=None, quantize=False, warmup=True, timeout=None):
+        """
+        The shared model for a variant; loads it in this thread on first use
+        or waits for a load already in progress. Raises if loading failed.
+        """
+        handle, created = self._handle(model_size, device, quantize)
+        if created:
+            self._load(handle, warmup)
+        elif not handle.ready.wait(timeout):
+            raise TimeoutError(f"Whisper model {handle.name} is still loading")
+        if handle.model is None:
+            raise RuntimeError(f"Whisper model {handle.name} failed to load: {handle.error}")
+        return handle.model
+
+    def preload(self, model_size="base", device=None, quantize=False, warmup=True):
+        """Start loading a variant on a background thread (e.g. at server boot)"""
+        handle, created = self._handle(model_size, device, quantize)
+        if created:
+            thread = threading.Thread(target=self._load, args=(handle, warmup),
+                                      name=f"whisper-load-{handle.name}")
+            thread.daemon = True
+            thread.start()
+        return handle
+
+    def _load(self, handle, warmup):
+        print(f"🤖 Loading Whisper model ({handle.name})...")
+        rss_before = current_rss_mb()
+        try:
+            start = time.perf_counter()
+            model = whisper.load_model(handle.model_size, device=handle.device)
+            if handle.quantize:
+                model = quantize_int8(model)
+            handle.load_seconds = round(time.perf_counter() - start, 2)
+
+            if warmup:
+                start = time.perf_counter()
+                silence = np.zeros(int(WARMUP_SECONDS * 16000), dtype=np.float32)
+                model.transcribe(silence, fp16=model.device.type == "cuda")
+                handle.warmup_seconds = round(time.perf_counter() - start, 2)
+
+            handle.weights_mb = round(model_size_mb(model), 1)
+            handle.rss_delta_mb = round(current_rss_mb() - rss_before, 1)
+            handle.model = model
+            handle.status = "ready"
+            print(f"✅ Whisper model {handle.name} ready: loaded in {handle.load_seconds}s, "
+                  f"warmup {handle.warmup_seconds}s, {handle.weights_mb} MB weights")
+        except Exception as e:
+            print(f"❌ Error loading Whisper: {e}")
+            handle.error = str(e)
+            handle.status = "failed"
+            # Let a later get() retry instead of caching the failure forever
+            with self.lock:
+                key = (handle.model_size, handle.device, handle.quantize)
+                if self.handles.get(key) is handle:
+                    del self.handles[key]
+        finally:
+            handle.ready.set()
+
+    def unload(self, model_size="base", device=None, quantize=False):
+        """Drop a variant so its memory can be reclaimed once no analyzer uses it"""
+        if quantize:
+            device = "cpu"
+        with self.lock:
+            return self.handles.pop((model_size, device, quantize), None) is not None
+
+    def stats(self):
+        with self.lock:
+            handles = list(self.handles.values())
+        return {handle.name: handle.stats() for handle in handles}
+
+
+# Process-wide registry shared by every SpeechAnalyzer
+model_registry = ModelRegistry()
@@ -0,0 +1,140 @@
+"""
+Multi-stream monitoring for VoiceGuard
+
+One process monitors many rooms/devices. Every stream gets its own
+pipeline (ring buffer, VAD and threat state), while all streams share a
+single Whisper model through one AnalysisWorker that batches pending
+transcription jobs from different streams into one padded model call.
+With an EventBroadcaster, every stream's state changes and incidents are
+published as live events (see utils/events.py).
+"""
+import threading
+
+from utils.analysis_worker import AnalysisWorker
+from utils.audio_buffer import AudioBuffer
+from utils.events import PipelineEvents, incident_event
+from utils.pipeline import (Pipeline, BufferStage, EvidenceStage, VADStage, ThreatStage, DistressStage,
+                            IncidentStage)
+from utils.transcript_cache import SpeechSegmenter
+from utils.vad import VoiceActivityDetector
+
+
+class MultiStreamMonitor:
+    def __init__(self, speech_analyzer, incident_recorder, on_incident=None,
+                 batch_size=4, max_pending_per_stream=2, buffer_seconds=15, incremental=True,
+                 distress_classifier=None, distress_mode="gate", events=None):
+        """
+        speech_analyzer: shared SpeechAnalyzer, or a zero-argument factory
+                         that loads it on the analysis thread
+        incident_recorder: shared IncidentRecorder (incidents carry stream_id)
+        on_incident: optional callback(incident, job); job.stream_id says where
+        batch_size: most jobs transcribed together in one Whisper call
+        incremental: transcribe speech segments in the background, so an
+                     incident only waits for the untranscribed tail
+        distress_classifier: optional DistressClassifier shared by every
+                             stream, checked before ASR on HIGH chunks and,
+                             in gate mode, on speech segments (see DistressStage)
+        events: optional EventBroadcaster for live stream/incident events
+        """
+        self.incident_recorder = incident_recorder
+        self.events = events
+        self.on_incident = on_incident
+        self.buffer_seconds = buffer_seconds
+        self.distress_classifier = distress_classifier
+        self.distress_mode = distress_mode
+        self.analysis_worker = AnalysisWorker(
+            speech_analyzer, incident_recorder,
+            max_pending=max_pending_per_stream,
+            on_incident=self._incident_recorded,
+            batch_size=batch_size,
+            incremental=incremental
+        )
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def _build_pipeline(self, stream_id, source):
+        audio_buffer = AudioBuffer(max_duration_seconds=self.buffer_seconds,
+                                   sample_rate=source.sample_rate)
+        segmenter = None
+        if self.analysis_worker.incremental:
+            # A new buffer restarts the sample offsets; forget old transcripts
+            self.analysis_worker.transcript_cache.clear(stream_id)
+            segmenter = SpeechSegmenter(
+                audio_buffer, self.analysis_worker, stream_id,
+                distress_classifier=self.distress_classifier if self.distress_mode == "gate" else None)
+        stages = [
+            BufferStage(audio_buffer),
+            EvidenceStage(audio_buffer, self.incident_recorder, stream_id=stream_id),
+            VADStage(VoiceActivityDetector(sample_rate=source.sample_rate, aggressiveness=3),
+                     segmenter=segmenter),
+            ThreatStage(verbose=False),
+        ]
+        if self.distress_classifier is not None:
+            stages.append(DistressStage(audio_buffer, self.distress_classifier, mode=self.distress_mode))
+        stages.append(IncidentStage(audio_buffer, self.analysis_worker, stream_id=stream_id,
+                                    owns_worker=False))
+        on_chunk = PipelineEvents(self.events, stream_id) if self.events is not None else None
+        return Pipeline(source, stages, name=stream_id, stats_interval=0, on_chunk=on_chunk)
+
+    def _incident_recorded(self, incident, job):
+        if self.events is not None:
+            self.events.publish("incident", **incident_event(incident))
+        if self.on_incident:
+            self.on_incident(incident, job)
+
+    def is_active(self, stream_id):
+        pipeline = self.streams.get(stream_id)
+        return bool(pipeline and pipeline.thread and pipeline.thread.is_alive())
+
+    def start_stream(self, stream_id, source):
+        """Start monitoring a stream; returns False if it is already running"""
+        with self.lock:
+            if self.is_active(stream_id):
+                return False
+            self.analysis_worker.start()
+            pipeline = self._build_pipeline(stream_id, source)
+            self.streams[stream_id] = pipeline
+            pipeline.start()
+        if self.events is not None:
+            self.events.publish("stream", stream_id=stream_id, running=True)
+        print(f"🎯 Stream '{stream_id}' is monitoring")
+        return True
+
+    def stop_stream(self, stream_id, timeout=None):
+        """Stop a stream; returns False if it was not running"""
+        with self.lock:
+            pipeline = self.streams.pop(stream_id, None)
+        if pipeline is None:
+            return False
+        was_active = pipeline.thread is not None and pipeline.thread.is_alive()
+        pipeline.stop(timeout)
+        if self.events is not None:
+            self.events.publish("stream", stream_id=stream_id, running=False)
+        print(f"🛑 Stream '{stream_id}' stopped")
+        return was_active
+
+    def stream_ids(self):
+        with self.lock:
+            return list(self.streams)
+
+    def stream_stats(self, stream_id):
+        pipeline = self.streams.get(stream_id)
+        return pipeline.stats() if pipeline else None
+
+    def stats(self):
+        with self.lock:
+            pipelines = list(self.streams.values())
+        stats = {
+            "active_streams": sum(1 for p in pipelines if p.thread and p.thread.is_alive()),
+            "streams": {p.name: p.stats() for p in pipelines},
+            "analysis": self.analysis_worker.stats()
+        }
+        if self.incident_recorder.outbox is not None:
+            stats["alerts"] = self.incident_recorder.outbox.stats()
+        return stats
+
+    def shutdown(self, timeout=None):
+        """Stop every stream, then drain the shared analysis worker"""
+        for stream_id in self.stream_ids():
+            self.stop_stream(stream_id, timeout)
+        self.analysis_worker.stop(timeout)
@@ -0,0 +1,290 @@
+"""
+Durable SOS outbox for VoiceGuard
+
+Alerts are written to a SQLite outbox before anything touches the network,
+and a background worker drains it through the AlertDispatcher. Delivery is
+at-least-once: an alert stays queued until the gateway accepts it, is
+retried with backoff through gateway outages, and is picked up again after
+a restart. Every (incident, recipient) pair has an idempotency key, so
+recording or enqueueing the same incident twice never messages anyone
+twice. On the first attempt, recipients of the same message are batched
+into one gateway request (the SMS API takes a comma-separated `recipients`
+list). A failed batch says nothing about which recipient was at fault, so
+every later attempt goes out one recipient per request and each alert is
+settled on its own: one invalid number cannot hold back the others. The
+outbox is the only retry layer; each attempt is a single gateway request.
+
+Alerts being sent are leased (status 'sending' until next_attempt_at); if
+the process dies mid-send, the lease runs out and any outbox process on
+the same database picks them up again.
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from utils.metrics import metrics
+from utils.sos import SOS_MESSAGE, get_dispatcher
+
+SMS_DISPATCH_MS = metrics.histogram("voiceguard_sms_dispatch_ms",
+                                    "Alert queued in the outbox to accepted by the gateway (ms)")
+SMS_ALERTS = metrics.counter("voiceguard_sms_alerts_total", "Outbox send attempts per recipient",
+                             ("status",))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    incident_id TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    sent_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+"""
+
+COLUMNS = ("id", "idempotency_key", "incident_id", "recipient", "message", "status",
+           "attempts", "next_attempt_at", "created_at", "sent_at", "last_error")
+
+
+class AlertOutbox:
+    def __init__(self, db_path="incidents/outbox.db", dispatcher=None, max_batch=10,
+                 max_attempts=20, retry_base=5.0, retry_max=300.0, lease_seconds=120.0,
+                 on_delivery=None):
+        """
+        dispatcher: AlertDispatcher used to send (default: the shared one)
+        max_batch: most recipients in one first-attempt gateway request
+                   (1 disables batching)
+        max_attempts: drain attempts before an alert is marked failed
+        retry_base/retry_max: backoff between drain attempts, in seconds
+        lease_seconds: how long a claimed alert is left to its sender before
+                       another drain may take it over
+        on_delivery: optional callback(incident_id, results) after every
+                     send attempt, with one result dict per recipient
+        """
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+        self.dispatcher = dispatcher
+        self.max_batch = max(1, max_batch)
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lease_seconds = lease_seconds
+        self.on_delivery = on_delivery
+
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def enqueue(self, incident_id, contacts, message=SOS_MESSAGE):
+        """
+        Queue an alert for every contact; returns how many were new.
+        The idempotency key is incident_id:recipient, so duplicates are ignored.
+        """
+        now = time.time()
+        rows = [(f"{incident_id}:{phone}", incident_id, phone, message, now, now)
+                for phone in dict.fromkeys(contacts) if phone]
+        with self.lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO outbox "
+                "(idempotency_key, incident_id, recipient, message, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            queued = self.conn.total_changes - before
+        if queued:
+            self.start()
+            self.wakeup.set()
+        return queued
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="alert-outbox")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """Stop draining; undelivered alerts stay in the outbox for next time"""
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                drained = self.drain()
+            except Exception as e:
+                print(f"❌ Alert outbox error: {e}")
+                drained = 0
+            if not drained:
+                self.wakeup.wait(self._seconds_until_due())
+                self.wakeup.clear()
+
+    def _seconds_until_due(self):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox "
+                "WHERE status IN ('pending', 'sending')").fetchone()
+        # Nothing queued: sleep until enqueue() or stop() wakes us
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def _claim_due(self):
+        """
+        Lease due alerts, including 'sending' ones whose lease ran out
+        (their sender died). BEGIN IMMEDIATE takes the write lock before the
+        SELECT, so two processes never claim the same row.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute(
+                "SELECT " + ", ".join(COLUMNS) + " FROM outbox "
+                "WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? ORDER BY id",
+                (now,)).fetchall()
+            self.conn.executemany(
+                "UPDATE outbox SET status = 'sending', next_attempt_at = ? WHERE id = ?",
+                [(now + self.lease_seconds, row[0]) for row in rows])
+        alerts = [dict(zip(COLUMNS, row)) for row in rows]
+        recovered = sum(alert["status"] == "sending" for alert in alerts)
+        if recovered:
+            print(f"📮 Re-sending {recovered} alert(s) whose sender stopped mid-send")
+        return alerts
+
+    def _batches(self, alerts):
+        """
+        Group first-attempt alerts with the same message into gateway-sized
+        batches; anything else goes out one per request
+        """
+        by_message = {}
+        for alert in alerts:
+            # Retries and alerts recovered from a dead sender: one per request
+            if alert["attempts"] or alert["status"] == "sending":
+                yield alert["message"], [alert]
+            else:
+                by_message.setdefault(alert["message"], []).append(alert)
+        for message, group in by_message.items():
+            for i in range(0, len(group), self.max_batch):
+                yield message, group[i:i + self.max_batch]
+
+    def drain(self):
+        """Send every due alert once; returns how many were attempted"""
+        alerts = self._claim_due()
+        if not alerts:
+            return 0
+
+        dispatcher = self.dispatcher or get_dispatcher()
+        batches = list(self._batches(alerts))
+        futures = [
+            dispatcher.executor.submit(dispatcher.send, ",".join(a["recipient"] for a in batch), message,
+                                       max_attempts=1)
+            for message, batch in batches
+        ]
+        for (message, batch), future in zip(batches, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"ok": False, "error": str(e), "attempts": 0, "status_code": None,
+                          "elapsed_ms": None, "delivered_at": None}
+            self._settle(batch, result)
+        return len(alerts)
+
+    def _settle(self, batch, result):
+        """Mark each alert of a request sent, or schedule its retry / give up"""
+        now = time.time()
+        # A 4xx other than 429 will not succeed on retry - unless it came from
+        # a batch, where any one recipient may have caused it
+        rejected = (result["status_code"] is not None and 400 <= result["status_code"] < 500
+                    and result["status_code"] != 429)
+        updates, per_incident = [], {}
+        for alert in batch:
+            attempts = alert["attempts"] + 1
+            if result["ok"]:
+                status, next_attempt_at = "sent", now
+            elif (rejected and len(batch) == 1) or attempts >= self.max_attempts:
+                status, next_attempt_at = "failed", now
+            elif rejected:
+                # Find the bad recipient right away, one request each
+                status, next_attempt_at = "pending", now
+            else:
+                status, next_attempt_at = "pending", now + random.uniform(
+                    0, min(self.retry_max, self.retry_base * (2 ** attempts)))
+            updates.append((status, attempts, next_attempt_at, now if result["ok"] else None,
+                            result["error"], alert["id"]))
+            per_incident.setdefault(alert["incident_id"], []).append({
+                "phone": alert["recipient"],
+                "ok": result["ok"],
+                "status": status,
+                "attempts": attempts,
+                "status_code": result["status_code"],
+                "error": result["error"],
+                "batch_size": len(batch),
+                "queued_ms": round((now - alert["created_at"]) * 1000, 1),
+                "delivered_at": result["delivered_at"],
+            })
+            SMS_ALERTS.labels(status).inc()
+            if result["ok"]:
+                SMS_DISPATCH_MS.observe((now - alert["created_at"]) * 1000)
+
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, "
+                "sent_at = ?, last_error = ? WHERE id = ?", updates)
+
+        for incident_id, results in per_incident.items():
+            for r in results:
+                if r["ok"]:
+                    print(f"✅ SOS sent to {r['phone']} ({incident_id}, {r['queued_ms']:.0f} ms after queueing)")
+                elif r["status"] == "failed":
+                    print(f"❌ Giving up on SOS to {r['phone']} ({incident_id}): {r['error']}")
+                else:
+                    print(f"⚠️  SOS to {r['phone']} failed, will retry: {r['error']}")
+            if self.on_delivery:
+                try:
+                    self.on_delivery(incident_id, results)
+                except Exception as e:
+                    print(f"❌ Alert delivery callback failed: {e}")
+
+    def alerts(self, incident_id=None, status=None, limit=100):
+        """Outbox rows, newest first"""
+        sql = "SELECT " + ", ".join(COLUMNS) + " FROM outbox"
+        where, params = [], []
+        if incident_id:
+            where.append("incident_id = ?")
+            params.append(incident_id)
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(int(limit))
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def stats(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        counts = dict(rows)
+        return {status: counts.get(status, 0) for status in ("pending", "sending", "sent", "failed")}
+
+    def close(self):
+        self.stop()
+        with self.lock:
+            self.conn.close()
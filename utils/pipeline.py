@@ -0,0 +1,552 @@
+"""
+Detection pipeline for VoiceGuard
+
+One hot loop shared by the CLI (main.py) and the Flask app:
+capture -> evidence buffer -> VAD -> threat scoring -> incident analysis.
+Each step is a Stage; a Pipeline pulls chunks from an audio source
+(anything with start_recording / get_audio_chunk / stop_recording) and
+runs them through its stages. The loop blocks on the source until a chunk
+arrives instead of sleep-polling.
+"""
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from utils.analysis_worker import AnalysisWorker, AnalysisJob
+from utils.features import FeatureExtractor
+from utils.metrics import QUEUE_BUCKETS, metrics
+from utils.transcript_cache import SpeechSegmenter
+
+CHUNKS = metrics.counter("voiceguard_chunks_total", "Audio chunks processed", ("stream",))
+HIGH_THREAT_CHUNKS = metrics.counter("voiceguard_high_threat_chunks_total", "Chunks scored HIGH threat",
+                                     ("stream",))
+CHUNK_LATENCY_MS = metrics.histogram("voiceguard_chunk_latency_ms",
+                                     "Chunk capture to threat decision latency (ms)", ("stream",))
+CAPTURE_BACKLOG = metrics.histogram("voiceguard_capture_backlog_chunks",
+                                    "Captured chunks waiting when the pipeline takes one", ("stream",),
+                                    buckets=QUEUE_BUCKETS)
+VAD_FRAMES = metrics.counter("voiceguard_vad_frames_total", "Frames run through the VAD", ("stream",))
+DISTRESS_GATED = metrics.counter("voiceguard_distress_gated_total",
+                                 "HIGH chunks downgraded by the distress classifier", ("stream",))
+
+
+class AudioChunk:
+    """Per-chunk state handed from stage to stage"""
+    def __init__(self, audio_data, timestamp, sample_rate):
+        self.audio_data = audio_data
+        self.timestamp = timestamp          # capture time of the chunk
+        self.sample_rate = sample_rate
+        self.offset = None                  # absolute sample offset (set by BufferStage)
+        self.speech_detected = False
+        self.speech_confidence = 0.0
+        self.speech_events = []             # VAD segment start/end events in this chunk
+        self.in_speech = False              # a VAD speech segment is open
+        self.segment = None                 # running SegmentStats of the open segment
+        self.features = None                # FrameFeatures of the VAD frames in this chunk
+        self.volume = None                  # RMS, set by VADStage from the frame features
+        self.shout_ratio = 0.0
+        self.distress = None                # DistressStage score of a HIGH chunk
+        self.threat_level = None
+        self.incident_submitted = False
+
+
+class Stage:
+    """Base class for pipeline stages"""
+    name = "stage"
+
+    def start(self, pipeline):
+        pass
+
+    def process(self, chunk, pipeline):
+        """Handle one chunk; return False to skip the remaining stages"""
+        return True
+
+    def stop(self, pipeline):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class BufferStage(Stage):
+    """Keep the rolling evidence buffer up to date"""
+    name = "buffer"
+
+    def __init__(self, audio_buffer):
+        self.audio_buffer = audio_buffer
+
+    def process(self, chunk, pipeline):
+        self.audio_buffer.add_audio(chunk.audio_data, chunk.timestamp)
+        chunk.offset = self.audio_buffer.total_samples - len(chunk.audio_data)
+        return True
+
+
+class EvidenceStage(Stage):
+    """Stream post-incident audio into open evidence files"""
+    name = "evidence"
+
+    def __init__(self, audio_buffer, incident_recorder, stream_id=None):
+        self.audio_buffer = audio_buffer
+        self.incident_recorder = incident_recorder
+        self.stream_id = stream_id
+
+    def process(self, chunk, pipeline):
+        for stream in self.incident_recorder.get_open_streams(self.stream_id):
+            # Catch up from the ring buffer: the incident is recorded after
+            # analysis, so audio since the trigger is already buffered (or,
+            # after a slow analysis, partly gone - append records the gap)
+            end = self.audio_buffer.total_samples
+            stream.append(self.audio_buffer.get_audio_range(stream.next_offset, end), end_offset=end)
+        return True
+
+    def stop(self, pipeline):
+        self.incident_recorder.close_streams(self.stream_id)
+
+    def stats(self):
+        return self.incident_recorder.evidence_writer.stats()
+
+
+class VADStage(Stage):
+    """Voice activity detection; chunks without speech stop here"""
+    name = "vad"
+
+    def __init__(self, vad_detector, segmenter=None):
+        """
+        segmenter: optional SpeechSegmenter that receives every speech
+                   segment event (including those on non-speech chunks)
+        """
+        self.vad_detector = vad_detector
+        self.segmenter = segmenter
+        self.frames_metric = None
+        self.frames_counted = 0
+
+    def start(self, pipeline):
+        self.frames_metric = VAD_FRAMES.labels(pipeline.name)
+        self.frames_counted = self.vad_detector.frames_processed
+
+    def process(self, chunk, pipeline):
+        vad = self.vad_detector
+        vad.add_audio(chunk.audio_data)
+        chunk.speech_detected = vad.is_speech_detected()
+        chunk.speech_events = vad.events
+        chunk.in_speech = vad.in_speech
+        chunk.segment = vad.segment
+        if self.frames_metric is not None:
+            self.frames_metric.inc(vad.frames_processed - self.frames_counted)
+            self.frames_counted = vad.frames_processed
+        # Level features are computed by the VAD anyway (not for plain
+        # silence, which stops here); no second pass
+        chunk.features = vad.features
+        if len(chunk.features):
+            chunk.volume = chunk.features.overall_rms
+        if self.segmenter is not None and chunk.speech_events:
+            self.segmenter.handle_events(chunk.speech_events, chunk.sample_rate)
+        if not chunk.speech_detected:
+            return False
+        chunk.speech_confidence = vad.get_speech_confidence()
+        return True
+
+    def stop(self, pipeline):
+        events = self.vad_detector.flush()
+        if self.segmenter is not None and events:
+            self.segmenter.handle_events(events, pipeline.source.sample_rate)
+
+    def stats(self):
+        stats = {
+            "frames_processed": self.vad_detector.frames_processed,
+            "segments_started": self.vad_detector.segments_started,
+            "segments_ended": self.vad_detector.segments_ended,
+            "in_speech": self.vad_detector.in_speech
+        }
+        if self.segmenter is not None:
+            stats["segments_transcribed"] = self.segmenter.segments_emitted
+            if self.segmenter.distress_classifier is not None:
+                stats["segments_gated"] = self.segmenter.segments_gated
+        return stats
+
+
+class ThreatStage(Stage):
+    """Audio-based threat level from loudness, shouting and speech confidence"""
+    name = "threat"
+
+    def __init__(self, volume_threshold=1000, high_confidence=0.7, medium_confidence=0.5,
+                 shout_pitch=250.0, shout_ratio=0.5, shouting_rule=False, verbose=True):
+        """
+        shout_pitch/shout_ratio: a chunk counts as shouting when at least
+            shout_ratio of its frames are louder than volume_threshold and
+            voiced at shout_pitch Hz or higher (raised voice). Pitch needs
+            the spectral features, which are computed here only for chunks
+            loud enough to pass that test (and so for every HIGH chunk).
+        shouting_rule: make shouting HIGH threat already at medium speech
+            confidence. Off by default: 250 Hz is an ordinary pitch for raised
+            female voices and children, so the rule needs evaluating on
+            labeled audio first. Shouting is counted and recorded either way.
+        """
+        self.volume_threshold = volume_threshold
+        self.high_confidence = high_confidence
+        self.medium_confidence = medium_confidence
+        self.shout_pitch = shout_pitch
+        self.shout_ratio = shout_ratio
+        self.shouting_rule = shouting_rule
+        self.verbose = verbose
+        self.feature_extractor = None
+        self.shouting_chunks = 0
+        self.spectral_chunks = 0
+
+    def start(self, pipeline):
+        self.feature_extractor = FeatureExtractor(pipeline.source.sample_rate)
+
+    def process(self, chunk, pipeline):
+        if chunk.volume is None:
+            chunk.volume = float(np.sqrt(np.mean(chunk.audio_data.astype(np.float32) ** 2)))
+        # shout_ratio of the frames louder than volume_threshold implies an
+        # overall RMS above volume_threshold * sqrt(shout_ratio); quieter
+        # chunks cannot be shouting and skip the FFT
+        if chunk.volume > self.volume_threshold * self.shout_ratio ** 0.5:
+            chunk.features = self.feature_extractor.compute_audio(chunk.audio_data)
+            chunk.shout_ratio = chunk.features.shout_ratio(self.volume_threshold, self.shout_pitch)
+            self.spectral_chunks += 1
+        shouting = chunk.shout_ratio >= self.shout_ratio
+        self.shouting_chunks += shouting
+
+        if chunk.volume > self.volume_threshold and chunk.speech_confidence > self.high_confidence:
+            chunk.threat_level = "HIGH"
+            threat_emoji = "🔴"
+        elif self.shouting_rule and shouting and chunk.speech_confidence > self.medium_confidence:
+            chunk.threat_level = "HIGH"
+            threat_emoji = "🔴"
+        elif chunk.volume > self.volume_threshold and chunk.speech_confidence > self.medium_confidence:
+            chunk.threat_level = "MEDIUM"
+            threat_emoji = "🟡"
+        else:
+            chunk.threat_level = "LOW"
+            threat_emoji = "🟢"
+
+        if self.verbose:
+            print(f"🗣️  SPEECH: Vol={chunk.volume:>6.0f} | Conf={chunk.speech_confidence:.2f} | "
+                  f"{threat_emoji} {chunk.threat_level}{' (shouting)' if shouting else ''}")
+        return True
+
+    def stats(self):
+        return {"shouting_chunks": self.shouting_chunks, "spectral_chunks": self.spectral_chunks}
+
+
+class DistressStage(Stage):
+    """
+    Acoustic distress check of HIGH chunks before they can trigger Whisper.
+    mode="gate": HIGH chunks scoring below the threshold drop to MEDIUM, so
+                 loud harmless audio never reaches ASR
+    mode="prioritize": nothing is dropped; the score orders the analysis
+                       queue so the most distressed audio is transcribed first
+    Speech segments are gated separately, by SpeechSegmenter (gate mode only).
+    """
+    name = "distress"
+
+    def __init__(self, audio_buffer, classifier, threshold=0.5, window_seconds=1.5,
+                 mode="gate", min_interval_seconds=0.25):
+        """
+        classifier: DistressClassifier (utils/distress.py)
+        window_seconds: most recent audio scored for each HIGH chunk
+        min_interval_seconds: consecutive HIGH chunks reuse the last score
+                              for this long (audio clock) instead of rescoring
+        """
+        self.audio_buffer = audio_buffer
+        self.classifier = classifier
+        self.threshold = threshold
+        self.window_seconds = window_seconds
+        self.mode = mode
+        self.min_interval_seconds = min_interval_seconds
+        self.last_score = None
+        self.last_scored_at = None  # audio time of last_score
+        self.scored = 0
+        self.gated = 0
+        self.gated_metric = None
+
+    def start(self, pipeline):
+        self.gated_metric = DISTRESS_GATED.labels(pipeline.name)
+
+    def process(self, chunk, pipeline):
+        if chunk.threat_level != "HIGH":
+            return True
+
+        audio_time = self.audio_buffer.total_samples / chunk.sample_rate
+        if self.last_scored_at is None or audio_time - self.last_scored_at >= self.min_interval_seconds:
+            self.last_score = self.classifier.score(
+                self.audio_buffer.get_recent_audio(self.window_seconds, copy=False), chunk.sample_rate)
+            self.last_scored_at = audio_time
+            self.scored += 1
+        chunk.distress = self.last_score
+
+        if self.mode == "gate" and chunk.distress["distress"] < self.threshold:
+            chunk.threat_level = "MEDIUM"
+            self.gated += 1
+            if self.gated_metric is not None:
+                self.gated_metric.inc()
+        return True
+
+    def stats(self):
+        return dict(self.classifier.stats(), mode=self.mode, threshold=self.threshold,
+                    scored=self.scored, gated=self.gated)
+
+
+class IncidentStage(Stage):
+    """Turn sustained HIGH threat into analysis jobs, with a cooldown"""
+    name = "incident"
+
+    def __init__(self, audio_buffer, analysis_worker, high_threat_threshold=1,
+                 cooldown_seconds=30, evidence_seconds=8, stream_id=None, owns_worker=True):
+        """
+        stream_id: tag for jobs when several streams share one worker
+        owns_worker: start/stop the analysis worker with the pipeline
+                     (False when the worker is shared)
+        """
+        self.audio_buffer = audio_buffer
+        self.analysis_worker = analysis_worker
+        self.stream_id = stream_id
+        self.owns_worker = owns_worker
+        self.high_threat_threshold = high_threat_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.evidence_seconds = evidence_seconds
+
+        self.consecutive_high_threats = 0
+        self.last_incident_time = None  # audio time (seconds) of the last incident
+        self.incidents_submitted = 0
+        self.feature_extractor = None
+
+    def start(self, pipeline):
+        self.feature_extractor = FeatureExtractor(pipeline.source.sample_rate)
+        if self.owns_worker:
+            self.analysis_worker.start()
+
+    def stop(self, pipeline):
+        if self.owns_worker:
+            self.analysis_worker.stop()
+
+    def process(self, chunk, pipeline):
+        if chunk.threat_level != "HIGH":
+            self.consecutive_high_threats = 0
+            return True
+        self.consecutive_high_threats += 1
+
+        # Cooldown runs on the audio clock (sample offsets), so replayed
+        # audio behaves the same as live capture at any replay speed
+        audio_time = self.audio_buffer.total_samples / chunk.sample_rate
+        if (self.consecutive_high_threats >= self.high_threat_threshold and
+                (self.last_incident_time is None or
+                 audio_time - self.last_incident_time > self.cooldown_seconds)):
+            # Hand the evidence window to the analysis worker so Whisper
+            # never blocks capture + VAD
+            evidence_audio = self.audio_buffer.get_recent_audio(duration_seconds=self.evidence_seconds)
+            self.analysis_worker.submit(AnalysisJob(
+                evidence_audio,
+                start_offset=self.audio_buffer.total_samples - len(evidence_audio),
+                sample_rate=chunk.sample_rate,
+                volume=chunk.volume,
+                speech_confidence=chunk.speech_confidence,
+                timestamp=chunk.timestamp,
+                stream_id=self.stream_id,
+                acoustic_features=self._acoustic_features(chunk),
+                priority=chunk.distress["distress"] if chunk.distress else 0.0
+            ))
+            chunk.incident_submitted = True
+            self.incidents_submitted += 1
+            self.last_incident_time = audio_time
+            self.consecutive_high_threats = 0
+        return True
+
+    def _acoustic_features(self, chunk):
+        """Trigger chunk + current speech segment features for the incident record"""
+        features = {"shout_ratio": round(chunk.shout_ratio, 3)}
+        if chunk.features is not None:
+            features["trigger"] = chunk.features.summary()
+        if chunk.segment is not None:
+            # Pitch and centroid of the segment, computed once per incident
+            # from the buffered audio (at most the evidence window of it)
+            segment = chunk.segment.to_dict()
+            start = max(chunk.segment.start_offset,
+                        self.audio_buffer.total_samples - int(self.evidence_seconds * chunk.sample_rate))
+            spectral = self.feature_extractor.compute_audio(
+                self.audio_buffer.get_audio_range(start, copy=False)).summary()
+            for key in ("centroid_hz", "voiced_ratio", "pitch_hz"):
+                if key in spectral:
+                    segment[key] = spectral[key]
+            features["segment"] = segment
+        if chunk.distress is not None:
+            features["distress"] = chunk.distress
+        return features
+
+    def stats(self):
+        stats = {"incidents_submitted": self.incidents_submitted}
+        stats.update(self.analysis_worker.stats())
+        return stats
+
+
+class Pipeline:
+    def __init__(self, source, stages, name="default", stop_event=None,
+                 stats_interval=100, poll_timeout=0.5, latency_window=1000, on_chunk=None):
+        """
+        source: audio source (AudioCapture or compatible)
+        stages: list of Stage objects, run in order for every chunk
+        stop_event: optional threading.Event shared with the caller
+        stats_interval: print a stats line every N chunks (0 disables)
+        poll_timeout: longest time the loop blocks before rechecking stop
+        latency_window: how many recent chunk latencies stats() summarizes
+        on_chunk: optional callback(pipeline, chunk) after every chunk, also
+                  for chunks a stage stopped early (e.g. silence)
+        """
+        self.source = source
+        self.stages = list(stages)
+        self.name = name
+        self.stop_event = stop_event or threading.Event()
+        self.stats_interval = stats_interval
+        self.poll_timeout = poll_timeout
+        self.on_chunk = on_chunk
+
+        self.thread = None
+        self.running = False
+        self.started_at = None
+        self.total_chunks = 0
+        self.speech_chunks = 0
+        self.high_threat_chunks = 0
+        self.latencies = deque(maxlen=latency_window)  # chunk capture -> decision, seconds
+
+        # Series in the shared metrics registry (see utils/metrics.py)
+        self.chunks_metric = CHUNKS.labels(name)
+        self.high_threat_metric = HIGH_THREAT_CHUNKS.labels(name)
+        self.latency_metric = CHUNK_LATENCY_MS.labels(name)
+        self.backlog_metric = CAPTURE_BACKLOG.labels(name) if hasattr(source, "backlog") else None
+
+    @property
+    def is_running(self):
+        return self.running and not self.stop_event.is_set()
+
+    def get_stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        return None
+
+    def start(self):
+        """Run the pipeline on a background thread"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name=f"pipeline-{self.name}")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """Signal the loop to stop and wait for it"""
+        self.stop_event.set()
+        # Wake a consumer blocked on the source
+        self.source.stop_recording()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+            self.thread = None
+
+    def run(self):
+        """Blocking loop: pull chunks from the source until stopped"""
+        self.started_at = time.time()
+        self.running = True
+        for stage in self.stages:
+            stage.start(self)
+        try:
+            self.source.start_recording()
+            while not self.stop_event.is_set():
+                item = self.source.get_audio_chunk(timeout=self.poll_timeout)
+                if item is None:
+                    # File-backed sources end on their own
+                    if getattr(self.source, "is_finished", False):
+                        break
+                    continue
+                audio_data, timestamp = item
+                self.process_chunk(audio_data, timestamp)
+        finally:
+            self.running = False
+            self.source.stop_recording()
+            for stage in reversed(self.stages):
+                stage.stop(self)
+
+    def process_chunk(self, audio_data, timestamp):
+        """Run one chunk through every stage"""
+        if self.backlog_metric is not None:
+            self.backlog_metric.observe(self.source.backlog)
+        chunk = AudioChunk(audio_data, timestamp, self.source.sample_rate)
+        for stage in self.stages:
+            if stage.process(chunk, self) is False:
+                break
+
+        latency = time.time() - timestamp
+        self.latencies.append(latency)
+        self.latency_metric.observe(latency * 1000)
+        self.chunks_metric.inc()
+        self.total_chunks += 1
+        if chunk.speech_detected:
+            self.speech_chunks += 1
+        if chunk.threat_level == "HIGH":
+            self.high_threat_chunks += 1
+            self.high_threat_metric.inc()
+
+        if self.stats_interval and self.total_chunks % self.stats_interval == 0:
+            speech_ratio = self.speech_chunks / self.total_chunks
+            threat_ratio = self.high_threat_chunks / self.speech_chunks if self.speech_chunks > 0 else 0
+            print(f"📊 Stats: Speech {self.speech_chunks}/{self.total_chunks} ({speech_ratio:.1%}) | "
+                  f"High threats: {self.high_threat_chunks} ({threat_ratio:.1%})")
+        if self.on_chunk is not None:
+            self.on_chunk(self, chunk)
+        return chunk
+
+    def stats(self):
+        """Counters, throughput and chunk -> decision latency percentiles"""
+        uptime = time.time() - self.started_at if self.started_at else 0.0
+        latency_ms = {}
+        if self.latencies:
+            p50, p95, p99 = np.percentile(np.fromiter(self.latencies, dtype=np.float64), [50, 95, 99]) * 1000
+            latency_ms = {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2),
+                          "max": round(max(self.latencies) * 1000, 2)}
+        return {
+            "name": self.name,
+            "running": self.is_running,
+            "uptime_seconds": round(uptime, 1),
+            "total_chunks": self.total_chunks,
+            "speech_chunks": self.speech_chunks,
+            "high_threat_chunks": self.high_threat_chunks,
+            "chunks_per_sec": round(self.total_chunks / uptime, 1) if uptime > 0 else 0.0,
+            "latency_ms": latency_ms,
+            "stages": {stage.name: stage.stats() for stage in self.stages},
+            "source": self.source.stats() if hasattr(self.source, "stats") else {}
+        }
+
+
+def build_monitoring_pipeline(source, audio_buffer, vad_detector, speech_analyzer,
+                              incident_recorder, on_incident=None, incremental=True,
+                              distress_classifier=None, distress_mode="gate", **kwargs):
+    """
+    The standard VoiceGuard pipeline used by main.py and app.py
+    incremental: transcribe speech segments in the background so incidents
+                 only wait for the untranscribed tail of the window
+    distress_classifier: optional DistressClassifier checked before ASR
+                         (see DistressStage for distress_mode; in gate mode
+                         it also gates background segment transcription)
+    """
+    analysis_worker = AnalysisWorker(speech_analyzer, incident_recorder, on_incident=on_incident,
+                                     incremental=incremental)
+    segmenter = None
+    if incremental:
+        segmenter = SpeechSegmenter(
+            audio_buffer, analysis_worker,
+            distress_classifier=distress_classifier if distress_mode == "gate" else None)
+    stages = [
+        BufferStage(audio_buffer),
+        EvidenceStage(audio_buffer, incident_recorder),
+        VADStage(vad_detector, segmenter=segmenter),
+        ThreatStage(),
+    ]
+    if distress_classifier is not None:
+        stages.append(DistressStage(audio_buffer, distress_classifier, mode=distress_mode))
+    stages += [
+        IncidentStage(audio_buffer, analysis_worker),
+    ]
+    return Pipeline(source, stages, **kwargs)
@@ -0,0 +1,142 @@
+"""
+File-based audio source for VoiceGuard
+
+FileAudioSource replays WAV/FLAC files with the same interface as
+AudioCapture (start_recording / get_audio_chunk / stop_recording), so the
+detection pipeline can run headless - for benchmarks, CI and regression
+tests - without a microphone.
+"""
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.ogg')
+
+
+def find_audio_files(paths):
+    """Expand files and directories into a sorted list of audio files"""
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names
+                             if name.lower().endswith(AUDIO_EXTENSIONS))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def load_audio(path, sample_rate=16000):
+    """Read an audio file as mono int16 at the requested sample rate"""
+    data, file_rate = sf.read(path, dtype='float32', always_2d=True)
+    audio = data.mean(axis=1)
+    if file_rate != sample_rate and len(audio) > 0:
+        num_out = int(round(len(audio) * sample_rate / file_rate))
+        positions = np.linspace(0, len(audio) - 1, num_out)
+        audio = np.interp(positions, np.arange(len(audio)), audio)
+    return np.clip(audio * 32768.0, -32768, 32767).astype(np.int16)
+
+
+class FileAudioSource:
+    def __init__(self, paths, sample_rate=16000, chunk_size=1024, realtime_factor=0.0,
+                 loop=False, max_queue_chunks=64):
+        """
+        paths: audio file(s) and/or directories to replay, in order
+        realtime_factor: 0 replays as fast as the consumer keeps up,
+                         1 paces chunks at real time, 10 at 10x, ...
+        loop: start over when the last file is done
+        """
+        self.files = find_audio_files(paths)
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.realtime_factor = realtime_factor
+        self.loop = loop
+        # Bounded, so fast replay applies back-pressure instead of buffering
+        # whole files in memory
+        self.audio_queue = queue.Queue(maxsize=max_queue_chunks)
+        self.is_recording = False
+        self.is_finished = False
+        self.chunks_emitted = 0
+        self.samples_emitted = 0
+        self.current_file = None
+
+    def start_recording(self):
+        """Start replaying the files"""
+        if self.is_recording:
+            print("Already recording!")
+            return
+        if not self.files:
+            print("⚠️  No audio files to replay")
+            self.is_finished = True
+            return
+
+        self.is_recording = True
+        self.is_finished = False
+        print(f"🎞️  Replaying {len(self.files)} file(s)...")
+
+        self.record_thread = threading.Thread(target=self._replay_loop)
+        self.record_thread.daemon = True
+        self.record_thread.start()
+
+    def _put(self, item):
+        while self.is_recording:
+            try:
+                self.audio_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _replay_loop(self):
+        chunk_seconds = self.chunk_size / self.sample_rate
+        started = time.perf_counter()
+        try:
+            while self.is_recording:
+                for path in self.files:
+                    self.current_file = path
+                    try:
+                        audio = load_audio(path, self.sample_rate)
+                    except Exception as e:
+                        print(f"❌ Error reading {path}: {e}")
+                        continue
+
+                    for start in range(0, len(audio) - self.chunk_size + 1, self.chunk_size):
+                        if self.realtime_factor > 0:
+                            due = started + self.chunks_emitted * chunk_seconds / self.realtime_factor
+                            delay = due - time.perf_counter()
+                            if delay > 0:
+                                time.sleep(delay)
+                        if not self._put((audio[start:start + self.chunk_size], time.time())):
+                            return
+                        self.chunks_emitted += 1
+                        self.samples_emitted += self.chunk_size
+                if not self.loop:
+                    break
+        finally:
+            self.is_finished = True
+            self.is_recording = False
+            try:
+                # Wake up a consumer blocked in get_audio_chunk
+                self.audio_queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def get_audio_chunk(self, timeout=0.1):
+        """Get next audio chunk, blocking up to `timeout` seconds"""
+        try:
+            return self.audio_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop_recording(self):
+        """Stop replaying"""
+        if not self.is_recording:
+            return
+        self.is_recording = False
+        print("🛑 Replay stopped")
@@ -0,0 +1,268 @@
+"""
+Chatbot session store for VoiceGuard
+
+Bounded replacement for the old module-level defaultdict of sessions:
+- a hard cap on the number of sessions, least recently used evicted first
+- lazy expiry: a session past its TTL is dropped when it is next touched
+  (and the LRU end is pruned on writes), no sweeper thread
+- history trimmed to an approximate token budget instead of a fixed
+  message count, so prompt size (and LLM latency) stays bounded
+- reads never create sessions, so unknown user_ids cost nothing
+
+MemorySessionStore keeps sessions in process; SQLiteSessionStore keeps
+them in a shared database file so several worker processes see the same
+conversations.
+
+Both are blocking APIs. SQLiteSessionStore calls can wait on another
+process's write for up to the 10 s lock timeout, so never call a store
+directly from an event loop: AsyncChatbot (and so asgi.py) runs every
+store call on its own thread pool, which makes either backend safe there.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_tokens(text):
+    """Rough token count: ~4 UTF-8 bytes per token (Devanagari counts heavier)"""
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def message_tokens(message):
+    return estimate_tokens(message["content"]) + 4  # role/formatting overhead
+
+
+def trim_history(history, token_budget, trim_to=None):
+    """
+    Drop the oldest user/assistant pairs once the history exceeds the
+    budget, down to trim_to tokens (default: the budget). Trimming well
+    below the budget leaves the history prefix unchanged for the next
+    few turns, which keeps provider-side prompt caching effective.
+    """
+    total = sum(message_tokens(m) for m in history)
+    if total <= token_budget:
+        return history, total
+    target = token_budget if trim_to is None else trim_to
+    start = 0
+    # Always keep the latest exchange, even if it alone is over budget
+    while total > target and len(history) - start > 2:
+        total -= message_tokens(history[start]) + message_tokens(history[start + 1])
+        start += 2
+    return history[start:], total
+
+
+class MemorySessionStore:
+    def __init__(self, max_sessions=10000, ttl_seconds=2 * 3600, history_token_budget=1500,
+                 trim_ratio=0.6):
+        """
+        max_sessions: hard cap; the least recently active session is evicted
+        ttl_seconds: sessions idle longer than this are expired on access
+        history_token_budget: approximate tokens of history kept per session
+        trim_ratio: an over-budget history is cut to this fraction of the
+                    budget, so trimming happens every few turns, not every turn
+        """
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.history_token_budget = history_token_budget
+        self.trim_to = int(history_token_budget * trim_ratio)
+        self.sessions = OrderedDict()  # user_id -> session, least recently active first
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, session, now):
+        return now - session["last_activity"] > self.ttl_seconds
+
+    def _live(self, user_id, now):
+        session = self.sessions.get(user_id)
+        if session is not None and self._expired(session, now):
+            del self.sessions[user_id]
+            self.expirations += 1
+            return None
+        return session
+
+    def get(self, user_id):
+        """Copy of a session (history, last_activity, language_preference) or None"""
+        with self.lock:
+            session = self._live(user_id, time.time())
+            if session is None:
+                return None
+            return dict(session, history=list(session["history"]))
+
+    def history(self, user_id):
+        with self.lock:
+            session = self._live(user_id, time.time())
+            return list(session["history"]) if session else []
+
+    def append(self, user_id, user_message, ai_response):
+        """Add an exchange, trim to the token budget; returns the history length"""
+        now = time.time()
+        with self.lock:
+            session = self._live(user_id, now)
+            if session is None:
+                session = self.sessions[user_id] = {"history": [], "language_preference": "auto"}
+            session["history"], session["history_tokens"] = trim_history(
+                session["history"] + [{"role": "user", "content": user_message},
+                                      {"role": "assistant", "content": ai_response}],
+                self.history_token_budget, self.trim_to
+            )
+            session["last_activity"] = now
+            self.sessions.move_to_end(user_id)
+            self._prune(now)
+            return len(session["history"])
+
+    def _prune(self, now):
+        # Expired sessions sit at the least recently active end
+        while self.sessions:
+            oldest = next(iter(self.sessions.values()))
+            if not self._expired(oldest, now):
+                break
+            self.sessions.popitem(last=False)
+            self.expirations += 1
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self, user_id):
+        """Empty a session's history; returns False if there was no session"""
+        with self.lock:
+            session = self._live(user_id, time.time())
+            if session is None:
+                return False
+            session["history"] = []
+            session["history_tokens"] = 0
+            return True
+
+    def list_sessions(self):
+        """(user_id, session) pairs of live sessions, most recently active first"""
+        now = time.time()
+        with self.lock:
+            return [(user_id, dict(session)) for user_id, session in reversed(self.sessions.items())
+                    if not self._expired(session, now)]
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+class SQLiteSessionStore(MemorySessionStore):
+    """
+    Sessions in a SQLite file shared by every worker process.
+    Calls block on the database lock; keep them off event loops (see the
+    module docstring).
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS chat_sessions (
+        user_id TEXT PRIMARY KEY,
+        history TEXT NOT NULL,
+        history_tokens INTEGER NOT NULL,
+        last_activity REAL NOT NULL,
+        language_preference TEXT NOT NULL DEFAULT 'auto'
+    );
+    CREATE INDEX IF NOT EXISTS idx_chat_sessions_activity ON chat_sessions (last_activity);
+    """
+
+    def __init__(self, db_path="chat_sessions.db", **kwargs):
+        super().__init__(**kwargs)
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def _load(self, user_id, now):
+        row = self.conn.execute(
+            "SELECT history, history_tokens, last_activity, language_preference "
+            "FROM chat_sessions WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        session = {"history": json.loads(row[0]), "history_tokens": row[1],
+                   "last_activity": row[2], "language_preference": row[3]}
+        if self._expired(session, now):
+            self.conn.execute("DELETE FROM chat_sessions WHERE user_id = ?", (user_id,))
+            self.expirations += 1
+            return None
+        return session
+
+    def get(self, user_id):
+        with self.lock, self.conn:
+            return self._load(user_id, time.time())
+
+    def history(self, user_id):
+        session = self.get(user_id)
+        return session["history"] if session else []
+
+    def append(self, user_id, user_message, ai_response):
+        now = time.time()
+        with self.lock, self.conn:
+            # BEGIN IMMEDIATE: read-modify-write is atomic across processes
+            self.conn.execute("BEGIN IMMEDIATE")
+            session = self._load(user_id, now) or {"history": [], "language_preference": "auto"}
+            history, tokens = trim_history(
+                session["history"] + [{"role": "user", "content": user_message},
+                                      {"role": "assistant", "content": ai_response}],
+                self.history_token_budget, self.trim_to
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO chat_sessions VALUES (?, ?, ?, ?, ?)",
+                (user_id, json.dumps(history, ensure_ascii=False), tokens, now,
+                 session["language_preference"]))
+            self._prune(now)
+            return len(history)
+
+    def _prune(self, now):
+        expired = self.conn.execute("DELETE FROM chat_sessions WHERE last_activity < ?",
+                                    (now - self.ttl_seconds,)).rowcount
+        self.expirations += expired
+        evicted = self.conn.execute(
+            "DELETE FROM chat_sessions WHERE user_id IN ("
+            "SELECT user_id FROM chat_sessions ORDER BY last_activity DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,)).rowcount
+        self.evictions += evicted
+
+    def clear(self, user_id):
+        with self.lock, self.conn:
+            if self._load(user_id, time.time()) is None:
+                return False
+            self.conn.execute("UPDATE chat_sessions SET history = '[]', history_tokens = 0 "
+                              "WHERE user_id = ?", (user_id,))
+            return True
+
+    def list_sessions(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT user_id, history, history_tokens, last_activity, language_preference "
+                "FROM chat_sessions WHERE last_activity >= ? ORDER BY last_activity DESC",
+                (time.time() - self.ttl_seconds,)).fetchall()
+        return [(row[0], {"history": json.loads(row[1]), "history_tokens": row[2],
+                          "last_activity": row[3], "language_preference": row[4]}) for row in rows]
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()[0]
+
+    def stats(self):
+        return dict(super().stats(), backend="sqlite", sessions=len(self))
+
+
+def create_session_store(backend=None, **kwargs):
+    """Session store from CHAT_SESSION_BACKEND ("memory" or "sqlite") / CHAT_SESSION_DB"""
+    backend = backend or os.getenv("CHAT_SESSION_BACKEND", "memory")
+    if backend == "sqlite":
+        return SQLiteSessionStore(os.getenv("CHAT_SESSION_DB", "chat_sessions.db"), **kwargs)
+    if backend == "memory":
+        return MemorySessionStore(**kwargs)
+    raise ValueError(f"Unknown session backend: {backend}")
@@ -1,12 +1,28 @@
 # send_sos.py
 import logging
+import os
+import random
 import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from utils.metrics import metrics
 
 # It's good practice to get keys from environment variables, but for this example, we keep it here.
-API_URL = "https://api.smsmobileapi.com/sendsms/"
+API_URL = os.environ.get("SMS_API_URL", "https://api.smsmobileapi.com/sendsms/")
 API_KEY = "9128ffa5c5e683d5b606630ff6f59d72541984b3a009865d"
 
+# Customize your SOS message here
+SOS_MESSAGE = "SOS from VoiceGuard: An urgent alert has been triggered. Please check on the user immediately. This is a potential emergency."
+
+SMS_SEND_MS = metrics.histogram("voiceguard_sms_send_ms",
+                                "SMS gateway send incl. retries, per request (ms)", ("outcome",))
+
 # Setup logger once
 logging.basicConfig(
     level=logging.INFO,
@@ -14,41 +30,184 @@ logging.basicConfig(
     handlers=[logging.StreamHandler(sys.stdout)],
 )
 
-def sos(phone):
-    """
-    Sends an SOS SMS to the given phone number.
-    Returns True for success, False for failure.
-    """
-    try:
-        if not phone:
-            logging.error("Phone number is required for SOS.")
-            return False
 
-        # Customize your SOS message here
-        message = "SOS from VoiceGuard: An urgent alert has been triggered. Please check on the user immediately. This is a potential emergency."
+class AlertDispatcher:
+    def __init__(self, api_url=API_URL, api_key=API_KEY, max_workers=8, request_timeout=5.0,
+                 deadline_seconds=30.0, max_attempts=4, backoff_base=0.5, backoff_max=4.0):
+        """
+        Sends SOS SMS to many contacts at once over one pooled HTTP session.
+
+        request_timeout: seconds for a single gateway request
+        deadline_seconds: give up on a recipient once this much time has
+                          passed since the alert was dispatched
+        max_attempts: tries per recipient (network errors, 429 and 5xx retry)
+        backoff_base/backoff_max: exponential backoff with full jitter
+        """
+        self.api_url = api_url
+        self.api_key = api_key
+        self.request_timeout = request_timeout
+        self.deadline_seconds = deadline_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # Keep-alive connections are reused across alerts and recipients
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sos")
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def send(self, phone, message=SOS_MESSAGE, deadline=None, max_attempts=None):
+        """
+        Send one SMS, retrying until it is accepted or the deadline passes.
+        max_attempts: overrides the dispatcher's (1 = no retries here, for
+                      callers such as the outbox that retry themselves)
+        Returns a result dict: phone, ok, attempts, status_code, error,
+        elapsed_ms and delivered_at.
+        """
+        max_attempts = max_attempts or self.max_attempts
+        started = time.monotonic()
+        deadline = deadline or started + self.deadline_seconds
+        result = {"phone": phone, "ok": False, "attempts": 0, "status_code": None,
+                  "error": None, "elapsed_ms": None, "delivered_at": None}
+        if not phone:
+            result["error"] = "Phone number is required for SOS."
+            logging.error(result["error"])
+            return result
 
         params = {
             "recipients": phone,
             "message": message,
-            "apikey": API_KEY,
+            "apikey": self.api_key,
         }
 
-        logging.info(f"Sending SOS SMS to {phone}")
-        resp = requests.get(API_URL, params=params, timeout=15)
-        logging.info(f"SMS API Response - Status: {resp.status_code}, URL: {resp.url}")
+        while result["attempts"] < max_attempts:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                result["error"] = result["error"] or "deadline exceeded"
+                break
 
-        try:
-            logging.info(f"Response JSON: {resp.json()}")
-        except requests.exceptions.JSONDecodeError:
-            logging.info(f"Response Text: {resp.text[:500]}")
+            result["attempts"] += 1
+            retry = True
+            try:
+                logging.info(f"Sending SOS SMS to {phone} (attempt {result['attempts']})")
+                resp = self.session.get(self.api_url, params=params,
+                                        timeout=min(self.request_timeout, remaining))
+                result["status_code"] = resp.status_code
+                logging.info(f"SMS API Response - Status: {resp.status_code}, Phone: {phone}")
+                if resp.ok:
+                    result["ok"] = True
+                    result["error"] = None
+                    result["delivered_at"] = datetime.now().isoformat()
+                    break
+                result["error"] = f"HTTP {resp.status_code}: {resp.text[:200]}"
+                # Client errors other than rate limiting will not succeed on retry
+                retry = resp.status_code == 429 or resp.status_code >= 500
+            except requests.RequestException as e:
+                logging.error(f"Network/Request error while sending SMS to {phone}: {e}")
+                result["error"] = str(e)
 
-        if resp.ok:
-            logging.info("SMS request sent successfully.")
-            return True
-        else:
-            logging.warning("SMS request failed. Check API response above.")
-            return False
+            if not retry or result["attempts"] >= max_attempts:
+                break
+            time.sleep(max(0.0, min(self._backoff(result["attempts"]), deadline - time.monotonic())))
+
+        result["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+        SMS_SEND_MS.labels("ok" if result["ok"] else "failed").observe(result["elapsed_ms"])
+        if not result["ok"]:
+            logging.warning(f"SMS to {phone} failed after {result['attempts']} attempt(s): {result['error']}")
+        return result
+
+    def dispatch(self, contacts, message=SOS_MESSAGE, on_complete=None):
+        """
+        Fan an alert out to every contact concurrently.
+        Returns a Future that resolves to the list of per-recipient results
+        (in contact order) once every recipient has succeeded or given up;
+        on_complete(results) is called at the same time.
+        """
+        done = Future()
+        contacts = list(contacts)
+        if not contacts:
+            done.set_result([])
+            if on_complete:
+                on_complete([])
+            return done
+
+        deadline = time.monotonic() + self.deadline_seconds
+        results = [None] * len(contacts)
+        pending = [len(contacts)]
+        lock = threading.Lock()
+
+        def finished(index, future):
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                results[index] = {"phone": contacts[index], "ok": False, "attempts": 0,
+                                  "status_code": None, "error": str(e), "elapsed_ms": None,
+                                  "delivered_at": None}
+            with lock:
+                pending[0] -= 1
+                last = pending[0] == 0
+            if last:
+                if on_complete:
+                    try:
+                        on_complete(results)
+                    except Exception as e:
+                        print(f"❌ Alert callback failed: {e}")
+                done.set_result(results)
 
-    except requests.RequestException as e:
-        logging.error(f"Network/Request error while sending SMS: {e}")
-        return False
+        for index, phone in enumerate(contacts):
+            future = self.executor.submit(self.send, phone, message, deadline)
+            future.add_done_callback(lambda f, i=index: finished(i, f))
+        return done
+
+    def close(self, wait=True):
+        """Wait for in-flight alerts (if wait) and release the connection pool"""
+        self.executor.shutdown(wait=wait)
+        self.session.close()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Shared dispatcher so every alert reuses the same connection pool"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = AlertDispatcher()
+        return _dispatcher
+
+
+def sos(phone):
+    """
+    Sends an SOS SMS to the given phone number.
+    Returns True for success, False for failure.
+    """
+    result = get_dispatcher().send(phone)
+    if result["ok"]:
+        logging.info("SMS request sent successfully.")
+    return result["ok"]
+
+
+def alert_contacts(contacts):
+    """
+    Sends an SOS SMS to every contact concurrently and waits for them.
+    Returns the list of per-recipient results.
+    """
+    results = get_dispatcher().dispatch(contacts).result()
+    print_alert_results(results)
+    return results
+
+
+def print_alert_results(results):
+    for result in results:
+        if result["ok"]:
+            print(f"✅ SOS sent to {result['phone']} in {result['elapsed_ms']:.0f} ms "
+                  f"({result['attempts']} attempt(s))")
+        else:
+            print(f"❌ Failed to send SOS to {result['phone']}: {result['error']}")
@@ -6,107 +6,231 @@ import numpy as np
 import tempfile
 import soundfile as sf
 import os
-import re
+import time
+from utils.keywords import KeywordMatcher, DEFAULT_LEXICON_PATH
+from utils.model_registry import model_registry
+
+WHISPER_SAMPLE_RATE = 16000
+
+# whisper.transcribe() defaults: a decode is suspect (and retried at a higher
+# temperature there) when it is too repetitive or too unlikely, unless the
+# clip is judged silent
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
 
 class SpeechAnalyzer:
-    def __init__(self, model_size="base"):
+    def __init__(self, model_size="base", in_memory=True, lexicon_path=DEFAULT_LEXICON_PATH,
+                 quantize=False, device=None, registry=model_registry):
         """
         Initialize Whisper model
         model_size: tiny, base, small, medium, large
+        in_memory: transcribe from NumPy arrays instead of temp WAV files
+        lexicon_path: threat keyword lexicon (JSON, see data/threat_keywords.json)
+        quantize: use the int8 dynamically quantized CPU variant
+        registry: models are shared through this registry, so a new analyzer
+                  reuses an already loaded (or preloading) model
         """
-        print(f"🤖 Loading Whisper model ({model_size})...")
+        self.in_memory = in_memory
         try:
-            self.model = whisper.load_model(model_size)
-            print(f"✅ Whisper model loaded successfully")
+            self.model = registry.get(model_size, device=device, quantize=quantize)
         except Exception as e:
             print(f"❌ Error loading Whisper: {e}")
             self.model = None
         
-        # Aggressive/abusive keywords for Indian context
-        self.threat_keywords = {
-            'high': [
-                'kill', 'murder', 'die', 'death', 'hurt', 'pain', 'beat', 'hit', 
-                'destroy', 'break', 'smash', 'attack', 'fight', 'violence',
-                'stupid', 'idiot', 'useless', 'worthless', 'hate', 'disgust'
-            ],
-            'medium': [
-                'angry', 'mad', 'upset', 'annoyed', 'frustrated', 'irritated',
-                'shut up', 'stop', 'enough', 'problem', 'wrong', 'bad'
-            ]
-        }
-        
-        # Hindi/Hinglish aggressive words (common in Indian households)
-        self.hindi_threats = [
-            'maar', 'marunga', 'khatam', 'pagal', 'bewakoof', 'gadha', 
-            'chup', 'band kar', 'paagal hai', 'dimag kharab'
-        ]
+        # Aggressive/abusive keywords (English + Hinglish) for Indian context,
+        # compiled into a single word-boundary matcher
+        try:
+            self.keyword_matcher = KeywordMatcher.from_file(lexicon_path)
+            print(f"✅ Threat lexicon loaded ({self.keyword_matcher.term_count} terms)")
+        except Exception as e:
+            print(f"❌ Error loading threat lexicon: {e}")
+            self.keyword_matcher = KeywordMatcher({})
     
-    def transcribe_audio(self, audio_data, sample_rate=16000):
+    def _to_float32(self, audio_data):
+        """Normalize audio to float32 in [-1, 1]"""
+        if audio_data.dtype == np.int16:
+            return audio_data.astype(np.float32) / 32768.0
+        return audio_data.astype(np.float32)
+
+    def _to_whisper_input(self, audio_data, sample_rate):
+        """float32 audio at Whisper's 16 kHz sample rate"""
+        audio_float = self._to_float32(audio_data)
+        if sample_rate != WHISPER_SAMPLE_RATE and len(audio_float) > 0:
+            # Whisper expects 16 kHz input; resample linearly
+            num_out = int(round(len(audio_float) * WHISPER_SAMPLE_RATE / sample_rate))
+            positions = np.linspace(0, len(audio_float) - 1, num_out)
+            audio_float = np.interp(positions, np.arange(len(audio_float)), audio_float).astype(np.float32)
+        return audio_float
+
+    def _transcribe_in_memory(self, audio_data, sample_rate, timings):
+        """Hand Whisper a float32 array directly (no temp file, no ffmpeg)"""
+        start = time.perf_counter()
+        audio_float = self._to_whisper_input(audio_data, sample_rate)
+        timings["prepare_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        result = self.model.transcribe(audio_float, language=None)  # Auto-detect language
+        timings["transcribe_ms"] = (time.perf_counter() - start) * 1000
+        return result
+
+    def _transcribe_from_file(self, audio_data, sample_rate, timings):
+        """Write a temporary WAV and let Whisper decode it through ffmpeg"""
+        start = time.perf_counter()
+        audio_float = self._to_float32(audio_data)
+        timings["prepare_ms"] = (time.perf_counter() - start) * 1000
+
+        # Create temporary file for Whisper
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+            temp_path = temp_file.name
+        try:
+            start = time.perf_counter()
+            sf.write(temp_path, audio_float, sample_rate)
+            timings["write_ms"] = (time.perf_counter() - start) * 1000
+
+            # Transcribe with Whisper
+            start = time.perf_counter()
+            result = self.model.transcribe(temp_path, language=None)  # Auto-detect language
+            timings["transcribe_ms"] = (time.perf_counter() - start) * 1000
+            return result
+        finally:
+            # Clean up
+            os.unlink(temp_path)
+
+    def transcribe_audio(self, audio_data, sample_rate=16000, in_memory=None):
         """
         Convert audio to text using Whisper
+
+        in_memory: pass the normalized array straight to the model (default
+        from the analyzer). Falls back to the temp-file path if that fails.
+        The per-stage timings are returned under "timings_ms".
         """
         if self.model is None:
             return {"text": "", "language": "unknown", "error": "Whisper not loaded"}
-        
+
+        if in_memory is None:
+            in_memory = self.in_memory
+
+        total_start = time.perf_counter()
+        timings = {}
+        mode = "memory" if in_memory else "file"
+        fallback_error = None
+
         try:
-            # Create temporary file for Whisper
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                # Convert to float32 if needed
-                if audio_data.dtype == np.int16:
-                    audio_float = audio_data.astype(np.float32) / 32768.0
-                else:
-                    audio_float = audio_data.astype(np.float32)
-                
-                # Save temporary audio file
-                sf.write(temp_file.name, audio_float, sample_rate)
-                
-                # Transcribe with Whisper
-                result = self.model.transcribe(temp_file.name, language=None)  # Auto-detect language
-                
-                # Clean up
-                os.unlink(temp_file.name)
-                
-                return {
-                    "text": result["text"].strip(),
-                    "language": result["language"],
-                    "error": None
-                }
-                
+            if in_memory:
+                try:
+                    result = self._transcribe_in_memory(audio_data, sample_rate, timings)
+                except Exception as e:
+                    print(f"⚠️  In-memory transcription failed ({e}), falling back to file")
+                    fallback_error = str(e)
+                    mode = "file"
+                    timings = {}
+                    result = self._transcribe_from_file(audio_data, sample_rate, timings)
+            else:
+                result = self._transcribe_from_file(audio_data, sample_rate, timings)
+
+            timings["total_ms"] = (time.perf_counter() - total_start) * 1000
+            return {
+                "text": result["text"].strip(),
+                "language": result["language"],
+                "error": None,
+                "mode": mode,
+                "fallback_error": fallback_error,
+                "timings_ms": {k: round(v, 1) for k, v in timings.items()}
+            }
+
         except Exception as e:
-            return {"text": "", "language": "unknown", "error": str(e)}
-    
+            return {"text": "", "language": "unknown", "error": str(e), "mode": mode}
+
+    def transcribe_batch(self, audio_list, sample_rate=16000):
+        """
+        Transcribe several clips in one padded Whisper call.
+        Each clip is padded/trimmed to Whisper's 30 s window and the log-mel
+        spectrograms are decoded as a single batch, so pending jobs from
+        many streams share one forward pass. Returns one transcription
+        dict per clip, in order.
+
+        The batch is a single greedy decode without transcribe()'s
+        temperature fallback, so clips whose result fails its checks
+        (compression ratio, average log-prob) are transcribed again on
+        their own; a clip gets the same quality whether or not it shared
+        a batch.
+        """
+        if self.model is None:
+            return [{"text": "", "language": "unknown", "error": "Whisper not loaded"}
+                    for _ in audio_list]
+        if len(audio_list) == 1:
+            return [self.transcribe_audio(audio_list[0], sample_rate)]
+
+        try:
+            import torch
+
+            start = time.perf_counter()
+            n_mels = getattr(self.model.dims, "n_mels", 80)
+            mel = torch.stack([
+                whisper.log_mel_spectrogram(
+                    whisper.pad_or_trim(torch.from_numpy(self._to_whisper_input(audio, sample_rate))),
+                    n_mels
+                )
+                for audio in audio_list
+            ]).to(self.model.device)
+            prepare_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            options = whisper.DecodingOptions(fp16=self.model.device.type == "cuda")  # Auto-detect language
+            results = whisper.decode(self.model, mel, options)
+            transcribe_ms = (time.perf_counter() - start) * 1000
+
+            timings = {
+                "prepare_ms": round(prepare_ms, 1),
+                "transcribe_ms": round(transcribe_ms, 1),
+                "total_ms": round(prepare_ms + transcribe_ms, 1),
+                "batch_size": len(audio_list)
+            }
+            transcriptions = []
+            for audio, result in zip(audio_list, results):
+                silent = (result.no_speech_prob > NO_SPEECH_THRESHOLD and
+                          result.avg_logprob < LOGPROB_THRESHOLD)
+                if not silent and (result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or
+                                   result.avg_logprob < LOGPROB_THRESHOLD):
+                    transcription = self.transcribe_audio(audio, sample_rate)
+                    transcription["fallback_error"] = "batch decode failed quality checks"
+                    transcriptions.append(transcription)
+                    continue
+                transcriptions.append({
+                    # transcribe() drops silent windows too
+                    "text": "" if silent else result.text.strip(),
+                    "language": result.language,
+                    "error": None,
+                    "mode": "batch",
+                    "fallback_error": None,
+                    "timings_ms": timings
+                })
+            return transcriptions
+
+        except Exception as e:
+            print(f"⚠️  Batched transcription failed ({e}), transcribing one by one")
+            return [self.transcribe_audio(audio, sample_rate) for audio in audio_list]
+
     def analyze_text_threats(self, text):
         """
         Analyze text for threatening/abusive content
         """
         if not text:
-            return {"threat_score": 0.0, "threat_level": "NONE", "keywords_found": []}
+            return {"threat_score": 0.0, "threat_level": "NONE", "keywords_found": [], "keyword_hits": []}
         
-        text_lower = text.lower()
         keywords_found = []
         threat_score = 0.0
         
-        # Check for high-threat keywords
-        for keyword in self.threat_keywords['high']:
-            if keyword in text_lower:
-                keywords_found.append(keyword)
-                threat_score += 0.3
-        
-        # Check for medium-threat keywords  
-        for keyword in self.threat_keywords['medium']:
-            if keyword in text_lower:
-                keywords_found.append(keyword)
-                threat_score += 0.15
-        
-        # Check for Hindi/Hinglish threats
-        for keyword in self.hindi_threats:
-            if keyword in text_lower:
-                keywords_found.append(keyword)
-                threat_score += 0.25
+        # High/medium English and Hindi/Hinglish keywords in one pass
+        keyword_hits = self.keyword_matcher.match(text)
+        for hit in keyword_hits:
+            keywords_found.append(hit["keyword"])
+            threat_score += hit["weight"]
         
         # Check for excessive capitalization (shouting)
         if len(text) > 10:
-            caps_ratio = sum(1 for c in text if c.isupper()) / len(text)
+            caps_ratio = sum(map(str.isupper, text)) / len(text)
             if caps_ratio > 0.6:
                 threat_score += 0.2
                 keywords_found.append("EXCESSIVE_CAPS")
@@ -132,16 +256,12 @@ class SpeechAnalyzer:
         return {
             "threat_score": threat_score,
             "threat_level": threat_level,
-            "keywords_found": keywords_found
+            "keywords_found": keywords_found,
+            "keyword_hits": keyword_hits
         }
     
-    def analyze_audio_with_text(self, audio_data, sample_rate=16000):
-        """
-        Complete analysis: speech-to-text + threat analysis
-        """
-        # Transcribe audio
-        transcription = self.transcribe_audio(audio_data, sample_rate)
-        
+    def _combine(self, transcription):
+        """Threat analysis on top of a transcription"""
         # Analyze text for threats
         text_analysis = self.analyze_text_threats(transcription["text"])
         
@@ -156,3 +276,57 @@ class SpeechAnalyzer:
                 "threatening_words": text_analysis["keywords_found"]
             }
         }
+
+    def analyze_audio_with_text(self, audio_data, sample_rate=16000):
+        """
+        Complete analysis: speech-to-text + threat analysis
+        """
+        # Transcribe audio
+        transcription = self.transcribe_audio(audio_data, sample_rate)
+        return self._combine(transcription)
+
+    def analyze_audio_batch(self, audio_list, sample_rate=16000):
+        """
+        Complete analysis for several clips with one batched Whisper call
+        """
+        return [self._combine(transcription)
+                for transcription in self.transcribe_batch(audio_list, sample_rate)]
+
+    def analyze_incremental_batch(self, cached_segments, tails, sample_rate=16000, min_tail_seconds=0.1):
+        """
+        Complete analysis from already transcribed speech segments plus the
+        untranscribed tail of each window (see utils/transcript_cache.py).
+        Only the tails go through Whisper, in one batched call.
+        cached_segments: per window, the SpeechSegments covering its start
+        tails: per window, the audio after the last cached segment
+        """
+        min_tail = int(min_tail_seconds * sample_rate)
+        indices = [i for i, tail in enumerate(tails) if len(tail) >= min_tail]
+        tail_transcriptions = {}
+        if indices:
+            tail_transcriptions = dict(zip(indices, self.transcribe_batch([tails[i] for i in indices],
+                                                                          sample_rate)))
+
+        analyses = []
+        for i, segments in enumerate(cached_segments):
+            tail = tail_transcriptions.get(i, {"text": "", "language": "unknown", "error": None})
+            texts = [segment.text for segment in segments if segment.text]
+            if tail["text"]:
+                texts.append(tail["text"])
+            languages = [segment.language for segment in segments if segment.text]
+            language = tail["language"] if tail["text"] else (languages[-1] if languages else "unknown")
+
+            timings = dict(tail.get("timings_ms") or {})
+            timings.setdefault("total_ms", 0.0)
+            timings["cached_segments"] = len(segments)
+            timings["tail_seconds"] = round(len(tails[i]) / sample_rate, 2)
+            analyses.append(self._combine({
+                "text": " ".join(texts),
+                "language": language,
+                "error": tail["error"],
+                "mode": "incremental",
+                "fallback_error": tail.get("fallback_error"),
+                "timings_ms": timings,
+                "segments": [segment.to_dict() for segment in segments]
+            }))
+        return analyses
@@ -0,0 +1,196 @@
+"""
+Incremental transcription for VoiceGuard
+
+Instead of decoding the whole evidence window after an incident triggers,
+the VAD's speech segments are queued while speech happens (SpeechSegmenter)
+and the analysis worker transcribes them in the background whenever it is
+idle. Each segment's text and keyword hits are cached here, keyed by the
+absolute sample offsets of the segment (see AudioBuffer).
+
+At incident time the transcript is assembled from the cached segments that
+cover the start of the evidence window, and only the remaining tail (the
+speech still in progress plus anything not transcribed yet) goes through
+Whisper, so the incident-time ASR cost is O(tail) instead of O(window).
+
+With a distress classifier (utils/distress.py) the segmenter scores each
+segment first and only queues the distressed ones; the rest are recorded
+as skipped, so if an incident does happen they are transcribed with the
+tail instead of in the background.
+"""
+import threading
+from collections import deque
+
+from utils.vad import SHORT
+
+
+class SpeechSegment:
+    """One VAD-delimited stretch of speech and, once transcribed, its text"""
+    def __init__(self, stream_id, start_offset, audio_data, sample_rate=16000):
+        self.stream_id = stream_id
+        self.start_offset = start_offset
+        self.end_offset = start_offset + len(audio_data)
+        self.sample_rate = sample_rate
+        self.audio_data = audio_data  # dropped once transcribed
+        self.status = "pending"       # pending -> done | failed | skipped
+        self.text = ""
+        self.language = "unknown"
+        self.keyword_hits = []
+        self.transcribe_ms = None
+        self.distress = None          # SpeechSegmenter's distress score, if it has a classifier
+
+    @property
+    def seconds(self):
+        return (self.end_offset - self.start_offset) / self.sample_rate
+
+    def to_dict(self):
+        return {
+            "start_offset": self.start_offset,
+            "end_offset": self.end_offset,
+            "text": self.text,
+            "language": self.language,
+            "keywords": [hit["keyword"] for hit in self.keyword_hits],
+            "transcribe_ms": self.transcribe_ms
+        }
+
+
+class TranscriptCache:
+    def __init__(self, max_segments_per_stream=64):
+        """
+        max_segments_per_stream: oldest segments are forgotten past this
+                                 (they have left the evidence buffer anyway)
+        """
+        self.max_segments_per_stream = max_segments_per_stream
+        self.streams = {}  # stream_id -> deque of SpeechSegment, oldest first
+        self.lock = threading.Lock()
+
+        self.segments_added = 0
+        self.segments_transcribed = 0
+        self.segments_failed = 0
+        self.segments_skipped = 0
+        self.assembled = 0
+        self.cached_seconds = 0.0
+        self.tail_seconds = 0.0
+
+    def add(self, segment):
+        with self.lock:
+            segments = self.streams.get(segment.stream_id)
+            if segments is None:
+                segments = self.streams[segment.stream_id] = deque(maxlen=self.max_segments_per_stream)
+            segments.append(segment)
+            self.segments_added += 1
+
+    def complete(self, segment, text="", language="unknown", keyword_hits=None,
+                 transcribe_ms=None, error=None):
+        """Store a segment's transcription (or mark it failed)"""
+        with self.lock:
+            segment.audio_data = None
+            if error:
+                segment.status = "failed"
+                self.segments_failed += 1
+                return
+            segment.text = text
+            segment.language = language
+            segment.keyword_hits = keyword_hits or []
+            segment.transcribe_ms = transcribe_ms
+            segment.status = "done"
+            self.segments_transcribed += 1
+
+    def skip(self, segment):
+        """Segment will not be transcribed (dropped from a full queue or superseded)"""
+        with self.lock:
+            segment.audio_data = None
+            segment.status = "skipped"
+            self.segments_skipped += 1
+
+    def assemble(self, stream_id, start_offset, end_offset):
+        """
+        Cached segments covering [start_offset, end_offset) and the offset
+        where the untranscribed tail begins. Coverage stops at the first
+        segment that is not transcribed yet, so nothing after it is trusted;
+        gaps between segments are non-speech and need no transcription.
+        """
+        covered = []
+        tail_offset = start_offset
+        with self.lock:
+            for segment in self.streams.get(stream_id, ()):
+                if segment.end_offset <= start_offset:
+                    continue
+                if segment.start_offset >= end_offset or segment.status != "done":
+                    break
+                covered.append(segment)
+                tail_offset = max(tail_offset, segment.end_offset)
+            tail_offset = min(tail_offset, end_offset)
+            self.assembled += 1
+            sample_rate = covered[0].sample_rate if covered else None
+            if sample_rate:
+                self.cached_seconds += (tail_offset - start_offset) / sample_rate
+        return covered, tail_offset
+
+    def record_tail(self, seconds):
+        with self.lock:
+            self.tail_seconds += seconds
+
+    def clear(self, stream_id=None):
+        with self.lock:
+            if stream_id is None:
+                self.streams.clear()
+            else:
+                self.streams.pop(stream_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "segments": sum(len(segments) for segments in self.streams.values()),
+                "added": self.segments_added,
+                "transcribed": self.segments_transcribed,
+                "failed": self.segments_failed,
+                "skipped": self.segments_skipped,
+                "assembled": self.assembled,
+                "cached_seconds": round(self.cached_seconds, 1),
+                "tail_seconds": round(self.tail_seconds, 1)
+            }
+
+
+class SpeechSegmenter:
+    def __init__(self, audio_buffer, analysis_worker, stream_id=None, skip_short=True,
+                 distress_classifier=None, distress_threshold=0.5):
+        """
+        Turn the VAD's speech segment events (see utils/vad.py) into segment
+        jobs for background transcription. Hangover, pre-roll and the
+        maximum segment length are VAD settings.
+
+        skip_short: do not transcribe segments the VAD flagged SHORT
+                    (sub-word blips Whisper tends to hallucinate on)
+        distress_classifier: optional DistressClassifier; segments scoring
+                             below distress_threshold are not transcribed
+        """
+        self.audio_buffer = audio_buffer
+        self.analysis_worker = analysis_worker
+        self.stream_id = stream_id
+        self.skip_short = skip_short
+        self.distress_classifier = distress_classifier
+        self.distress_threshold = distress_threshold
+        self.segments_emitted = 0
+        self.segments_short = 0
+        self.segments_gated = 0
+
+    def handle_events(self, events, sample_rate=16000):
+        for event in events:
+            if not event.is_end:
+                continue
+            if self.skip_short and event.flags & SHORT:
+                self.segments_short += 1
+                continue
+            start_offset = max(event.segment.start_offset, self.audio_buffer.start_offset)
+            audio = self.audio_buffer.get_audio_range(start_offset, event.offset)
+            if not len(audio):
+                continue
+            segment = SpeechSegment(self.stream_id, start_offset, audio, sample_rate)
+            if self.distress_classifier is not None:
+                segment.distress = self.distress_classifier.score_segment(audio, sample_rate)
+                if segment.distress["distress"] < self.distress_threshold:
+                    self.analysis_worker.skip_segment(segment)
+                    self.segments_gated += 1
+                    continue
+            self.analysis_worker.submit_segment(segment)
+            self.segments_emitted += 1
@@ -1,54 +1,305 @@
 """
 Voice Activity Detection utilities for VoiceGuard
+
+Besides per-frame speech decisions, the detector runs a small segment state
+machine (silence -> speech -> silence) over the 30 ms frames and emits
+SpeechEvents with absolute sample offsets:
+- speech starts after min_speech_ms of consecutive speech frames, backdated
+  by pre_roll_ms so the first syllable is not cut off
+- speech ends after hangover_ms of non-speech, so short pauses do not split
+  a sentence; segments longer than max_segment_seconds are split
+- every segment keeps running statistics (RMS, peak, speech ratio) updated
+  frame by frame, so consumers never rescan its audio
+
+The per-frame level features (RMS, peak, ZCR) come from utils/features.py,
+computed once for the frames the VAD processes and published as `features`
+for later stages. Chunks of silence outside a segment get no features at
+all. Spectral features (pitch, centroid) are not computed here; stages that
+need them compute them on demand for the few chunks that matter.
+
+Offsets count samples since the detector was created, which matches
+AudioBuffer offsets when both are fed the same stream.
 """
 import webrtcvad
 import numpy as np
 from collections import deque
 
+from utils.features import FeatureExtractor, FrameFeatures
+
+# SpeechEvent flags (bit mask, test with `event.flags & LOUD`)
+SPEECH_START = 1
+SPEECH_END = 2
+SPLIT = 4       # end forced by max_segment_seconds, speech continues
+CONTINUED = 8   # start of the segment that follows a split
+LOUD = 16       # ended segment's RMS above loud_rms
+SHORT = 32      # ended segment shorter than min_segment_ms (likely a blip)
+FLUSHED = 64    # end forced by flush() (stream stopped mid-speech)
+
+
+class SegmentStats:
+    """
+    Running statistics of one speech segment, updated once per frame.
+    Non-speech frames are held back until speech resumes, so the hangover
+    silence that ends a segment never dilutes its level or speech ratio.
+    """
+    def __init__(self, start_offset, sample_rate):
+        self.start_offset = start_offset
+        self.end_offset = start_offset
+        self.sample_rate = sample_rate
+        self.frames = 0
+        self.speech_frames = 0
+        self.sum_squares = 0.0
+        self.samples = 0
+        self.peak = 0
+        self.trailing = []  # non-speech frames since the last speech frame
+
+    def add_frame(self, end_offset, is_speech, rms, peak, frame_size):
+        self.end_offset = end_offset
+        if not is_speech:
+            self.trailing.append((rms, peak, frame_size))
+            return
+        for frame in self.trailing:
+            self._accumulate(False, *frame)
+        self.trailing.clear()
+        self._accumulate(True, rms, peak, frame_size)
+
+    def _accumulate(self, is_speech, rms, peak, frame_size):
+        self.frames += 1
+        self.speech_frames += is_speech
+        self.sum_squares += rms * rms * frame_size
+        self.samples += frame_size
+        if peak > self.peak:
+            self.peak = peak
+
+    @property
+    def duration(self):
+        return (self.end_offset - self.start_offset) / self.sample_rate
+
+    @property
+    def rms(self):
+        return (self.sum_squares / self.samples) ** 0.5 if self.samples else 0.0
+
+    @property
+    def speech_ratio(self):
+        return self.speech_frames / self.frames if self.frames else 0.0
+
+    def to_dict(self):
+        return {
+            "start_offset": self.start_offset,
+            "end_offset": self.end_offset,
+            "duration": round(self.duration, 3),
+            "rms": round(self.rms, 1),
+            "peak": int(self.peak),
+            "speech_ratio": round(self.speech_ratio, 3)
+        }
+
+
+class SpeechEvent:
+    def __init__(self, flags, offset, segment):
+        """
+        flags: SPEECH_START or SPEECH_END plus modifiers (SPLIT, LOUD, ...)
+        offset: absolute sample offset where the segment starts / ends
+        segment: SegmentStats of the segment (final for end events)
+        """
+        self.flags = flags
+        self.offset = offset
+        self.segment = segment
+
+    @property
+    def is_start(self):
+        return bool(self.flags & SPEECH_START)
+
+    @property
+    def is_end(self):
+        return bool(self.flags & SPEECH_END)
+
+    def __repr__(self):
+        kind = "start" if self.is_start else "end"
+        return f"SpeechEvent({kind}, offset={self.offset}, flags={self.flags})"
+
+
 class VoiceActivityDetector:
-    def __init__(self, sample_rate=16000, aggressiveness=3):
+    def __init__(self, sample_rate=16000, aggressiveness=3, hangover_ms=300, pre_roll_ms=200,
+                 min_speech_ms=60, min_segment_ms=250, max_segment_seconds=6.0, loud_rms=1000,
+                 feature_extractor=None):
         """
         aggressiveness: 0-3, where 3 is most aggressive (less likely to detect silence as speech)
+        hangover_ms: non-speech that ends a segment
+        pre_roll_ms: audio before the first speech frame included in a segment
+        min_speech_ms: consecutive speech needed to start a segment
+        min_segment_ms: ended segments shorter than this are flagged SHORT
+        max_segment_seconds: longer speech is split into several segments
+        loud_rms: segments above this RMS are flagged LOUD
+        feature_extractor: FeatureExtractor for the VAD frames (default: one
+                           matching the frame size)
         """
         self.sample_rate = sample_rate
         self.frame_duration = 30  # 30ms frames
         self.frame_size = int(sample_rate * self.frame_duration / 1000)
-        
+        self.frame_bytes = self.frame_size * 2  # int16 samples
+
         self.vad = webrtcvad.Vad(aggressiveness)
-        self.audio_buffer = deque()
+        self.feature_extractor = feature_extractor or FeatureExtractor(sample_rate, self.frame_size)
+        self.features = FrameFeatures.empty()  # features of the frames in the latest call
         self.speech_frames = deque(maxlen=20)  # Track last 20 frames
-        
+        self.frames_processed = 0
+
+        # Segment state machine, counted in frames
+        self.hangover_frames = max(1, int(round(hangover_ms / self.frame_duration)))
+        self.start_frames = max(1, int(round(min_speech_ms / self.frame_duration)))
+        self.pre_roll_samples = int(pre_roll_ms * sample_rate / 1000)
+        self.min_segment_samples = int(min_segment_ms * sample_rate / 1000)
+        self.max_segment_samples = int(max_segment_seconds * sample_rate)
+        self.loud_rms = loud_rms
+        self.segment = None          # SegmentStats of the open segment
+        self.speech_run = 0          # consecutive speech frames (while silent)
+        self.silence_run = 0         # consecutive non-speech frames (while in speech)
+        self.last_segment_end = 0
+        self.events = []             # events from the latest is_speech_detected()
+        self.segments_started = 0
+        self.segments_ended = 0
+
+        # Contiguous int16 staging area; samples that don't fill a whole
+        # frame stay at the front and carry over to the next chunk
+        self.staging = np.zeros(self.frame_size * 4, dtype=np.int16)
+        self.staged_samples = 0
+
     def add_audio(self, audio_data):
         """Add audio data to buffer"""
         # Convert to 16-bit PCM
         if audio_data.dtype != np.int16:
             audio_data = (audio_data * 32767).astype(np.int16)
-        self.audio_buffer.extend(audio_data)
-    
+
+        needed = self.staged_samples + len(audio_data)
+        if needed > len(self.staging):
+            grown = np.zeros(max(needed, 2 * len(self.staging)), dtype=np.int16)
+            grown[:self.staged_samples] = self.staging[:self.staged_samples]
+            self.staging = grown
+
+        self.staging[self.staged_samples:needed] = audio_data
+        self.staged_samples = needed
+
+    @property
+    def in_speech(self):
+        """True while a segment is open (including its hangover)"""
+        return self.segment is not None
+
     def is_speech_detected(self):
-        """Process buffered audio and return if speech is detected"""
+        """
+        Process buffered audio and return if speech is detected.
+        Segment events produced by these frames are left in self.events.
+        """
         speech_detected = False
-        
-        # Process all complete frames in buffer
-        while len(self.audio_buffer) >= self.frame_size:
-            # Extract 30ms frame
-            frame = np.array([self.audio_buffer.popleft() for _ in range(self.frame_size)])
-            frame_bytes = frame.tobytes()
-            
+        self.events = []
+        self.features = FrameFeatures.empty()
+
+        num_frames = self.staged_samples // self.frame_size
+        if num_frames == 0:
+            return speech_detected
+
+        # Byte view over the staging area: each 30ms frame is a slice of it,
+        # handed to webrtcvad without building any intermediate arrays
+        staged_bytes = memoryview(self.staging).cast('B')
+        decisions = []
+        for i in range(num_frames):
+            start = i * self.frame_bytes
+            frame_bytes = staged_bytes[start:start + self.frame_bytes]
+
             # Check if frame contains speech
             try:
                 is_speech = self.vad.is_speech(frame_bytes, self.sample_rate)
                 self.speech_frames.append(is_speech)
-                
+
                 if is_speech:
                     speech_detected = True
-                    
+
             except Exception as e:
                 print(f"VAD error: {e}")
+                is_speech = False
                 self.speech_frames.append(False)
-        
+            decisions.append(is_speech)
+
+        if speech_detected or self.segment is not None:
+            # Level features for every frame in one vectorized pass
+            features = self.features = self.feature_extractor.compute(self.get_frames(), spectral=False)
+            rms, peak = features.rms.tolist(), features.peak.tolist()
+            for i, is_speech in enumerate(decisions):
+                frame_end = (self.frames_processed + i + 1) * self.frame_size
+                self._update_segment(frame_end, is_speech, rms[i], peak[i])
+        else:
+            # Silence outside a segment: no stage reads features, skip them
+            self.speech_run = 0
+
+        staged_bytes.release()
+        self.frames_processed += num_frames
+
+        # Carry leftover samples over to the front of the staging area
+        consumed = num_frames * self.frame_size
+        leftover = self.staged_samples - consumed
+        if leftover:
+            self.staging[:leftover] = self.staging[consumed:self.staged_samples]
+        self.staged_samples = leftover
+
         return speech_detected
-    
+
+    def _update_segment(self, frame_end, is_speech, rms, peak):
+        """Advance the segment state machine by one frame"""
+        if self.segment is None:
+            if not is_speech:
+                self.speech_run = 0
+                return
+            self.speech_run += 1
+            if self.speech_run < self.start_frames:
+                return
+            # Backdate the start to the first speech frame, plus pre-roll
+            first_speech = frame_end - self.speech_run * self.frame_size
+            start = max(first_speech - self.pre_roll_samples, self.last_segment_end, 0)
+            self._start_segment(start, 0)
+            self.speech_run = 0
+
+        self.segment.add_frame(frame_end, is_speech, rms, peak, self.frame_size)
+        self.silence_run = 0 if is_speech else self.silence_run + 1
+
+        if self.silence_run >= self.hangover_frames:
+            self._end_segment(frame_end, 0)
+        elif frame_end - self.segment.start_offset >= self.max_segment_samples:
+            self._end_segment(frame_end, SPLIT)
+            if is_speech:
+                self._start_segment(frame_end, CONTINUED)
+
+    def _flags(self, segment):
+        return LOUD if segment.rms > self.loud_rms else 0
+
+    def _start_segment(self, offset, flags):
+        self.segment = SegmentStats(offset, self.sample_rate)
+        self.silence_run = 0
+        self.segments_started += 1
+        self.events.append(SpeechEvent(SPEECH_START | flags, offset, self.segment))
+
+    def _end_segment(self, offset, flags):
+        segment = self.segment
+        segment.end_offset = offset
+        flags |= self._flags(segment)
+        if offset - segment.start_offset < self.min_segment_samples:
+            flags |= SHORT
+        self.segment = None
+        self.silence_run = 0
+        self.last_segment_end = offset
+        self.segments_ended += 1
+        self.events.append(SpeechEvent(SPEECH_END | flags, offset, segment))
+
+    def flush(self):
+        """End the open segment (e.g. the stream stopped); returns the events"""
+        self.events = []
+        if self.segment is not None:
+            self._end_segment(self.segment.end_offset, FLUSHED)
+        return self.events
+
+    def get_frames(self):
+        """Strided (num_frames, frame_size) view of the complete frames currently staged"""
+        num_frames = self.staged_samples // self.frame_size
+        return self.staging[:num_frames * self.frame_size].reshape(num_frames, self.frame_size)
+
     def get_speech_confidence(self):
         """Get confidence that recent audio contains speech (0-1)"""
         if len(self.speech_frames) == 0: